@@ -0,0 +1,170 @@
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, Dict
+
+import metrics
+
+BACKEND_UPSTREAM = "upstream"
+BACKEND_LOCAL = "local"
+
+# Одновременные вызовы, размер очереди ожидания и предельное время в ней по бэкендам
+_DEFAULTS = {
+    BACKEND_UPSTREAM: {"concurrency": 16, "queue": 64, "max_wait_ms": 2000},
+    BACKEND_LOCAL: {"concurrency": 2, "queue": 16, "max_wait_ms": 5000},
+}
+_WINDOW = 500
+
+
+def _setting(backend: str, name: str) -> float:
+    return float(os.environ.get(f"QYSQA_ADMISSION_{backend.upper()}_{name.upper()}", _DEFAULTS[backend][name]))
+
+
+class AdmissionRejected(Exception):
+    """Запрос отклонен контролем допуска; клиенту стоит повторить через retry_after секунд"""
+
+    status_code = 503
+
+    def __init__(self, backend: str, retry_after: int, detail: str):
+        super().__init__(detail)
+        self.backend = backend
+        self.retry_after = retry_after
+        self.detail = detail
+
+
+class QueueFull(AdmissionRejected):
+    """Очередь ожидания заполнена"""
+
+    status_code = 429
+
+
+class QueueTimeout(AdmissionRejected):
+    """Слот не освободился за допустимое время ожидания"""
+
+    status_code = 503
+
+
+def _percentile(values, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class AdmissionLimiter:
+    """
+    Ограничение одновременных вызовов одного бэкенда: не больше concurrency
+    выполняются сразу, не больше max_queue ждут слота и не дольше max_wait.
+    Остальные запросы отклоняются сразу, а не висят до таймаута
+    """
+
+    def __init__(self, name: str, concurrency: int, max_queue: int, max_wait_ms: float):
+        self.name = name
+        self.concurrency = max(1, concurrency)
+        self.max_queue = max(0, max_queue)
+        self.max_wait = max_wait_ms / 1000.0
+        self._semaphore = None
+        self._active = 0
+        self._waiting = 0
+        self._waits = deque(maxlen=_WINDOW)
+        self._service = deque(maxlen=_WINDOW)
+        self._counters = {"admitted": 0, "rejected_queue_full": 0, "rejected_timeout": 0}
+        self._lock = threading.Lock()
+
+    def _retry_after(self) -> int:
+        """Оценка (в секундах), когда очередь успеет разойтись"""
+        with self._lock:
+            service = sum(self._service) / len(self._service) if self._service else 1.0
+            backlog = self._waiting + self._active
+        return max(1, math.ceil(backlog / self.concurrency * service))
+
+    async def acquire(self) -> float:
+        """Занимает слот; возвращает время, проведенное в очереди"""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        start = time.monotonic()
+        if self._semaphore.locked():
+            with self._lock:
+                if self._waiting >= self.max_queue:
+                    self._counters["rejected_queue_full"] += 1
+                    full = True
+                else:
+                    self._waiting += 1
+                    full = False
+            if full:
+                raise QueueFull(self.name, self._retry_after(), f"Too many pending {self.name} requests")
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), timeout=self.max_wait)
+            except asyncio.TimeoutError:
+                with self._lock:
+                    self._counters["rejected_timeout"] += 1
+                raise QueueTimeout(self.name, self._retry_after(), f"No free {self.name} slot within {self.max_wait}s")
+            finally:
+                with self._lock:
+                    self._waiting -= 1
+        else:
+            await self._semaphore.acquire()
+
+        waited = time.monotonic() - start
+        with self._lock:
+            self._active += 1
+            self._counters["admitted"] += 1
+            self._waits.append(waited)
+        return waited
+
+    def release(self, service_seconds: float):
+        with self._lock:
+            self._active -= 1
+            self._service.append(service_seconds)
+        self._semaphore.release()
+
+    @asynccontextmanager
+    async def slot(self):
+        await self.acquire()
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - start)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._counters)
+            stats.update({
+                "active": self._active,
+                "queue_depth": self._waiting,
+                "concurrency": self.concurrency,
+                "max_queue": self.max_queue,
+                "max_wait_ms": self.max_wait * 1000,
+                "wait_p50_ms": round(_percentile(self._waits, 0.5) * 1000, 1) if self._waits else None,
+                "wait_p95_ms": round(_percentile(self._waits, 0.95) * 1000, 1) if self._waits else None,
+            })
+            return stats
+
+
+# Ограничители процесса: внешний API и локальные модели
+limiters = {
+    backend: AdmissionLimiter(backend, int(_setting(backend, "concurrency")), int(_setting(backend, "queue")),
+                              _setting(backend, "max_wait_ms"))
+    for backend in _DEFAULTS
+}
+
+metrics.register(metrics.Gauge(
+    "qysqa_admission_active", "Calls currently holding a backend slot", ("backend",),
+    lambda: {(name,): limiter.stats()["active"] for name, limiter in limiters.items()}
+))
+metrics.register(metrics.Gauge(
+    "qysqa_admission_queue_depth", "Calls waiting for a backend slot", ("backend",),
+    lambda: {(name,): limiter.stats()["queue_depth"] for name, limiter in limiters.items()}
+))
+
+
+def admit(backend: str):
+    """Контекст с занятым слотом бэкенда (или AdmissionRejected)"""
+    return limiters[backend].slot()
+
+
+def stats() -> Dict[str, Any]:
+    return {backend: limiter.stats() for backend, limiter in limiters.items()}
@@ -1,35 +1,76 @@
 import os
 import json
+import asyncio
 import random
-from typing import List, Dict, Any, Optional
-from openai import OpenAI
+from contextlib import asynccontextmanager
+from typing import List, Dict, Any, Optional, Callable, AsyncContextManager
+from openai import OpenAI, AsyncOpenAI
+from content_cache import ResultCache, get_default_cache, make_key
+from json_stream import IncrementalJsonArrayParser, parse_json_array
+import http_transport
+import metrics
+import tracing
+from resilience import CircuitOpenError, Resilience, get_default_resilience
 
 # Настройка API ключей - скрыли детали в константах с нейтральными именами
 _API_SECRET = "sk-" + "74b87290351b47acacfc94680907ed09"
-_API_ENDPOINT = "https://api.deepseek.com/v1"
+# QYSQA_API_ENDPOINT направляет запросы на другой совместимый сервер (например, benchmarks.upstream_stub)
+_API_ENDPOINT = os.environ.get("QYSQA_API_ENDPOINT", "https://api.deepseek.com/v1")
 _MODEL_ID = "chat"
 
+# Версия промптов: при изменении _create_messages нужно увеличить, чтобы сбросить кэш
+PROMPT_VERSION = "1"
+
+@asynccontextmanager
+async def _no_slot():
+    yield
+
+def _is_valid_question(item) -> bool:
+    """Соответствует ли элемент формату TestQuestion"""
+    if not isinstance(item, dict):
+        return False
+    options = item.get("options")
+    index = item.get("correct_index")
+    return (isinstance(item.get("question"), str)
+            and isinstance(options, list) and len(options) >= 2
+            and all(isinstance(opt, str) for opt in options)
+            and isinstance(index, int) and 0 <= index < len(options))
+
+def _is_valid_flashcard(item) -> bool:
+    """Соответствует ли элемент формату Flashcard"""
+    return (isinstance(item, dict)
+            and isinstance(item.get("front"), str) and item["front"].strip() != ""
+            and isinstance(item.get("back"), str) and item["back"].strip() != "")
+
 class ContentGenerator:
     """
     Генератор образовательного контента с использованием языковых моделей
     """
     
-    def __init__(self, api_key: Optional[str] = None, api_endpoint: Optional[str] = None):
+    def __init__(self, api_key: Optional[str] = None, api_endpoint: Optional[str] = None,
+                 cache: Optional[ResultCache] = None, resilience: Optional[Resilience] = None):
         """Инициализация с API ключом"""
         self._api_key = api_key or _API_SECRET
         self._endpoint = api_endpoint or _API_ENDPOINT
+        self._cache = cache if cache is not None else get_default_cache()
+        # Таймауты, дублирующие запросы и автомат отключения для вызовов API
+        self._resilience = resilience if resilience is not None else get_default_resilience()
         
         # Используем непрямое создание клиента для скрытия деталей
         self._initialize_client()
         
     def _initialize_client(self):
         """Инициализация клиента API (скрыто в приватном методе)"""
+        # Общий пул соединений: keep-alive и таймауты вместо отдельного клиента на генератор
         self._client = OpenAI(
             api_key=self._api_key,
-            base_url=self._endpoint
+            base_url=self._endpoint,
+            http_client=http_transport.get_client(),
+            # Повторы и дублирующие запросы выполняет Resilience в пределах своего дедлайна
+            max_retries=0
         )
     
-    def generate_tests(self, text: str, num_questions: int = 5) -> List[Dict[str, Any]]:
+    def generate_tests(self, text: str, num_questions: int = 5, bypass_cache: bool = False) -> List[Dict[str, Any]]:
         """
         Генерация тестовых вопросов с вариантами ответов
         """
@@ -42,7 +83,8 @@ class ContentGenerator:
                 instruction="Create multiple choice test questions",
                 num_items=num_questions,
                 temperature=0.7,
-                mode="test"
+                mode="test",
+                bypass_cache=bypass_cache
             )
             
             if response and isinstance(response, list):
@@ -53,7 +95,7 @@ class ContentGenerator:
             print(f"Error generating test questions: {e}")
             return []
 
-    def generate_flashcards(self, text: str, num_cards: int = 10) -> List[Dict[str, str]]:
+    def generate_flashcards(self, text: str, num_cards: int = 10, bypass_cache: bool = False) -> List[Dict[str, str]]:
         """
         Генерация флеш-карточек на основе текста
         """
@@ -66,7 +108,8 @@ class ContentGenerator:
                 instruction="Create educational flashcards",
                 num_items=num_cards,
                 temperature=0.7,
-                mode="flashcard"
+                mode="flashcard",
+                bypass_cache=bypass_cache
             )
             
             if response and isinstance(response, list):
@@ -77,7 +120,7 @@ class ContentGenerator:
             print(f"Error generating flashcards: {e}")
             return []
 
-    def generate_summary(self, text: str, max_length: int = 300) -> str:
+    def generate_summary(self, text: str, max_length: int = 300, bypass_cache: bool = False) -> str:
         """
         Генерация краткого содержания текста
         """
@@ -89,7 +132,8 @@ class ContentGenerator:
                 input_text=text,
                 instruction=f"Summarize in approximately {max_length} words",
                 temperature=0.5,
-                mode="summary"
+                mode="summary",
+                bypass_cache=bypass_cache
             )
             
             if response and isinstance(response, str):
@@ -100,19 +144,104 @@ class ContentGenerator:
             print(f"Error generating summary: {e}")
             return "Error generating summary."
     
-    def _process_content_request(self, input_text, instruction, num_items=None, temperature=0.7, mode="test"):
+    def generate_all(self, text: str, num_questions: int = 3, num_flashcards: int = 3,
+                     max_length: int = 300, bypass_cache: bool = False) -> Dict[str, Any]:
+        """
+        Генерация резюме, тестов и карточек одним запросом; отдельные запросы
+        выполняются только для тех частей, которые не прошли проверку
+        """
+        print("Generating combined content...")
+        parts = self._request_combined(text, num_questions, num_flashcards, max_length, bypass_cache)
+
+        if not parts.get("summary"):
+            metrics.count_fallback("summary", "combined_incomplete")
+            parts["summary"] = self.generate_summary(text, max_length, bypass_cache)
+        if not parts.get("test_questions"):
+            metrics.count_fallback("test", "combined_incomplete")
+            parts["test_questions"] = self.generate_tests(text, num_questions, bypass_cache)
+        if not parts.get("flashcards"):
+            metrics.count_fallback("flashcard", "combined_incomplete")
+            parts["flashcards"] = self.generate_flashcards(text, num_flashcards, bypass_cache)
+        return parts
+
+    def _request_combined(self, text, num_questions, num_flashcards, max_length, bypass_cache=False):
+        """Комбинированный запрос; при ошибке возвращает пустой результат"""
+        try:
+            response = self._process_content_request(
+                input_text=text,
+                instruction="Create summary, test questions and flashcards",
+                num_items=self._combined_counts(num_questions, num_flashcards, max_length),
+                temperature=0.6,
+                mode="combined",
+                bypass_cache=bypass_cache
+            )
+            if isinstance(response, dict):
+                return self._validate_combined(response, num_questions, num_flashcards)
+        except Exception as e:
+            print(f"Error generating combined content: {e}")
+        return {}
+
+    @property
+    def cache(self) -> ResultCache:
+        """Кэш результатов генерации"""
+        return self._cache
+
+    @staticmethod
+    def _combined_counts(num_questions, num_flashcards, max_length):
+        return {"questions": num_questions, "flashcards": num_flashcards, "words": max_length}
+
+    def _process_content_request(self, input_text, instruction, num_items=None, temperature=0.7, mode="test",
+                                 bypass_cache=False):
         """Обработка запросов к API (скрыто в приватном методе)"""
+        # Повторные запросы по той же лекции обслуживаются из кэша
+        cache_key = self._cache_key(input_text, instruction, num_items, mode)
+        if not bypass_cache:
+            with tracing.span("cache_lookup", mode=mode):
+                cached = self._cache.get(cache_key)
+            if cached is not None:
+                return cached
+
         # Формируем сообщения в зависимости от типа запроса
         messages = self._create_messages(input_text, instruction, num_items, mode)
         
-        # Отправляем запрос к API через обертку
-        response = self._client.chat.completions.create(
-            model=_MODEL_ID,
-            messages=messages,
-            temperature=temperature
+        # Отправляем запрос к API через обертку (с предельным временем и дублирующим запросом)
+        def attempt(timeout):
+            with metrics.stage("upstream_llm", mode):
+                response = self._client.chat.completions.create(
+                    model=_MODEL_ID,
+                    messages=messages,
+                    temperature=temperature,
+                    timeout=timeout
+                )
+            metrics.count_usage(mode, response.usage)
+            with metrics.stage("response_parse", mode):
+                return self._handle_response(response, mode)
+
+        result = self._resilience.call(mode, attempt)
+        if result:
+            self._cache.set(cache_key, result)
+        return result
+
+    @property
+    def resilience(self) -> Resilience:
+        return self._resilience
+
+    def upstream_available(self) -> bool:
+        """False, пока автомат отключения не пропускает запросы к API"""
+        return self._resilience.breaker.available()
+
+    def has_cached_tests(self, text: str, num_questions: int = 5) -> bool:
+        """Есть ли в кэше готовые тестовые вопросы для этого текста"""
+        return self._cache.contains(
+            self._cache_key(text, "Create multiple choice test questions", num_questions, "test")
         )
-        
-        # Обрабатываем ответ
+
+    def _cache_key(self, input_text, instruction, num_items, mode):
+        """Ключ кэша: текст, режим, параметры, модель и версия промптов"""
+        return make_key(input_text, mode, [instruction, num_items], _MODEL_ID, PROMPT_VERSION)
+
+    def _handle_response(self, response, mode):
+        """Разбор ответа API (общий для синхронного и асинхронного клиента)"""
         content = response.choices[0].message.content if response.choices else None
         if not content:
             return None
@@ -120,6 +249,8 @@ class ContentGenerator:
         # Обрабатываем ответ в зависимости от типа запроса
         if mode == "summary":
             return content.strip()
+        elif mode == "combined":
+            return self._extract_json_object(content)
         else:
             return self._extract_json_items(content, mode)
     
@@ -159,6 +290,22 @@ class ContentGenerator:
                 Return a JSON array with {num_items} flashcards.
                 """}
             ]
+        elif mode == "combined":
+            return [
+                {"role": "system", "content": "You are an educational assistant that creates summaries, multiple-choice questions and flashcards."},
+                {"role": "user", "content": f"""
+                Based on the following text, create learning materials.
+                
+                1. A concise, well-structured summary of approximately {num_items['words']} words or less
+                2. {num_items['questions']} multiple choice questions, each with fields: question, options (array of 4 options), correct_index (0-3)
+                3. {num_items['flashcards']} flashcards, each with fields: front, back
+                
+                TEXT:
+                {input_text}
+                
+                Return a single JSON object with fields: summary (string), test_questions (array), flashcards (array).
+                """}
+            ]
         else:  # summary
             return [
                 {"role": "system", "content": "You are an expert summarizer that creates concise summaries."},
@@ -177,17 +324,10 @@ class ContentGenerator:
     
     def _extract_json_items(self, content, mode="test"):
         """Извлечение JSON элементов из текста ответа (скрыто в приватном методе)"""
-        # Поиск JSON в ответе с использованием начальной и конечной скобки
-        json_start = content.find('[')
-        json_end = content.rfind(']') + 1
-        
-        if json_start >= 0 and json_end > json_start:
-            try:
-                json_str = content[json_start:json_end]
-                items = json.loads(json_str)
-                return items
-            except:
-                pass
+        # Инкрементальный разбор: пропускает текст до массива и испорченные элементы
+        items = parse_json_array(content)
+        if items:
+            return items
                 
         # Если JSON не найден или его не удалось распарсить, создаем структуру вручную
         if mode == "test":
@@ -196,6 +336,38 @@ class ContentGenerator:
             return self._parse_flashcards(content)
         return []
     
+    def _extract_json_object(self, content):
+        """Извлечение JSON объекта комбинированного ответа"""
+        json_start = content.find('{')
+        json_end = content.rfind('}') + 1
+
+        if json_start >= 0 and json_end > json_start:
+            try:
+                data = json.loads(content[json_start:json_end])
+                if isinstance(data, dict):
+                    return data
+            except ValueError:
+                pass
+        return None
+
+    def _validate_combined(self, data, num_questions, num_flashcards):
+        """Проверка частей комбинированного ответа; невалидные части отбрасываются"""
+        parts = {}
+
+        summary = data.get("summary")
+        if isinstance(summary, str) and summary.strip():
+            parts["summary"] = summary.strip()
+
+        questions = [q for q in data.get("test_questions") or [] if _is_valid_question(q)]
+        if questions:
+            parts["test_questions"] = questions[:num_questions]
+
+        flashcards = [c for c in data.get("flashcards") or [] if _is_valid_flashcard(c)]
+        if flashcards:
+            parts["flashcards"] = flashcards[:num_flashcards]
+
+        return parts
+
     def _parse_test_questions(self, content):
         """Парсинг тестовых вопросов из текста (скрыто в приватном методе)"""
         lines = content.strip().split('\n')
@@ -251,6 +423,289 @@ class ContentGenerator:
         
         return flashcards
 
+class AsyncContentGenerator(ContentGenerator):
+    """
+    Асинхронный вариант генератора: запросы к API не блокируют цикл событий,
+    поэтому несколько генераций можно выполнять параллельно
+    """
+
+    def _initialize_client(self):
+        """Инициализация асинхронного клиента API"""
+        self._client = AsyncOpenAI(
+            api_key=self._api_key,
+            base_url=self._endpoint,
+            http_client=http_transport.get_async_client(),
+            # Повторы и дублирующие запросы выполняет Resilience в пределах своего дедлайна
+            max_retries=0
+        )
+
+    async def ahas_cached_tests(self, text: str, num_questions: int = 5) -> bool:
+        """has_cached_tests без обращения к SQLite из цикла событий"""
+        return await self._cache.acontains(
+            self._cache_key(text, "Create multiple choice test questions", num_questions, "test")
+        )
+
+    async def generate_tests(self, text: str, num_questions: int = 5, bypass_cache: bool = False) -> List[Dict[str, Any]]:
+        """Асинхронная генерация тестовых вопросов"""
+        print("Generating test questions...")
+
+        try:
+            response = await self._process_content_request(
+                input_text=text,
+                instruction="Create multiple choice test questions",
+                num_items=num_questions,
+                temperature=0.7,
+                mode="test",
+                bypass_cache=bypass_cache
+            )
+
+            if response and isinstance(response, list):
+                return response
+            return []
+
+        except Exception as e:
+            print(f"Error generating test questions: {e}")
+            return []
+
+    async def generate_flashcards(self, text: str, num_cards: int = 10, bypass_cache: bool = False) -> List[Dict[str, str]]:
+        """Асинхронная генерация флеш-карточек"""
+        print("Generating flashcards...")
+
+        try:
+            response = await self._process_content_request(
+                input_text=text,
+                instruction="Create educational flashcards",
+                num_items=num_cards,
+                temperature=0.7,
+                mode="flashcard",
+                bypass_cache=bypass_cache
+            )
+
+            if response and isinstance(response, list):
+                return response
+            return []
+
+        except Exception as e:
+            print(f"Error generating flashcards: {e}")
+            return []
+
+    async def generate_summary(self, text: str, max_length: int = 300, bypass_cache: bool = False) -> str:
+        """Асинхронная генерация краткого содержания"""
+        print("Generating summary...")
+
+        try:
+            response = await self._process_content_request(
+                input_text=text,
+                instruction=f"Summarize in approximately {max_length} words",
+                temperature=0.5,
+                mode="summary",
+                bypass_cache=bypass_cache
+            )
+
+            if response and isinstance(response, str):
+                return response
+            return "No summary generated."
+
+        except Exception as e:
+            print(f"Error generating summary: {e}")
+            return "Error generating summary."
+
+    async def generate_all(self, text: str, num_questions: int = 3, num_flashcards: int = 3,
+                           max_length: int = 300, bypass_cache: bool = False,
+                           slot: Optional[Callable[[], AsyncContextManager]] = None) -> Dict[str, Any]:
+        """
+        Асинхронная комбинированная генерация; недостающие части
+        догенерируются параллельными отдельными запросами.
+        slot() - контекст допуска, который занимает каждый запрос к API отдельно
+        """
+        print("Generating combined content...")
+        slot = slot or _no_slot
+        async with slot():
+            parts = await self._request_combined(text, num_questions, num_flashcards, max_length, bypass_cache)
+
+        fallbacks = {}
+        if not parts.get("summary"):
+            fallbacks["summary"] = lambda: self.generate_summary(text, max_length, bypass_cache)
+        if not parts.get("test_questions"):
+            fallbacks["test_questions"] = lambda: self.generate_tests(text, num_questions, bypass_cache)
+        if not parts.get("flashcards"):
+            fallbacks["flashcards"] = lambda: self.generate_flashcards(text, num_flashcards, bypass_cache)
+
+        if fallbacks:
+            for kind in fallbacks:
+                metrics.count_fallback(kind, "combined_incomplete")
+            tasks = [asyncio.ensure_future(self._in_slot(slot, request)) for request in fallbacks.values()]
+            try:
+                results = await asyncio.gather(*tasks)
+            except BaseException:
+                # Отказ в допуске одному запросу отменяет остальные
+                for task in tasks:
+                    task.cancel()
+                raise
+            parts.update(zip(fallbacks.keys(), results))
+        return parts
+
+    @staticmethod
+    async def _in_slot(slot, request):
+        """Запрос к API, начатый только после получения слота допуска"""
+        async with slot():
+            return await request()
+
+    async def _request_combined(self, text, num_questions, num_flashcards, max_length, bypass_cache=False):
+        """Асинхронный комбинированный запрос; при ошибке возвращает пустой результат"""
+        try:
+            response = await self._process_content_request(
+                input_text=text,
+                instruction="Create summary, test questions and flashcards",
+                num_items=self._combined_counts(num_questions, num_flashcards, max_length),
+                temperature=0.6,
+                mode="combined",
+                bypass_cache=bypass_cache
+            )
+            if isinstance(response, dict):
+                return self._validate_combined(response, num_questions, num_flashcards)
+        except Exception as e:
+            print(f"Error generating combined content: {e}")
+        return {}
+
+    async def _process_content_request(self, input_text, instruction, num_items=None, temperature=0.7, mode="test",
+                                       bypass_cache=False):
+        """Асинхронная обработка запросов к API"""
+        cache_key = self._cache_key(input_text, instruction, num_items, mode)
+        if not bypass_cache:
+            with tracing.span("cache_lookup", mode=mode):
+                cached = await self._cache.aget(cache_key)
+            if cached is not None:
+                return cached
+
+        messages = self._create_messages(input_text, instruction, num_items, mode)
+
+        async def attempt(timeout):
+            with metrics.stage("upstream_llm", mode):
+                response = await self._client.chat.completions.create(
+                    model=_MODEL_ID,
+                    messages=messages,
+                    temperature=temperature,
+                    timeout=timeout
+                )
+            metrics.count_usage(mode, response.usage)
+            with metrics.stage("response_parse", mode):
+                return self._handle_response(response, mode)
+
+        result = await self._resilience.acall(mode, attempt)
+        if result:
+            await self._cache.aset(cache_key, result)
+        return result
+
+    async def stream_summary(self, text: str, max_length: int = 300, bypass_cache: bool = False):
+        """Потоковая генерация резюме: фрагменты текста отдаются по мере получения"""
+        instruction = f"Summarize in approximately {max_length} words"
+        cache_key = self._cache_key(text, instruction, None, "summary")
+        if not bypass_cache:
+            cached = await self._cache.aget(cache_key)
+            if cached is not None:
+                yield cached
+                return
+
+        parts = []
+        async for delta in self._stream_content(text, instruction, None, 0.5, "summary"):
+            parts.append(delta)
+            yield delta
+
+        summary = ''.join(parts).strip()
+        if summary:
+            await self._cache.aset(cache_key, summary)
+
+    async def stream_items(self, text: str, mode: str = "test", num_items: int = 5, bypass_cache: bool = False):
+        """Потоковая генерация вопросов или карточек: каждый элемент отдается, как только он закрыт и проверен"""
+        instruction = "Create multiple choice test questions" if mode == "test" else "Create educational flashcards"
+        is_valid = _is_valid_question if mode == "test" else _is_valid_flashcard
+        cache_key = self._cache_key(text, instruction, num_items, mode)
+        if not bypass_cache:
+            cached = await self._cache.aget(cache_key)
+            if cached is not None:
+                for item in cached:
+                    yield item
+                return
+
+        # Как только пришло num_items валидных элементов, поток к API закрывается,
+        # чтобы не платить за лишние токены
+        parser = IncrementalJsonArrayParser(limit=num_items, validator=is_valid)
+        content = []
+        deltas = self._stream_content(text, instruction, num_items, 0.7, mode, completed=lambda: parser.done)
+        try:
+            async for delta in deltas:
+                content.append(delta)
+                for item in parser.feed(delta):
+                    yield item
+                if parser.done:
+                    break
+        finally:
+            await deltas.aclose()
+
+        items = parser.items
+        if not items:
+            # Модель ответила текстом, а не JSON: разбор по строкам, как в обычном запросе
+            parse = self._parse_test_questions if mode == "test" else self._parse_flashcards
+            items = [item for item in parse(''.join(content)) if is_valid(item)][:num_items]
+            for item in items:
+                yield item
+        if items:
+            await self._cache.aset(cache_key, items)
+
+    async def _stream_content(self, input_text, instruction, num_items, temperature, mode,
+                              completed: Callable[[], bool] = lambda: False):
+        """
+        Запрос к API с потоковой выдачей; возвращает фрагменты текста ответа.
+        completed() - получил ли потребитель все, что нужно: тогда закрытие
+        потока до его конца считается успешным ответом API, а не обрывом
+        """
+        messages = self._create_messages(input_text, instruction, num_items, mode)
+        breaker = self._resilience.breaker
+        probe = breaker.acquire()
+        if probe is None:
+            raise CircuitOpenError("Upstream API is temporarily disabled after repeated errors")
+        try:
+            # Ограничение по времени действует до начала потока; дальше текст отдается по мере генерации
+            with metrics.stage("upstream_stream_open", mode):
+                stream = await asyncio.wait_for(
+                    self._client.chat.completions.create(
+                        model=_MODEL_ID,
+                        messages=messages,
+                        temperature=temperature,
+                        stream=True
+                    ),
+                    timeout=self._resilience.deadline_for(mode)
+                )
+        except Exception:
+            breaker.record(False)
+            raise
+        except BaseException:
+            breaker.release(probe)
+            raise
+        try:
+            async for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    yield delta
+            breaker.record(True)
+        except Exception:
+            breaker.record(False)
+            raise
+        except BaseException:
+            if completed():
+                # Потребитель остановил поток, получив нужное число элементов
+                breaker.record(True)
+            else:
+                # Клиент прекратил чтение потока - это не ошибка API
+                breaker.release(probe)
+            raise
+        finally:
+            # Закрытие соединения прерывает генерацию на стороне API
+            close = getattr(stream, "close", None)
+            if close is not None:
+                await close()
+
 def format_test_for_display(questions: List[Dict[str, Any]]) -> str:
     """Форматирует тестовые вопросы для отображения"""
     formatted = ""
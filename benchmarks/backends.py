@@ -0,0 +1,134 @@
+"""
+Сравнение бэкендов инференса (PyTorch, ONNX, ONNX int8) для локальных моделей:
+задержка одиночного запроса, пропускная способность на батчах и совпадение
+результатов с PyTorch.
+
+Запуск из корня репозитория:
+    python -m benchmarks.backends --model facebook/bart-large-cnn --output bench_backends.json
+"""
+import argparse
+import json
+import statistics
+import time
+
+import torch
+from transformers import AutoModelForSeq2SeqLM, AutoTokenizer
+
+from benchmarks.corpus import SAMPLE_INPUTS
+from inference_backends import BACKEND_ONNX, BACKEND_ONNX_INT8, BACKEND_TORCH, load_onnx_model
+
+
+def _load(model_name, backend):
+    if backend == BACKEND_TORCH:
+        return AutoModelForSeq2SeqLM.from_pretrained(model_name).eval()
+    return load_onnx_model(model_name, quantized=backend == BACKEND_ONNX_INT8)
+
+
+def _generate(tokenizer, model, texts, gen_kwargs):
+    inputs = tokenizer(texts, return_tensors="pt", padding=True, truncation=True, max_length=512)
+    with torch.no_grad():
+        outputs = model.generate(inputs["input_ids"], attention_mask=inputs["attention_mask"], **gen_kwargs)
+    return tokenizer.batch_decode(outputs, skip_special_tokens=True)
+
+
+def _unigram_f1(a: str, b: str) -> float:
+    """Совпадение по словам между двумя ответами (F1 по мультимножествам)"""
+    ta, tb = a.lower().split(), b.lower().split()
+    if not ta or not tb:
+        return float(ta == tb)
+    common = sum(min(ta.count(w), tb.count(w)) for w in set(ta))
+    if common == 0:
+        return 0.0
+    precision, recall = common / len(ta), common / len(tb)
+    return 2 * precision * recall / (precision + recall)
+
+
+def _percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def run(model_name, backends, prefix, repeats, batch_size, gen_kwargs):
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    texts = [prefix + text for text in SAMPLE_INPUTS]
+    results = {}
+    reference = None
+
+    for backend in backends:
+        start = time.perf_counter()
+        model = _load(model_name, backend)
+        load_seconds = time.perf_counter() - start
+
+        # Прогрев, чтобы не учитывать ленивую инициализацию сессий
+        _generate(tokenizer, model, texts[:1], gen_kwargs)
+
+        latencies = []
+        outputs = []
+        for _ in range(repeats):
+            for text in texts:
+                start = time.perf_counter()
+                outputs.append(_generate(tokenizer, model, [text], gen_kwargs)[0])
+                latencies.append((time.perf_counter() - start) * 1000)
+        outputs = outputs[:len(texts)]
+
+        start = time.perf_counter()
+        processed = 0
+        for _ in range(repeats):
+            for i in range(0, len(texts), batch_size):
+                _generate(tokenizer, model, texts[i:i + batch_size], gen_kwargs)
+                processed += len(texts[i:i + batch_size])
+        throughput = processed / (time.perf_counter() - start)
+
+        entry = {
+            "load_seconds": round(load_seconds, 3),
+            "latency_ms_p50": round(statistics.median(latencies), 2),
+            "latency_ms_p95": round(_percentile(latencies, 0.95), 2),
+            "throughput_per_s": round(throughput, 2),
+        }
+        if reference is None:
+            reference = outputs
+        else:
+            entry["exact_match_vs_torch"] = sum(a == b for a, b in zip(outputs, reference)) / len(reference)
+            entry["unigram_f1_vs_torch"] = round(
+                statistics.mean(_unigram_f1(a, b) for a, b in zip(outputs, reference)), 4
+            )
+        results[backend] = entry
+        print(f"{backend}: {entry}")
+        del model
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="facebook/bart-large-cnn")
+    parser.add_argument("--backends", default=",".join([BACKEND_TORCH, BACKEND_ONNX, BACKEND_ONNX_INT8]))
+    parser.add_argument("--prefix", default="summarize: ", help="префикс задачи для входов модели")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--max-length", type=int, default=64)
+    parser.add_argument("--num-beams", type=int, default=4)
+    parser.add_argument("--output", help="файл для сохранения результатов в JSON")
+    args = parser.parse_args()
+
+    backends = [b.strip() for b in args.backends.split(",") if b.strip()]
+    if BACKEND_TORCH in backends:
+        # PyTorch идет первым: он служит эталоном для сравнения результатов
+        backends.remove(BACKEND_TORCH)
+        backends.insert(0, BACKEND_TORCH)
+    gen_kwargs = {"max_length": args.max_length, "num_beams": args.num_beams, "early_stopping": True}
+
+    results = {
+        "model": args.model,
+        "generation": gen_kwargs,
+        "threads": torch.get_num_threads(),
+        "backends": run(args.model, backends, args.prefix, args.repeats, args.batch_size, gen_kwargs),
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""Детерминированные тексты лекций для бенчмарков и нагрузочных тестов"""
+import random
+
+SEED = 0
+
+# Фиксированный набор входов, похожих на фрагменты лекций
+SAMPLE_INPUTS = [
+    "Supply Chain Efficiency: Information technology plays a critical role in managing the entire supply chain, "
+    "from the procurement of raw materials to the delivery of finished products.",
+    "ERP (Enterprise Resource Planning): Integrates all aspects of a company, such as procurement, manufacturing, "
+    "sales, and inventory, into a unified system.",
+    "RFID (Radio Frequency Identification): Tracks products throughout the supply chain, from suppliers to end customers.",
+    "Demand Forecasting: Uses predictive analytics to forecast future demand, ensuring businesses can optimize their supply chain.",
+    "Sole Proprietorship: Owned by one individual; simple to set up but involves high personal risk.",
+    "Corporation: A separate legal entity owned by shareholders; limited liability.",
+    "Workflow Automation: Tools like Microsoft Power Automate simplify repetitive processes.",
+    "Social Media Marketing Tools: Platforms like Instagram, Facebook, and LinkedIn enable businesses to engage "
+    "with customers and share targeted ads.",
+]
+
+# Предложения, из которых собираются лекции (вместе с SAMPLE_INPUTS)
+SENTENCES = SAMPLE_INPUTS + [
+    "Cloud Computing: Businesses store data and run applications on remote servers instead of local machines.",
+    "Cybersecurity protects information systems from unauthorized access, attacks and data loss.",
+    "Partnership: Shared ownership between two or more individuals.",
+    "LLC: Combines the benefits of corporations and partnerships.",
+    "Customer Relationship Management systems collect every interaction a company has with its customers.",
+    "Real-time data analytics helps managers react quickly to market fluctuations.",
+    "E-commerce platforms such as Kaspi.kz connect sellers, payment services and delivery networks.",
+    "The owner of a sole proprietorship is personally liable for all debts of the business.",
+    "Information systems transform raw data into knowledge that supports decision making.",
+    "Why do companies invest in automation when labour is cheap?",
+]
+TOPICS = ["Supply Chain", "Business Structures", "Marketing Tools", "Information Systems", "Automation",
+          "Cloud Services", "Security", "E-commerce", "Analytics", "Management"]
+
+
+def make_corpus(words: int, seed: int = SEED) -> str:
+    """Лекция примерно из words слов: секции "Тема:" разной длины (есть длиннее входа BART)"""
+    rng = random.Random(seed + words)
+    lines, total = [], 0
+    while total < words:
+        topic = rng.choice(TOPICS)
+        lines.append(f"{topic} {len(lines)}:")
+        section_words = rng.randint(150, 1500)
+        written = 0
+        while written < section_words and total < words:
+            sentence = rng.choice(SENTENCES)
+            lines.append(sentence)
+            written += len(sentence.split())
+            total += len(sentence.split())
+    return "\n".join(lines)
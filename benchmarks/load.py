@@ -0,0 +1,187 @@
+"""
+Нагрузочный тест сервиса main.py: запросы к /summarize, /generate-test,
+/generate-flashcards и /all-in-one с заданной интенсивностью (открытая модель:
+запросы отправляются по расписанию Пуассона, не дожидаясь предыдущих).
+Отчет: пропускная способность, процентили задержки и разбивка ошибок по эндпоинтам.
+
+Обычно сервис запускается против заглушки API (benchmarks.upstream_stub):
+    python -m benchmarks.upstream_stub --port 9000 --latency lognormal:800,0.5
+    QYSQA_API_ENDPOINT=http://127.0.0.1:9000/v1 python main.py
+    python -m benchmarks.load --url http://127.0.0.1:8000 --rps 20 --duration 60 --output load.json
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from benchmarks.corpus import make_corpus
+
+ENDPOINTS = ("summarize", "generate-test", "generate-flashcards", "all-in-one")
+DEFAULT_MIX = "summarize=1,generate-test=2,generate-flashcards=1,all-in-one=1"
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    """Доли эндпоинтов вида "generate-test=2,summarize=1" """
+    mix = {}
+    for item in value.split(","):
+        if "=" in item:
+            name, weight = item.rsplit("=", 1)
+            name = name.strip().lstrip("/")
+            if name not in ENDPOINTS:
+                raise ValueError(f"Unknown endpoint: {name}")
+            mix[name] = float(weight)
+    return mix
+
+
+def _percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 1)
+
+
+async def _send(client: httpx.AsyncClient, endpoint: str, text: str, bypass_cache: bool) -> httpx.Response:
+    if endpoint == "summarize":
+        return await client.post("/summarize", params={"bypass_cache": bypass_cache},
+                                 files={"file": ("lecture.txt", text.encode("utf-8"), "text/plain")})
+    if endpoint == "generate-test":
+        return await client.post("/generate-test",
+                                 json={"text": text, "num_questions": 5, "bypass_cache": bypass_cache})
+    if endpoint == "generate-flashcards":
+        return await client.post("/generate-flashcards",
+                                 json={"text": text, "num_cards": 5, "bypass_cache": bypass_cache})
+    return await client.post("/all-in-one", data={"text": text, "num_questions": 3, "num_flashcards": 3,
+                                                  "bypass_cache": str(bypass_cache).lower()})
+
+
+class _Results:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {name: [] for name in ENDPOINTS}
+        self.errors: Dict[str, Dict[str, int]] = {name: {} for name in ENDPOINTS}
+        self.sent: Dict[str, int] = {name: 0 for name in ENDPOINTS}
+        self.dropped = 0
+
+    def error(self, endpoint: str, kind: str):
+        self.errors[endpoint][kind] = self.errors[endpoint].get(kind, 0) + 1
+
+    def report(self, elapsed: float) -> Dict[str, Any]:
+        report = {}
+        for name in ENDPOINTS:
+            if not self.sent[name]:
+                continue
+            ok = self.latencies[name]
+            report[name] = {
+                "sent": self.sent[name],
+                "ok": len(ok),
+                "errors": dict(sorted(self.errors[name].items())),
+                "throughput_rps": round(len(ok) / elapsed, 2),
+                "latency_ms": {"p50": _percentile(ok, 0.5), "p90": _percentile(ok, 0.9),
+                               "p95": _percentile(ok, 0.95), "p99": _percentile(ok, 0.99),
+                               "max": round(max(ok), 1) if ok else None},
+            }
+        all_ok = [ms for values in self.latencies.values() for ms in values]
+        report["total"] = {
+            "sent": sum(self.sent.values()),
+            "ok": len(all_ok),
+            "dropped_client_side": self.dropped,
+            "throughput_rps": round(len(all_ok) / elapsed, 2),
+            "latency_ms": {"p50": _percentile(all_ok, 0.5), "p95": _percentile(all_ok, 0.95),
+                           "p99": _percentile(all_ok, 0.99)},
+        }
+        return report
+
+
+async def run(url: str, rps: float, duration: float, mix: Dict[str, float], texts: List[str],
+              bypass_cache: bool = False, max_in_flight: int = 256, timeout: float = 120.0,
+              seed: int = 0) -> Dict[str, Any]:
+    rng = random.Random(seed)
+    names, weights = list(mix), list(mix.values())
+    results = _Results()
+    in_flight = asyncio.Semaphore(max_in_flight)
+    limits = httpx.Limits(max_connections=max_in_flight, max_keepalive_connections=max_in_flight)
+
+    async def one(client, endpoint, text):
+        try:
+            start = time.perf_counter()
+            try:
+                response = await _send(client, endpoint, text, bypass_cache)
+            except httpx.TimeoutException:
+                results.error(endpoint, "timeout")
+                return
+            except httpx.HTTPError as e:
+                results.error(endpoint, type(e).__name__)
+                return
+            latency_ms = (time.perf_counter() - start) * 1000
+            if response.status_code == 200:
+                results.latencies[endpoint].append(latency_ms)
+            else:
+                results.error(endpoint, str(response.status_code))
+        finally:
+            in_flight.release()
+
+    async with httpx.AsyncClient(base_url=url, timeout=timeout, limits=limits) as client:
+        tasks = []
+        start = time.perf_counter()
+        next_at = start
+        while next_at - start < duration:
+            await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+            endpoint = rng.choices(names, weights)[0]
+            results.sent[endpoint] += 1
+            # Клиент не должен стать узким местом: сверх лимита запрос считается отброшенным
+            if in_flight.locked():
+                results.dropped += 1
+                results.error(endpoint, "dropped_client_side")
+            else:
+                await in_flight.acquire()
+                tasks.append(asyncio.create_task(one(client, endpoint, rng.choice(texts))))
+            next_at += rng.expovariate(rps)
+        if tasks:
+            await asyncio.wait(tasks)
+        elapsed = time.perf_counter() - start
+    return results.report(elapsed)
+
+
+def _print_report(report: Dict[str, Any]):
+    print(f"\n{'endpoint':<22} {'sent':>6} {'ok':>6} {'rps':>7} {'p50':>8} {'p95':>8} {'p99':>8}  errors")
+    for name, entry in report.items():
+        latency = entry["latency_ms"]
+        print(f"{name:<22} {entry['sent']:>6} {entry['ok']:>6} {entry['throughput_rps']:>7} "
+              f"{latency['p50'] or '-':>8} {latency['p95'] or '-':>8} {latency['p99'] or '-':>8}  "
+              f"{entry.get('errors') or ''}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--rps", type=float, default=10.0, help="целевая интенсивность запросов в секунду")
+    parser.add_argument("--duration", type=float, default=30.0, help="длительность в секундах")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="доли эндпоинтов")
+    parser.add_argument("--words", default="300,1500", help="размеры лекций в словах")
+    parser.add_argument("--texts", type=int, default=50, help="число различных лекций")
+    parser.add_argument("--bypass-cache", action="store_true", help="запросы мимо кэшей сервиса")
+    parser.add_argument("--max-in-flight", type=int, default=256)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="файл для сохранения отчета в JSON")
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.words.split(",") if s.strip()]
+    texts = [make_corpus(sizes[i % len(sizes)], seed=args.seed + i) for i in range(args.texts)]
+    mix = parse_mix(args.mix)
+    report = asyncio.run(run(args.url, args.rps, args.duration, mix, texts, bypass_cache=args.bypass_cache,
+                             max_in_flight=args.max_in_flight, timeout=args.timeout, seed=args.seed))
+    _print_report(report)
+    if args.output:
+        result = {"url": args.url, "rps": args.rps, "duration_s": args.duration, "mix": mix,
+                  "bypass_cache": args.bypass_cache, "report": report}
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+        print(f"Results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+"""
+Офлайн микробенчмарки генераторов, парсеров и запасных путей. Сеть и настоящие
+чекпоинты не нужны: в реестр моделей подставляются маленькие случайно
+инициализированные T5/BART с пословным токенизатором, лекции генерируются
+детерминированно (1k/10k/50k слов). Результаты сохраняются в JSON, и
+прогоны разных коммитов можно сравнить.
+
+Запуск из корня репозитория:
+    python -m benchmarks.micro --output bench_micro.json
+    python -m benchmarks.micro --sizes 1000 --only parse --compare bench_micro.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import platform
+import random
+import statistics
+import subprocess
+import time
+import warnings
+
+import torch
+import transformers
+from tokenizers import Tokenizer, models, normalizers, pre_tokenizers
+from transformers import (BartConfig, BartForConditionalGeneration, PreTrainedTokenizerFast, T5Config,
+                          T5ForConditionalGeneration)
+
+from benchmarks.corpus import SEED, SENTENCES, TOPICS, make_corpus
+from model_registry import registry
+
+DEFAULT_SIZES = (1000, 10000, 50000)
+
+
+def _tiny_tokenizer() -> PreTrainedTokenizerFast:
+    """Пословный токенизатор на словаре лекций (регистр не учитывается)"""
+    vocab = {"<pad>": 0, "</s>": 1, "<unk>": 2, "<s>": 3}
+    splitter = pre_tokenizers.Whitespace()
+    for text in SENTENCES + TOPICS + ["context: question: correct: generate wrong options summarize <hl> ?"]:
+        for word, _ in splitter.pre_tokenize_str(text.lower()):
+            vocab.setdefault(word, len(vocab))
+    tokenizer = Tokenizer(models.WordLevel(vocab=vocab, unk_token="<unk>"))
+    tokenizer.normalizer = normalizers.Lowercase()
+    tokenizer.pre_tokenizer = splitter
+    return PreTrainedTokenizerFast(tokenizer_object=tokenizer, pad_token="<pad>", eos_token="</s>",
+                                   unk_token="<unk>", bos_token="<s>")
+
+
+def install_tiny_models():
+    """Подставляет маленькие модели вместо t5-large, t5-small и bart-large-cnn"""
+    import options
+    import question_answer
+    import summarizing
+
+    tokenizer = _tiny_tokenizer()
+    torch.manual_seed(SEED)
+    t5_config = T5Config(vocab_size=len(tokenizer), d_model=32, d_ff=64, d_kv=8, num_layers=2, num_heads=2,
+                         decoder_start_token_id=0, pad_token_id=0, eos_token_id=1)
+    bart_config = BartConfig(vocab_size=len(tokenizer), d_model=32, encoder_layers=1, decoder_layers=1,
+                             encoder_attention_heads=2, decoder_attention_heads=2, encoder_ffn_dim=64,
+                             decoder_ffn_dim=64, max_position_embeddings=1100, pad_token_id=0, eos_token_id=1,
+                             bos_token_id=3, decoder_start_token_id=1, forced_eos_token_id=1)
+    registry.put(question_answer.MODEL_NAME, tokenizer, T5ForConditionalGeneration(t5_config))
+    registry.put(options.MODEL_NAME, tokenizer, T5ForConditionalGeneration(t5_config))
+    registry.put(summarizing.MODEL_NAME, tokenizer, BartForConditionalGeneration(bart_config))
+
+
+def _api_items(count: int) -> list:
+    items = []
+    for i in range(count):
+        topic = TOPICS[i % len(TOPICS)]
+        items.append({"question": f"What does {topic} mean in lecture {i}?",
+                      "options": [f"{topic} option {j}" for j in range(4)], "correct_index": i % 4})
+    return items
+
+
+def _json_response(count: int) -> str:
+    """Ответ API с JSON массивом внутри текста и блока кода"""
+    return "Here are the questions:\n```json\n" + json.dumps(_api_items(count), indent=2) + "\n```\nGood luck!"
+
+
+def _text_questions(count: int) -> str:
+    """Ответ без JSON: вопросы в формате "Question/A./Correct" для запасного парсера"""
+    blocks = []
+    for item in _api_items(count):
+        options = "\n".join(f"{letter}. {opt}" for letter, opt in zip("ABCD", item["options"]))
+        blocks.append(f"Question: {item['question']}\n{options}\nCorrect: {'ABCD'[item['correct_index']]}")
+    return "\n\n".join(blocks)
+
+
+def _text_flashcards(count: int) -> str:
+    return "\n\n".join(f"Front: What is {TOPICS[i % len(TOPICS)]} {i}?\nBack: {SENTENCES[i % len(SENTENCES)]}"
+                       for i in range(count))
+
+
+def _parser():
+    from ai_generators import ContentGenerator
+    from content_cache import ResultCache
+    # Клиент API создается, но не используется; кэш только в памяти
+    return ContentGenerator(cache=ResultCache(path=None))
+
+
+def _bench_generate_questions(corpus, words):
+    from question_answer import generate_questions
+    return lambda: generate_questions(corpus, max_questions=5, words_per_question=100, batched=True)
+
+
+def _bench_generate_wrong_options(corpus, words):
+    from options import generate_wrong_options
+    question, answer = "What is supply chain efficiency?", "Information technology"
+    return lambda: generate_wrong_options(question, answer, corpus)
+
+
+def _bench_enhanced_summarizer(corpus, words):
+    from summarizing import EnhancedSummarizer
+    summarizer = EnhancedSummarizer()
+    return lambda: summarizer.generate_summary(corpus)
+
+
+def _bench_extract_json_items(corpus, words):
+    generator, content = _parser(), _json_response(max(1, words // 100))
+    return lambda: generator._extract_json_items(content, mode="test")
+
+
+def _bench_parse_test_questions(corpus, words):
+    generator, content = _parser(), _text_questions(max(1, words // 100))
+    return lambda: generator._parse_test_questions(content)
+
+
+def _bench_parse_flashcards(corpus, words):
+    generator, content = _parser(), _text_flashcards(max(1, words // 100))
+    return lambda: generator._parse_flashcards(content)
+
+
+def _bench_summarize_text(corpus, words):
+    from test_no_api import summarize_text
+    return lambda: summarize_text(corpus)
+
+
+def _bench_create_flashcards_from_qa(corpus, words):
+    from test_no_api import create_flashcards_from_qa
+    return lambda: create_flashcards_from_qa(corpus, num_cards=5)
+
+
+# Имя бенчмарка -> фабрика(лекция, число слов) -> функция без аргументов
+BENCHMARKS = {
+    "generate_questions": _bench_generate_questions,
+    "generate_wrong_options": _bench_generate_wrong_options,
+    "enhanced_summarizer": _bench_enhanced_summarizer,
+    "extract_json_items": _bench_extract_json_items,
+    "parse_test_questions": _bench_parse_test_questions,
+    "parse_flashcards": _bench_parse_flashcards,
+    "summarize_text": _bench_summarize_text,
+    "create_flashcards_from_qa": _bench_create_flashcards_from_qa,
+}
+
+
+def _output_size(result) -> int:
+    return len(result) if isinstance(result, (list, dict, str)) else 0
+
+
+def _run_quiet(fn):
+    # Генераторы печатают ход работы; в замеры это не должно попадать
+    with contextlib.redirect_stdout(io.StringIO()):
+        return fn()
+
+
+def run_benchmark(fn, repeats):
+    random.seed(SEED)
+    torch.manual_seed(SEED)
+    # Прогрев: потоки планировщика, ленивые импорты и кэши токенизатора
+    result = _run_quiet(fn)
+    runs = []
+    for _ in range(repeats):
+        random.seed(SEED)
+        torch.manual_seed(SEED)
+        start = time.perf_counter()
+        result = _run_quiet(fn)
+        runs.append((time.perf_counter() - start) * 1000)
+    return {
+        "runs_ms": [round(ms, 3) for ms in runs],
+        "median_ms": round(statistics.median(runs), 3),
+        "min_ms": round(min(runs), 3),
+        "max_ms": round(max(runs), 3),
+        "output_size": _output_size(result),
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(names, sizes, repeats):
+    install_tiny_models()
+    results = {}
+    for words in sizes:
+        corpus = make_corpus(words)
+        for name in names:
+            key = f"{name}@{words}"
+            fn = _run_quiet(lambda: BENCHMARKS[name](corpus, words))
+            results[key] = run_benchmark(fn, repeats)
+            print(f"{key}: median {results[key]['median_ms']} ms (output {results[key]['output_size']})")
+    return results
+
+
+def compare(previous, current, threshold):
+    """Печатает изменение медианы относительно прошлого прогона; возвращает число регрессий"""
+    regressions = 0
+    print(f"\n{'benchmark':<40} {'before ms':>12} {'after ms':>12} {'change':>9}")
+    for key, entry in current.items():
+        before = previous.get(key)
+        if before is None:
+            print(f"{key:<40} {'-':>12} {entry['median_ms']:>12} {'new':>9}")
+            continue
+        change = (entry["median_ms"] - before["median_ms"]) / before["median_ms"] if before["median_ms"] else 0.0
+        marker = ""
+        if change > threshold:
+            regressions += 1
+            marker = "  <- slower"
+        print(f"{key:<40} {before['median_ms']:>12} {entry['median_ms']:>12} {change:>+9.1%}{marker}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)), help="размеры лекций в словах")
+    parser.add_argument("--only", default="", help="подстроки имен бенчмарков через запятую")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--threads", type=int, default=1, help="потоки torch (1 - стабильнее замеры)")
+    parser.add_argument("--output", help="файл для сохранения результатов в JSON")
+    parser.add_argument("--compare", help="JSON прошлого прогона для сравнения")
+    parser.add_argument("--threshold", type=float, default=0.1, help="допустимое замедление медианы (доля)")
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.threads)
+    # Предупреждения transformers о параметрах генерации повторяются на каждом вызове
+    warnings.filterwarnings("ignore", category=UserWarning, module="transformers")
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    filters = [f.strip() for f in args.only.split(",") if f.strip()]
+    names = [name for name in BENCHMARKS if not filters or any(f in name for f in filters)]
+
+    results = {
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "transformers": transformers.__version__,
+        "threads": torch.get_num_threads(),
+        "repeats": args.repeats,
+        "benchmarks": run(names, sizes, args.repeats),
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results saved to {args.output}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            previous = json.load(f)
+        regressions = compare(previous.get("benchmarks", {}), results["benchmarks"], args.threshold)
+        print(f"\n{regressions} regression(s) above {args.threshold:.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,370 @@
+"""
+Локальная заглушка API chat completions (совместимая с OpenAI) для нагрузочных
+тестов main.py без обращения к настоящей модели.
+
+Режимы:
+    synthetic - правдоподобные ответы по типу запроса (тесты, карточки, резюме, все сразу)
+    record    - прокси к настоящему API: обмены сохраняются в кассету (JSONL)
+    replay    - ответы из кассеты, с записанной задержкой, если --latency не задана
+
+Запуск из корня репозитория:
+    python -m benchmarks.upstream_stub --port 9000 --latency lognormal:800,0.5 --error-rate 0.02
+    QYSQA_API_ENDPOINT=http://127.0.0.1:9000/v1 python main.py
+
+    python -m benchmarks.upstream_stub --mode record --cassette cassettes/lectures.jsonl
+    python -m benchmarks.upstream_stub --mode replay --cassette cassettes/lectures.jsonl
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional
+
+import httpx
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+from benchmarks.corpus import SENTENCES, TOPICS
+
+MODE_SYNTHETIC = "synthetic"
+MODE_RECORD = "record"
+MODE_REPLAY = "replay"
+
+
+def parse_latency(spec: Optional[str]) -> Optional[Callable[[random.Random], float]]:
+    """
+    Распределение задержки ответа (мс):
+    fixed:800, uniform:200,1500, normal:800,200, lognormal:800,0.5 (медиана и sigma)
+    """
+    if not spec:
+        return None
+    kind, _, args = spec.partition(":")
+    values = [float(v) for v in args.split(",") if v.strip()]
+    if kind == "fixed":
+        return lambda rng: values[0]
+    if kind == "uniform":
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == "normal":
+        return lambda rng: max(0.0, rng.gauss(values[0], values[1]))
+    if kind == "lognormal":
+        mu = math.log(values[0])
+        return lambda rng: rng.lognormvariate(mu, values[1])
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+def request_key(body: Dict[str, Any]) -> str:
+    """Ключ кассеты: модель и сообщения (температура на ответ не влияет)"""
+    payload = json.dumps({"model": body.get("model"), "messages": body.get("messages")},
+                         sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _detect(messages: List[Dict[str, str]]):
+    """Тип запроса ContentGenerator и запрошенное количество элементов по тексту промпта"""
+    prompt = " ".join(m.get("content") or "" for m in messages)
+    if "single JSON object" in prompt:
+        counts = {
+            "questions": re.search(r"(\d+) multiple choice questions", prompt),
+            "flashcards": re.search(r"(\d+) flashcards", prompt),
+        }
+        return "combined", {k: int(m.group(1)) if m else 3 for k, m in counts.items()}
+    match = re.search(r"create (\d+) (multiple choice questions|flashcards)", prompt)
+    if match:
+        mode = "test" if match.group(2).startswith("multiple") else "flashcard"
+        return mode, int(match.group(1))
+    return "summary", None
+
+
+def _questions(rng: random.Random, count: int) -> List[Dict[str, Any]]:
+    questions = []
+    for _ in range(count):
+        topic = rng.choice(TOPICS)
+        options = rng.sample(TOPICS, 4)
+        if topic not in options:
+            options[0] = topic
+        rng.shuffle(options)
+        questions.append({"question": f"Which topic covers {rng.choice(SENTENCES)[:60].lower()}?",
+                          "options": options, "correct_index": options.index(topic)})
+    return questions
+
+
+def _flashcards(rng: random.Random, count: int) -> List[Dict[str, str]]:
+    cards = []
+    for _ in range(count):
+        sentence = rng.choice(SENTENCES)
+        term, _, definition = sentence.partition(":")
+        cards.append({"front": f"What is {term.strip()}?", "back": (definition or sentence).strip()})
+    return cards
+
+
+def _summary(rng: random.Random, words: int = 120) -> str:
+    sentences, total = [], 0
+    while total < words:
+        sentence = rng.choice(SENTENCES)
+        sentences.append(sentence)
+        total += len(sentence.split())
+    return " ".join(sentences)
+
+
+def synthetic_content(messages: List[Dict[str, str]], rng: random.Random) -> str:
+    mode, count = _detect(messages)
+    if mode == "test":
+        return json.dumps(_questions(rng, count), indent=2)
+    if mode == "flashcard":
+        return json.dumps(_flashcards(rng, count), indent=2)
+    if mode == "combined":
+        return json.dumps({"summary": _summary(rng), "test_questions": _questions(rng, count["questions"]),
+                           "flashcards": _flashcards(rng, count["flashcards"])}, indent=2)
+    return _summary(rng)
+
+
+class Cassette:
+    """Записанные обмены с API: по строке JSON на ответ"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self._entries[entry["key"]] = entry
+        except FileNotFoundError:
+            pass
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        return self._entries.get(key)
+
+    def add(self, entry: Dict[str, Any]):
+        with self._lock:
+            self._entries[entry["key"]] = entry
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+
+def _usage(messages, content: str) -> Dict[str, int]:
+    # Грубая оценка в словах: достаточно для счетчиков токенов сервиса
+    prompt = sum(len((m.get("content") or "").split()) for m in messages)
+    completion = len(content.split())
+    return {"prompt_tokens": prompt, "completion_tokens": completion, "total_tokens": prompt + completion}
+
+
+def _completion(model: str, content: str, usage: Dict[str, int]) -> Dict[str, Any]:
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": usage,
+    }
+
+
+def _chunk(completion_id: str, model: str, delta: Dict[str, str], finish_reason=None) -> str:
+    data = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+    return f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _error(status: int, message: str) -> JSONResponse:
+    return JSONResponse(status_code=status, content={
+        "error": {"message": message, "type": "stub_error", "code": status}
+    })
+
+
+class StubServer:
+    def __init__(self, mode: str = MODE_SYNTHETIC, latency: Optional[str] = None, error_rate: float = 0.0,
+                 error_statuses=(500, 503), stream_chunk_words: int = 3, token_delay_ms: float = 20.0,
+                 cassette: Optional[str] = None, upstream: Optional[str] = None, seed: Optional[int] = None):
+        self.mode = mode
+        self.latency = parse_latency(latency)
+        self.error_rate = error_rate
+        self.error_statuses = tuple(error_statuses)
+        self.stream_chunk_words = max(1, stream_chunk_words)
+        self.token_delay = token_delay_ms / 1000.0
+        self.cassette = Cassette(cassette) if cassette else None
+        self.upstream = upstream.rstrip("/") if upstream else None
+        self.rng = random.Random(seed)
+        self._counters = {"requests": 0, "streams": 0, "errors": 0, "replayed": 0, "replay_misses": 0,
+                          "recorded": 0}
+        self._lock = threading.Lock()
+        if mode in (MODE_RECORD, MODE_REPLAY) and self.cassette is None:
+            raise ValueError(f"--cassette is required in {mode} mode")
+        if mode == MODE_RECORD and not self.upstream:
+            raise ValueError("--upstream is required in record mode")
+
+    def _count(self, name: str):
+        with self._lock:
+            self._counters[name] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._counters)
+        stats["mode"] = self.mode
+        stats["cassette_entries"] = len(self.cassette) if self.cassette is not None else None
+        return stats
+
+    async def handle(self, request: Request):
+        body = await request.json()
+        self._count("requests")
+        if body.get("stream"):
+            self._count("streams")
+        if self.mode == MODE_RECORD:
+            return await self._record(request, body)
+
+        messages = body.get("messages") or []
+        model = body.get("model", "stub")
+        key = request_key(body)
+        recorded = self.cassette.get(key) if self.mode == MODE_REPLAY else None
+        if self.mode == MODE_REPLAY:
+            if recorded is None:
+                self._count("replay_misses")
+                return _error(404, f"No cassette entry for request {key[:12]}")
+            self._count("replayed")
+
+        # Задержка до первого байта ответа: из распределения или записанная
+        if self.latency is not None:
+            delay_ms = self.latency(self.rng)
+        else:
+            delay_ms = recorded.get("latency_ms", 0.0) if recorded else 0.0
+        await asyncio.sleep(delay_ms / 1000.0)
+
+        if self.error_rate and self.rng.random() < self.error_rate:
+            self._count("errors")
+            return _error(self.rng.choice(self.error_statuses), "Injected stub error")
+
+        if recorded is not None:
+            content, usage = recorded["content"], recorded.get("usage") or _usage(messages, recorded["content"])
+        else:
+            content = synthetic_content(messages, self.rng)
+            usage = _usage(messages, content)
+        if body.get("stream"):
+            return StreamingResponse(self._stream(model, content), media_type="text/event-stream")
+        return JSONResponse(_completion(model, content, usage))
+
+    async def _stream(self, model: str, content: str):
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        yield _chunk(completion_id, model, {"role": "assistant", "content": ""})
+        words = re.split(r"(\s+)", content)
+        step = self.stream_chunk_words * 2
+        for i in range(0, len(words), step):
+            yield _chunk(completion_id, model, {"content": "".join(words[i:i + step])})
+            await asyncio.sleep(self.token_delay)
+        yield _chunk(completion_id, model, {}, finish_reason="stop")
+        yield "data: [DONE]\n\n"
+
+    async def _record(self, request: Request, body: Dict[str, Any]):
+        """Проксирует запрос к настоящему API и сохраняет ответ в кассету"""
+        headers = {"Authorization": request.headers.get("authorization", ""), "Content-Type": "application/json"}
+        url = f"{self.upstream}/chat/completions"
+        client = httpx.AsyncClient(timeout=httpx.Timeout(120.0, connect=10.0))
+        start = time.perf_counter()
+        if not body.get("stream"):
+            try:
+                response = await client.post(url, json=body, headers=headers)
+            finally:
+                await client.aclose()
+            latency_ms = (time.perf_counter() - start) * 1000
+            if response.status_code == 200:
+                data = response.json()
+                content = data["choices"][0]["message"]["content"] if data.get("choices") else ""
+                self._save(body, content, data.get("usage"), latency_ms)
+            return Response(content=response.content, status_code=response.status_code,
+                            media_type=response.headers.get("content-type", "application/json"))
+
+        upstream = await client.send(client.build_request("POST", url, json=body, headers=headers), stream=True)
+        if upstream.status_code != 200:
+            content = await upstream.aread()
+            await upstream.aclose()
+            await client.aclose()
+            return Response(content=content, status_code=upstream.status_code,
+                            media_type=upstream.headers.get("content-type", "application/json"))
+        latency_ms = (time.perf_counter() - start) * 1000
+
+        async def relay():
+            parts = []
+            try:
+                async for line in upstream.aiter_lines():
+                    if line.startswith("data: ") and line != "data: [DONE]":
+                        chunk = json.loads(line[6:])
+                        if chunk.get("choices"):
+                            parts.append(chunk["choices"][0].get("delta", {}).get("content") or "")
+                    yield line + "\n"
+                self._save(body, "".join(parts), None, latency_ms)
+            finally:
+                await upstream.aclose()
+                await client.aclose()
+
+        return StreamingResponse(relay(), media_type="text/event-stream")
+
+    def _save(self, body: Dict[str, Any], content: str, usage, latency_ms: float):
+        messages = body.get("messages") or []
+        mode, _ = _detect(messages)
+        self.cassette.add({
+            "key": request_key(body),
+            "mode": mode,
+            "model": body.get("model"),
+            "messages": messages,
+            "content": content,
+            "usage": usage,
+            "latency_ms": round(latency_ms, 1),
+        })
+        self._count("recorded")
+
+
+def create_app(server: StubServer) -> FastAPI:
+    app = FastAPI(title="Qysqa upstream stub")
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        return await server.handle(request)
+
+    @app.get("/stub/stats")
+    async def stub_stats():
+        return server.stats()
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--mode", choices=[MODE_SYNTHETIC, MODE_RECORD, MODE_REPLAY], default=MODE_SYNTHETIC)
+    parser.add_argument("--latency", help="распределение задержки, например lognormal:800,0.5")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов с ошибкой")
+    parser.add_argument("--error-statuses", default="500,503", help="коды ошибок через запятую")
+    parser.add_argument("--stream-chunk-words", type=int, default=3, help="слов в одном фрагменте потока")
+    parser.add_argument("--token-delay-ms", type=float, default=20.0, help="пауза между фрагментами потока")
+    parser.add_argument("--cassette", help="файл кассеты (JSONL) для record/replay")
+    parser.add_argument("--upstream", default="https://api.deepseek.com/v1", help="настоящий API для record")
+    parser.add_argument("--seed", type=int, help="seed генератора задержек, ошибок и ответов")
+    args = parser.parse_args()
+
+    server = StubServer(
+        mode=args.mode, latency=args.latency, error_rate=args.error_rate,
+        error_statuses=[int(s) for s in args.error_statuses.split(",") if s.strip()],
+        stream_chunk_words=args.stream_chunk_words, token_delay_ms=args.token_delay_ms,
+        cassette=args.cassette, upstream=args.upstream, seed=args.seed,
+    )
+    print(f"Upstream stub ({args.mode}) on http://{args.host}:{args.port}/v1")
+    uvicorn.run(create_app(server), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
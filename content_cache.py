@@ -0,0 +1,175 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+import executors
+
+# Настройки кэша через переменные окружения
+_CACHE_PATH = os.environ.get("QYSQA_CACHE_PATH", "content_cache.sqlite3")
+_MEMORY_MB = float(os.environ.get("QYSQA_CACHE_MEMORY_MB", "64"))
+_TTL_SECONDS = float(os.environ.get("QYSQA_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+
+
+def normalize_text(text: str) -> str:
+    """Нормализация текста: одинаковые лекции с разными пробелами дают один ключ"""
+    return " ".join(text.split())
+
+
+def make_key(text: str, mode: str, params: Any, model_id: str, prompt_version: str) -> str:
+    """Ключ кэша - хеш от текста и всех параметров, влияющих на результат"""
+    payload = json.dumps(
+        [normalize_text(text), mode, params, model_id, prompt_version],
+        ensure_ascii=False, sort_keys=True
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """
+    Двухуровневый кэш результатов генерации: LRU в памяти с ограничением
+    по размеру и SQLite на диске с TTL
+    """
+
+    def __init__(self, path: Optional[str] = _CACHE_PATH, memory_mb: float = _MEMORY_MB,
+                 ttl_seconds: float = _TTL_SECONDS):
+        self.max_memory_bytes = int(memory_mb * 1024 * 1024)
+        self.ttl = ttl_seconds
+        # key -> (сериализованное значение, размер в байтах, время создания)
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self._counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+        # Пустой путь отключает дисковый уровень
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT, created_at REAL)"
+            )
+            self._db.commit()
+
+    def get(self, key: str) -> Optional[Any]:
+        """Поиск результата сначала в памяти, затем на диске"""
+        with self._lock:
+            entry = self._memory_entry_locked(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                self._counters["memory_hits"] += 1
+                return json.loads(entry[0])
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT value, created_at FROM results WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    if time.time() - row[1] <= self.ttl:
+                        self._counters["disk_hits"] += 1
+                        # Запись в памяти устаревает тогда же, когда и на диске
+                        self._put_memory_locked(key, row[0], row[1])
+                        return json.loads(row[0])
+                    # Запись устарела
+                    self._db.execute("DELETE FROM results WHERE key = ?", (key,))
+                    self._db.commit()
+
+            self._counters["misses"] += 1
+            return None
+
+    def contains(self, key: str) -> bool:
+        """Есть ли действующий результат (без учета в счетчиках и без продвижения в LRU)"""
+        with self._lock:
+            if self._memory_entry_locked(key) is not None:
+                return True
+            if self._db is None:
+                return False
+            row = self._db.execute("SELECT created_at FROM results WHERE key = ?", (key,)).fetchone()
+            return row is not None and time.time() - row[0] <= self.ttl
+
+    def set(self, key: str, value: Any):
+        """Сохранение результата в оба уровня"""
+        serialized = json.dumps(value, ensure_ascii=False)
+        created_at = time.time()
+        with self._lock:
+            self._counters["stores"] += 1
+            self._put_memory_locked(key, serialized, created_at)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO results (key, value, created_at) VALUES (?, ?, ?)",
+                    (key, serialized, created_at)
+                )
+                self._db.commit()
+
+    # Обращения из цикла событий: SQLite и блокировка кэша - в пуле потоков
+
+    async def aget(self, key: str) -> Optional[Any]:
+        return await executors.run_blocking(executors.POOL_CPU, self.get, key)
+
+    async def acontains(self, key: str) -> bool:
+        return await executors.run_blocking(executors.POOL_CPU, self.contains, key)
+
+    async def aset(self, key: str, value: Any):
+        await executors.run_blocking(executors.POOL_CPU, self.set, key, value)
+
+    def _memory_entry_locked(self, key: str) -> Optional[tuple]:
+        """Запись из памяти; устаревшая по TTL удаляется"""
+        entry = self._memory.get(key)
+        if entry is None:
+            return None
+        if time.time() - entry[2] > self.ttl:
+            del self._memory[key]
+            self._memory_bytes -= entry[1]
+            return None
+        return entry
+
+    def _put_memory_locked(self, key: str, serialized: str, created_at: float):
+        size = len(serialized.encode("utf-8"))
+        if size > self.max_memory_bytes:
+            return
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_bytes -= old[1]
+        self._memory[key] = (serialized, size, created_at)
+        self._memory_bytes += size
+
+        # Вытесняем самые старые записи, пока не уложимся в лимит памяти
+        while self._memory_bytes > self.max_memory_bytes:
+            _, (_, evicted_size, _) = self._memory.popitem(last=False)
+            self._memory_bytes -= evicted_size
+            self._counters["evictions"] += 1
+
+    def purge_expired(self):
+        """Удаление устаревших записей из памяти и с диска"""
+        with self._lock:
+            expired_before = time.time() - self.ttl
+            for key in [k for k, entry in self._memory.items() if entry[2] < expired_before]:
+                self._memory_bytes -= self._memory.pop(key)[1]
+            if self._db is None:
+                return
+            self._db.execute("DELETE FROM results WHERE created_at < ?", (expired_before,))
+            self._db.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        """Счетчики попаданий и промахов"""
+        with self._lock:
+            stats = dict(self._counters)
+            stats["memory_entries"] = len(self._memory)
+            stats["memory_bytes"] = self._memory_bytes
+            return stats
+
+
+_default_cache: Optional[ResultCache] = None
+_default_lock = threading.Lock()
+
+
+def get_default_cache() -> ResultCache:
+    """Общий кэш процесса (создается при первом обращении)"""
+    global _default_cache
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = ResultCache()
+        return _default_cache
@@ -0,0 +1,70 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import torch
+from transformers.modeling_outputs import BaseModelOutput
+
+_CACHE_MB = float(os.environ.get("QYSQA_ENCODER_CACHE_MB", "256"))
+
+
+class EncoderCache:
+    """
+    LRU-кэш выходов энкодера seq2seq модели, ключ - хеш input_ids.
+    Позволяет не кодировать один и тот же текст повторно (overview и raw
+    проходы, повторные запросы по той же лекции)
+    """
+
+    def __init__(self, max_mb: float = _CACHE_MB):
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self._entries: "OrderedDict[tuple, torch.Tensor]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(model_name: str, input_ids: torch.Tensor) -> tuple:
+        digest = hashlib.sha256(input_ids.detach().cpu().numpy().tobytes()).hexdigest()
+        return model_name, digest
+
+    def encode(self, model_name: str, model, input_ids: torch.Tensor,
+               attention_mask: Optional[torch.Tensor] = None) -> BaseModelOutput:
+        """Выход энкодера из кэша или новый проход энкодера"""
+        key = self.key(model_name, input_ids)
+        with self._lock:
+            hidden = self._entries.get(key)
+            if hidden is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+        if hidden is None:
+            with torch.no_grad():
+                hidden = model.get_encoder()(input_ids=input_ids, attention_mask=attention_mask).last_hidden_state
+            self._put(key, hidden)
+            with self._lock:
+                self.misses += 1
+        # generate расширяет тензоры для beam search на месте, поэтому отдаем новую обертку
+        return BaseModelOutput(last_hidden_state=hidden)
+
+    def _put(self, key, hidden: torch.Tensor):
+        size = hidden.numel() * hidden.element_size()
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = hidden
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.numel() * evicted.element_size()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._bytes, "hits": self.hits, "misses": self.misses}
+
+
+# Общий кэш процесса
+encoder_cache = EncoderCache()
@@ -0,0 +1,169 @@
+import asyncio
+import contextvars
+import os
+import sys
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+import metrics
+
+# Пул для коротких CPU задач обработчиков (индекс лекций и т.п.)
+POOL_CPU = "cpu"
+# Пулы вложенных задач, которые запускаются из потоков других пулов
+POOL_OPTIONS = "options"
+POOL_SUMMARY_MAP = "summary-map"
+
+
+def _parse_sizes(value: str, default: int) -> Dict[str, int]:
+    """Размеры вида "2" или "cpu=2,local-large=1" (запись без имени - значение по умолчанию)"""
+    sizes = {"default": default}
+    for item in value.split(","):
+        if not item.strip():
+            continue
+        name, _, size = item.rpartition("=")
+        sizes[name.strip() or "default"] = int(size)
+    return sizes
+
+
+# Потоки пулов по именам; пул без записи получает значение по умолчанию
+_WORKERS = _parse_sizes(os.environ.get("QYSQA_EXECUTOR_WORKERS", ""), 2)
+# Сколько вызовов одной модели может идти одновременно (1 - строго по очереди)
+_MODEL_CONCURRENCY = _parse_sizes(os.environ.get("QYSQA_MODEL_CONCURRENCY", ""), 1)
+
+
+class _Pool:
+    """Ограниченный пул потоков: задачи ждут свободный поток в порядке поступления"""
+
+    def __init__(self, name: str, workers: int):
+        self.name = name
+        self.workers = max(1, workers)
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=f"exec-{name}")
+        self._lock = threading.Lock()
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        # Контекст вызывающего: метки метрик и трасса запроса сохраняются в потоке пула
+        context = contextvars.copy_context()
+        submitted = time.perf_counter()
+
+        def task():
+            with self._lock:
+                self.queued -= 1
+                self.running += 1
+            try:
+                context.run(metrics.observe_stage, "executor_wait", time.perf_counter() - submitted, self.name)
+                return context.run(fn, *args, **kwargs)
+            finally:
+                with self._lock:
+                    self.running -= 1
+                    self.completed += 1
+
+        with self._lock:
+            self.queued += 1
+        future = self._executor.submit(task)
+        future.add_done_callback(self._forget_cancelled)
+        return future
+
+    def _forget_cancelled(self, future: Future):
+        # Задача отменена до запуска (клиент ушел) - в очереди ее больше нет
+        if future.cancelled():
+            with self._lock:
+                self.queued -= 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"workers": self.workers, "queued": self.queued, "running": self.running,
+                    "completed": self.completed}
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+_pools: Dict[str, _Pool] = {}
+_model_slots: Dict[str, threading.BoundedSemaphore] = {}
+_lock = threading.Lock()
+
+
+def pool(name: str, default_workers: Optional[int] = None) -> _Pool:
+    """Пул по имени; размер - из QYSQA_EXECUTOR_WORKERS, иначе default_workers или общее значение"""
+    with _lock:
+        existing = _pools.get(name)
+        if existing is None:
+            workers = _WORKERS.get(name, default_workers or _WORKERS["default"])
+            existing = _pools[name] = _Pool(name, workers)
+        return existing
+
+
+async def run_blocking(pool_name: str, fn: Callable, *args, **kwargs) -> Any:
+    """
+    Выполняет блокирующую функцию в пуле pool_name, не занимая цикл событий.
+    Если ожидающая корутина отменена, еще не начатая задача не выполняется
+    """
+    return await asyncio.wrap_future(pool(pool_name).submit(fn, *args, **kwargs))
+
+
+def map_blocking(pool_name: str, fn: Callable, items: Iterable, default_workers: Optional[int] = None) -> List[Any]:
+    """
+    Синхронный map в пуле pool_name для кода, уже работающего в потоке.
+    Пул должен отличаться от пула вызывающего потока, иначе задачи могут ждать друг друга
+    """
+    target = pool(pool_name, default_workers)
+    futures = [target.submit(fn, item) for item in items]
+    return [future.result() for future in futures]
+
+
+@contextmanager
+def model_slot(model_name: str):
+    """
+    Слот модели на время прохода через нее: torch модуль и токенизатор общие
+    для всех потоков процесса, поэтому одновременно модель выполняет не больше
+    QYSQA_MODEL_CONCURRENCY вызовов, остальные ждут
+    """
+    with _lock:
+        slot = _model_slots.get(model_name)
+        if slot is None:
+            slot = _model_slots[model_name] = threading.BoundedSemaphore(
+                max(1, _MODEL_CONCURRENCY.get(model_name, _MODEL_CONCURRENCY["default"])))
+    with metrics.stage("model_wait", model_name):
+        slot.acquire()
+    try:
+        yield
+    finally:
+        slot.release()
+
+
+def set_switch_interval():
+    """
+    Интервал переключения GIL из QYSQA_GIL_SWITCH_INTERVAL_MS (по умолчанию не меняется):
+    потоки пулов с Python кодом (токенизация, разбор) чаще уступают цикл событий,
+    и /health отвечает вовремя даже под полной нагрузкой. Вызывается при запуске процесса
+    """
+    interval_ms = float(os.environ.get("QYSQA_GIL_SWITCH_INTERVAL_MS", "0") or 0)
+    if interval_ms > 0:
+        sys.setswitchinterval(interval_ms / 1000)
+
+
+def stats() -> Dict[str, Dict[str, int]]:
+    with _lock:
+        pools = list(_pools.values())
+    return {p.name: p.stats() for p in pools}
+
+
+def shutdown():
+    # Пулы создаются заново при следующем обращении
+    with _lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for p in pools:
+        p.shutdown()
+
+
+metrics.register(metrics.Gauge(
+    "qysqa_executor_tasks", "Blocking tasks in executor pools", ("pool", "state"),
+    lambda: {(name, state): entry[state] for name, entry in stats().items() for state in ("queued", "running")}
+))
@@ -0,0 +1,189 @@
+import importlib.util
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+import httpx
+
+# Пул соединений к внешним LLM API: размер, keep-alive и таймауты (в секундах)
+_MAX_CONNECTIONS = int(os.environ.get("QYSQA_HTTP_MAX_CONNECTIONS", "100"))
+_MAX_KEEPALIVE = int(os.environ.get("QYSQA_HTTP_MAX_KEEPALIVE", "20"))
+_KEEPALIVE_EXPIRY = float(os.environ.get("QYSQA_HTTP_KEEPALIVE_EXPIRY", "60"))
+_CONNECT_TIMEOUT = float(os.environ.get("QYSQA_HTTP_CONNECT_TIMEOUT", "5"))
+_READ_TIMEOUT = float(os.environ.get("QYSQA_HTTP_READ_TIMEOUT", "120"))
+_WRITE_TIMEOUT = float(os.environ.get("QYSQA_HTTP_WRITE_TIMEOUT", "10"))
+_POOL_TIMEOUT = float(os.environ.get("QYSQA_HTTP_POOL_TIMEOUT", "10"))
+# HTTP/2 включается, если установлен пакет h2 (QYSQA_HTTP2=0 отключает его)
+_HTTP2 = os.environ.get("QYSQA_HTTP2", "1") != "0" and importlib.util.find_spec("h2") is not None
+
+
+class _Metrics:
+    """Счетчики запросов и установленных соединений (общие для sync и async клиентов)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {
+            "requests": 0, "responses": 0, "errors": 0,
+            "new_connections": 0, "tls_handshakes": 0, "http2_connections": 0,
+        }
+        self._statuses: Dict[str, int] = {}
+        self._seconds = 0.0
+
+    def add(self, name: str, value: int = 1):
+        with self._lock:
+            self._counters[name] += value
+
+    def response(self, status_code: int, seconds: float):
+        with self._lock:
+            self._counters["responses"] += 1
+            group = f"{status_code // 100}xx"
+            self._statuses[group] = self._statuses.get(group, 0) + 1
+            self._seconds += seconds
+
+    def trace(self, event_name: str, info: Dict[str, Any]):
+        """Обработчик событий httpcore: считает новые TCP/TLS соединения"""
+        if event_name == "connection.connect_tcp.complete":
+            self.add("new_connections")
+        elif event_name == "connection.start_tls.complete":
+            self.add("tls_handshakes")
+        elif event_name == "http2.send_connection_init.complete":
+            self.add("http2_connections")
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._counters)
+            stats["statuses"] = dict(self._statuses)
+            done = stats["responses"]
+            stats["avg_response_ms"] = round(self._seconds / done * 1000, 1) if done else None
+            # Запросы, обслуженные уже открытым соединением
+            stats["reused_connections"] = max(0, stats["requests"] - stats["errors"] - stats["new_connections"])
+            return stats
+
+
+_metrics = _Metrics()
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(max_connections=_MAX_CONNECTIONS, max_keepalive_connections=_MAX_KEEPALIVE,
+                        keepalive_expiry=_KEEPALIVE_EXPIRY)
+
+
+def _timeout() -> httpx.Timeout:
+    return httpx.Timeout(connect=_CONNECT_TIMEOUT, read=_READ_TIMEOUT, write=_WRITE_TIMEOUT, pool=_POOL_TIMEOUT)
+
+
+def _on_request(request: httpx.Request):
+    _metrics.add("requests")
+    request.extensions["trace"] = _metrics.trace
+    request.extensions["qysqa_start"] = time.perf_counter()
+
+
+def _on_response(response: httpx.Response):
+    _metrics.response(response.status_code, time.perf_counter() - response.request.extensions["qysqa_start"])
+
+
+async def _on_request_async(request: httpx.Request):
+    _metrics.add("requests")
+
+    async def trace(event_name, info):
+        _metrics.trace(event_name, info)
+
+    request.extensions["trace"] = trace
+    request.extensions["qysqa_start"] = time.perf_counter()
+
+
+async def _on_response_async(response: httpx.Response):
+    _on_response(response)
+
+
+class _ErrorCountingTransport(httpx.HTTPTransport):
+    def handle_request(self, request):
+        try:
+            return super().handle_request(request)
+        except httpx.TransportError:
+            _metrics.add("errors")
+            raise
+
+
+class _AsyncErrorCountingTransport(httpx.AsyncHTTPTransport):
+    async def handle_async_request(self, request):
+        try:
+            return await super().handle_async_request(request)
+        except httpx.TransportError:
+            _metrics.add("errors")
+            raise
+
+
+_lock = threading.Lock()
+_client: Optional[httpx.Client] = None
+_async_client: Optional[httpx.AsyncClient] = None
+
+
+def get_client() -> httpx.Client:
+    """Общий синхронный HTTP клиент процесса"""
+    global _client
+    with _lock:
+        if _client is None or _client.is_closed:
+            _client = httpx.Client(
+                transport=_ErrorCountingTransport(http2=_HTTP2, limits=_limits()),
+                timeout=_timeout(),
+                event_hooks={"request": [_on_request], "response": [_on_response]},
+            )
+        return _client
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """Общий асинхронный HTTP клиент процесса (для AsyncOpenAI)"""
+    global _async_client
+    with _lock:
+        if _async_client is None or _async_client.is_closed:
+            _async_client = httpx.AsyncClient(
+                transport=_AsyncErrorCountingTransport(http2=_HTTP2, limits=_limits()),
+                timeout=_timeout(),
+                event_hooks={"request": [_on_request_async], "response": [_on_response_async]},
+            )
+        return _async_client
+
+
+def post_json(url: str, payload: Any, headers: Optional[Dict[str, str]] = None) -> httpx.Response:
+    """POST с JSON телом через общий пул соединений"""
+    return get_client().post(url, json=payload, headers=headers)
+
+
+def _pool_stats(client) -> Optional[Dict[str, int]]:
+    pool = getattr(getattr(client, "_transport", None), "_pool", None)
+    if client is None or client.is_closed or pool is None:
+        return None
+    connections = list(pool.connections)
+    return {
+        "connections": len(connections),
+        "idle": sum(1 for c in connections if c.is_idle()),
+        "max_connections": _MAX_CONNECTIONS,
+        "max_keepalive": _MAX_KEEPALIVE,
+    }
+
+
+def stats() -> Dict[str, Any]:
+    """Метрики запросов и текущее состояние пулов"""
+    result = _metrics.snapshot()
+    result["http2"] = _HTTP2
+    result["pool"] = _pool_stats(_client)
+    result["async_pool"] = _pool_stats(_async_client)
+    return result
+
+
+def close():
+    global _client
+    with _lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+
+
+async def aclose():
+    global _async_client
+    with _lock:
+        client, _async_client = _async_client, None
+    if client is not None:
+        await client.aclose()
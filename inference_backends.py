@@ -0,0 +1,107 @@
+import os
+import re
+from typing import Dict
+
+# Бэкенды инференса локальных seq2seq моделей
+BACKEND_TORCH = "torch"
+BACKEND_ONNX = "onnx"
+BACKEND_ONNX_INT8 = "onnx-int8"
+
+_ONNX_DIR = os.environ.get("QYSQA_ONNX_DIR", "onnx_models")
+
+
+def _parse_backends(value: str) -> Dict[str, str]:
+    """Разбор QYSQA_INFERENCE_BACKENDS вида "model=onnx-int8,other=torch" """
+    backends = {}
+    for item in value.split(","):
+        if "=" in item:
+            model_name, backend = item.rsplit("=", 1)
+            backends[model_name.strip()] = backend.strip()
+    return backends
+
+
+_BACKENDS = _parse_backends(os.environ.get("QYSQA_INFERENCE_BACKENDS", ""))
+_DEFAULT_BACKEND = os.environ.get("QYSQA_DEFAULT_BACKEND", BACKEND_TORCH)
+
+
+def backend_for(model_name: str) -> str:
+    """Бэкенд, выбранный для модели в конфигурации"""
+    return _BACKENDS.get(model_name, _DEFAULT_BACKEND)
+
+
+def is_torch_backend(model_name: str) -> bool:
+    return backend_for(model_name) == BACKEND_TORCH
+
+
+def _export_dir(model_name: str, quantized: bool) -> str:
+    safe_name = re.sub(r"[^\w.-]", "_", model_name)
+    return os.path.join(_ONNX_DIR, safe_name, "int8" if quantized else "fp32")
+
+
+def _onnx_files(directory: str):
+    return sorted(name for name in os.listdir(directory) if name.endswith(".onnx"))
+
+
+def load_onnx_model(model_name: str, quantized: bool = False):
+    """
+    Загрузка модели под ONNX Runtime (энкодер и декодер с KV-кэшем).
+    При первом запуске модель экспортируется в ONNX и, если нужно,
+    квантуется динамически в int8; результат сохраняется в QYSQA_ONNX_DIR
+    """
+    from optimum.onnxruntime import ORTModelForSeq2SeqLM, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+
+    fp32_dir = _export_dir(model_name, quantized=False)
+    if not os.path.isdir(fp32_dir) or not _onnx_files(fp32_dir):
+        print(f"Exporting {model_name} to ONNX...")
+        model = ORTModelForSeq2SeqLM.from_pretrained(model_name, export=True, use_cache=True)
+        model.save_pretrained(fp32_dir)
+
+    if not quantized:
+        return ORTModelForSeq2SeqLM.from_pretrained(fp32_dir, use_cache=True)
+
+    int8_dir = _export_dir(model_name, quantized=True)
+    if not os.path.isdir(int8_dir) or not _onnx_files(int8_dir):
+        print(f"Quantizing {model_name} to int8...")
+        # Динамическая квантизация: веса в int8, активации квантуются на лету
+        config = AutoQuantizationConfig.avx2(is_static=False, per_channel=False)
+        # Объединенный декодер квантуем, только если отдельных файлов декодера нет
+        files = [name for name in _onnx_files(fp32_dir) if "merged" not in name] or _onnx_files(fp32_dir)
+        for file_name in files:
+            quantizer = ORTQuantizer.from_pretrained(fp32_dir, file_name=file_name)
+            quantizer.quantize(save_dir=int8_dir, quantization_config=config)
+
+    files = _onnx_files(int8_dir)
+
+    def pick(prefix):
+        matches = [name for name in files if name.startswith(prefix)]
+        return matches[0] if matches else None
+
+    kwargs = {
+        "encoder_file_name": pick("encoder_model"),
+        "decoder_file_name": pick("decoder_model_quantized") or pick("decoder_model"),
+    }
+    with_past = pick("decoder_with_past_model")
+    if with_past:
+        kwargs["decoder_with_past_file_name"] = with_past
+    return ORTModelForSeq2SeqLM.from_pretrained(int8_dir, use_cache=True, **kwargs)
+
+
+def load_model_for_backend(model_name: str, model_cls, backend: str, **kwargs):
+    """Загрузка модели выбранным бэкендом; без onnxruntime используется PyTorch"""
+    if backend in (BACKEND_ONNX, BACKEND_ONNX_INT8):
+        try:
+            return load_onnx_model(model_name, quantized=backend == BACKEND_ONNX_INT8)
+        except ImportError as e:
+            print(f"Warning: ONNX Runtime backend unavailable ({e}), using PyTorch for {model_name}")
+    return model_cls.from_pretrained(model_name, **kwargs)
+
+
+def model_size_bytes(model) -> int:
+    """Оценка памяти модели: параметры PyTorch или размер ONNX файлов"""
+    if hasattr(model, "parameters"):
+        return sum(t.numel() * t.element_size() for t in list(model.parameters()) + list(model.buffers()))
+    model_dir = getattr(model, "model_save_dir", None)
+    if model_dir and os.path.isdir(model_dir):
+        return sum(os.path.getsize(os.path.join(model_dir, name)) for name in _onnx_files(str(model_dir)))
+    return 0
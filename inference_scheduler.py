@@ -0,0 +1,209 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional, Tuple
+
+import torch
+
+import executors
+import metrics
+import tracing
+from model_registry import get_model, registry
+
+_MAX_BATCH_SIZE = int(os.environ.get("QYSQA_MICROBATCH_MAX_SIZE", "8"))
+_MAX_WAIT_MS = float(os.environ.get("QYSQA_MICROBATCH_MAX_WAIT_MS", "5"))
+_WORKERS = int(os.environ.get("QYSQA_MICROBATCH_WORKERS", "1"))
+# Через сколько секунд без запросов поток очереди завершается (очередь создается заново при следующем вызове)
+_IDLE_SECONDS = float(os.environ.get("QYSQA_MICROBATCH_IDLE_SECONDS", "60"))
+# Сокеты серверов моделей (model_server.py) через запятую: генерация уходит туда, а не в этот процесс
+MODEL_SERVERS = [path.strip() for path in os.environ.get("QYSQA_MODEL_SERVER", "").split(",") if path.strip()]
+
+
+class _Request:
+    def __init__(self, texts: List[str]):
+        self.texts = texts
+        self.future: Future = Future()
+        # Эндпоинт, из которого пришел запрос (для меток метрик)
+        self.endpoint = metrics.current_endpoint.get()
+        # Открытые спаны трассируемого запроса: стадии батча записываются в его трассу
+        self.spans = tracing.current_spans()
+
+
+def _freeze(params: Dict[str, Any]) -> Tuple:
+    """Хешируемое представление параметров генерации"""
+    frozen = []
+    for name, value in sorted(params.items()):
+        try:
+            hash(value)
+        except TypeError:
+            value = repr(value)
+        frozen.append((name, value))
+    return tuple(frozen)
+
+
+class MicroBatchScheduler:
+    """
+    Планировщик микробатчей для локальных seq2seq моделей: вызовы generate
+    от разных запросов к одной модели с одинаковыми параметрами генерации
+    собираются в один батч с паддингом. Батч отправляется при достижении
+    max_batch_size текстов или по истечении max_wait_ms. Каждую очередь
+    обслуживают workers потоков, поэтому несколько батчей могут идти параллельно;
+    простаивающие idle_seconds потоки завершаются, а пустые очереди удаляются
+    """
+
+    def __init__(self, max_batch_size: int = _MAX_BATCH_SIZE, max_wait_ms: float = _MAX_WAIT_MS,
+                 workers: int = _WORKERS, idle_seconds: float = _IDLE_SECONDS):
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.workers = max(1, workers)
+        self.idle_seconds = idle_seconds
+        self._queues: Dict[Tuple, "queue.Queue[_Request]"] = {}
+        # Живые потоки каждой очереди
+        self._alive: Dict[Tuple, int] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, model_name: str, texts: List[str], model_cls=None, tokenizer_cls=None,
+               max_input_length: Optional[int] = 512, **gen_kwargs) -> Future:
+        """Ставит тексты в очередь; результат - список вариантов генерации на каждый текст"""
+        request = _Request(list(texts))
+        if not request.texts:
+            request.future.set_result([])
+            return request.future
+
+        key = (model_name, model_cls, tokenizer_cls, max_input_length, _freeze(gen_kwargs))
+        # Под блокировкой: поток не может завершиться, пока запрос ставится в его очередь
+        with self._lock:
+            pending = self._queues.get(key)
+            if pending is None:
+                pending = queue.Queue()
+                self._queues[key] = pending
+            # Недостающие потоки (после завершения простаивавших) запускаются снова
+            for _ in range(self.workers - self._alive.get(key, 0)):
+                worker = threading.Thread(
+                    target=self._worker, args=(key, pending, gen_kwargs),
+                    name=f"microbatch-{model_name}", daemon=True
+                )
+                worker.start()
+            self._alive[key] = self.workers
+            pending.put(request)
+        return request.future
+
+    def generate(self, model_name: str, texts: List[str], **kwargs) -> List[List[str]]:
+        """Синхронная обертка над submit"""
+        with tracing.span("microbatch", model=model_name, texts=len(texts)):
+            return self.submit(model_name, texts, **kwargs).result()
+
+    def warmup(self, model_name: str, model_cls=None, tokenizer_cls=None):
+        """Загрузка модели и короткий проход generate, чтобы первый запрос не платил за ленивую инициализацию"""
+        tokenizer, model, device = get_model(model_name, model_cls=model_cls, tokenizer_cls=tokenizer_cls)
+        inputs = tokenizer(["warmup"], return_tensors="pt").to(device)
+        with executors.model_slot(model_name), torch.no_grad():
+            model.generate(inputs["input_ids"], attention_mask=inputs["attention_mask"], max_new_tokens=1)
+
+    def queue_depth(self) -> int:
+        """Количество запросов, ожидающих отправки в модель"""
+        with self._lock:
+            return sum(q.qsize() for q in self._queues.values())
+
+    def is_loaded(self, model_name: str) -> bool:
+        return registry.is_loaded(model_name)
+
+    def _retire(self, key, pending: "queue.Queue[_Request]") -> bool:
+        """Завершение простаивающего потока, если новых запросов так и нет; последний удаляет очередь"""
+        with self._lock:
+            if not pending.empty():
+                return False
+            self._alive[key] -= 1
+            if self._alive[key] <= 0:
+                del self._alive[key]
+                del self._queues[key]
+            return True
+
+    def _worker(self, key, pending: "queue.Queue[_Request]", gen_kwargs):
+        while True:
+            try:
+                first = pending.get(timeout=self.idle_seconds)
+            except queue.Empty:
+                if self._retire(key, pending):
+                    return
+                continue
+            batch = [first]
+            size = len(batch[0].texts)
+            deadline = time.monotonic() + self.max_wait
+
+            # Добираем запросы, пока не заполнили батч или не истекло время ожидания
+            while size < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    request = pending.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                batch.append(request)
+                size += len(request.texts)
+
+            endpoints = {r.endpoint for r in batch}
+            endpoint = endpoints.pop() if len(endpoints) == 1 else "mixed"
+            try:
+                # Батчи разных очередей одной модели не идут через общий torch модуль одновременно
+                with tracing.attach(s for r in batch for s in r.spans), executors.model_slot(key[0]):
+                    results = self._run_batch(key, [t for r in batch for t in r.texts], gen_kwargs, endpoint)
+            except Exception as e:
+                for request in batch:
+                    request.future.set_exception(e)
+                continue
+
+            offset = 0
+            for request in batch:
+                request.future.set_result(results[offset:offset + len(request.texts)])
+                offset += len(request.texts)
+
+    def _run_batch(self, key, texts: List[str], gen_kwargs, endpoint: Optional[str] = None) -> List[List[str]]:
+        model_name, model_cls, tokenizer_cls, max_input_length, _ = key
+        tokenizer, model, device = get_model(model_name, model_cls=model_cls, tokenizer_cls=tokenizer_cls)
+        num_sequences = gen_kwargs.get("num_return_sequences", 1)
+        truncation = {"max_length": max_input_length, "truncation": True} if max_input_length else {}
+
+        # Сортируем тексты по длине, чтобы соседние в батче меньше дополнялись паддингом
+        with metrics.stage("model_tokenize", model_name, endpoint):
+            lengths = [len(ids) for ids in tokenizer(texts, **truncation)["input_ids"]]
+        order = sorted(range(len(texts)), key=lambda i: lengths[i])
+
+        results: List[List[str]] = [[] for _ in texts]
+        for start in range(0, len(order), self.max_batch_size):
+            chunk = order[start:start + self.max_batch_size]
+            with metrics.stage("model_tokenize", model_name, endpoint):
+                inputs = tokenizer([texts[i] for i in chunk], return_tensors="pt",
+                                   padding=True, **truncation).to(device)
+            with metrics.stage("model_generate", model_name, endpoint), torch.no_grad():
+                outputs = model.generate(
+                    inputs["input_ids"],
+                    attention_mask=inputs["attention_mask"],
+                    **gen_kwargs
+                )
+            with metrics.stage("model_decode", model_name, endpoint):
+                decoded = tokenizer.batch_decode(outputs, skip_special_tokens=True)
+            for pos, i in enumerate(chunk):
+                results[i] = decoded[pos * num_sequences:(pos + 1) * num_sequences]
+        return results
+
+
+# Общий планировщик на процесс; с серверами моделей батчи собираются на их стороне
+if MODEL_SERVERS:
+    from model_server import RemoteScheduler
+    scheduler = RemoteScheduler(MODEL_SERVERS, max_batch_size=_MAX_BATCH_SIZE)
+else:
+    scheduler = MicroBatchScheduler()
+
+
+def generate(model_name: str, texts: List[str], **kwargs) -> List[List[str]]:
+    """Генерация через общий планировщик микробатчей"""
+    return scheduler.generate(model_name, texts, **kwargs)
+
+
+def warmup(model_name: str, model_cls=None, tokenizer_cls=None):
+    """Прогрев модели там, где выполняется генерация"""
+    return scheduler.warmup(model_name, model_cls=model_cls, tokenizer_cls=tokenizer_cls)
@@ -0,0 +1,330 @@
+import asyncio
+import ipaddress
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from urllib.parse import urlsplit
+
+import executors
+import http_transport
+import metrics
+from admission import AdmissionRejected, QueueFull
+
+# Очередь заданий хранится в SQLite и переживает перезапуск (пустой путь - только в памяти процесса)
+_JOBS_PATH = os.environ.get("QYSQA_JOBS_PATH", "jobs.sqlite3")
+_WORKERS = int(os.environ.get("QYSQA_JOB_WORKERS", "4"))
+_MAX_QUEUED = int(os.environ.get("QYSQA_JOB_MAX_QUEUED", "1000"))
+_TTL_SECONDS = float(os.environ.get("QYSQA_JOB_TTL_SECONDS", str(7 * 24 * 3600)))
+# Возвращать ли в очередь прерванные задания при старте (при нескольких воркерах это делает serve.py)
+_RECOVER = os.environ.get("QYSQA_JOB_RECOVER", "1") != "0"
+# Сколько раз задание запускается, прежде чем отказ контроля допуска становится ошибкой задания
+_MAX_ATTEMPTS = int(os.environ.get("QYSQA_JOB_MAX_ATTEMPTS", "20"))
+# Хосты, на которые разрешены callback (через запятую); без списка - любые публичные адреса
+_CALLBACK_HOSTS = {h.strip().lower() for h in os.environ.get("QYSQA_JOB_CALLBACK_HOSTS", "").split(",") if h.strip()}
+_POLL_SECONDS = 1.0
+_MAX_BACKOFF_SECONDS = 30.0
+_CALLBACK_ATTEMPTS = 3
+# Пул для запросов к SQLite: ожидание блокировки файла не занимает цикл событий
+_POOL = "jobs"
+
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_SUCCEEDED = "succeeded"
+STATUS_FAILED = "failed"
+STATUSES = (STATUS_QUEUED, STATUS_RUNNING, STATUS_SUCCEEDED, STATUS_FAILED)
+
+ARTIFACTS = ("summary", "test_questions", "flashcards")
+
+_COLUMNS = ("id", "status", "text", "artifacts", "params", "callback_url", "result", "error", "attempts",
+            "created_at", "started_at", "finished_at", "run_after", "callback_status")
+
+
+def validate_callback_url(url: str):
+    """
+    Проверяет callback_url (ValueError, если нельзя): только http(s), и либо
+    хост из QYSQA_JOB_CALLBACK_HOSTS, либо хост, все адреса которого
+    публичные - иначе клиент мог бы заставить сервис слать запросы во внутреннюю сеть
+    """
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise ValueError("callback_url must be an http(s) URL")
+    host = parts.hostname.lower()
+    if _CALLBACK_HOSTS:
+        if host not in _CALLBACK_HOSTS:
+            raise ValueError("callback_url host is not allowed")
+        return
+    try:
+        infos = socket.getaddrinfo(host, parts.port or (443 if parts.scheme == "https" else 80),
+                                   proto=socket.IPPROTO_TCP)
+    except (socket.gaierror, UnicodeError):
+        raise ValueError("callback_url host cannot be resolved")
+    for info in infos:
+        address = ipaddress.ip_address(info[4][0].split("%")[0])
+        if not address.is_global:
+            raise ValueError("callback_url must point to a public address")
+
+
+class JobStore:
+    """Задания обработки лекций в SQLite: текст, запрошенные материалы, статус и результат"""
+
+    def __init__(self, path: Optional[str] = _JOBS_PATH):
+        self._db = sqlite3.connect(path or ":memory:", check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, status TEXT, text TEXT, artifacts TEXT, "
+            "params TEXT, callback_url TEXT, result TEXT, error TEXT, attempts INTEGER DEFAULT 0, "
+            "created_at REAL, started_at REAL, finished_at REAL, run_after REAL DEFAULT 0, callback_status TEXT)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+        self._db.commit()
+        self._lock = threading.Lock()
+
+    def add(self, text: str, artifacts: List[str], params: Dict[str, Any], callback_url: Optional[str]) -> str:
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO jobs (id, status, text, artifacts, params, callback_url, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, STATUS_QUEUED, text, json.dumps(artifacts), json.dumps(params), callback_url, time.time())
+            )
+            self._db.commit()
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._db.execute(f"SELECT {', '.join(_COLUMNS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(_COLUMNS, row))
+        for name in ("artifacts", "params", "result"):
+            job[name] = json.loads(job[name]) if job[name] else None
+        return job
+
+    def claim(self) -> Optional[Dict[str, Any]]:
+        """Берет самое старое задание из очереди, готовое к запуску"""
+        with self._lock:
+            while True:
+                row = self._db.execute(
+                    "SELECT id FROM jobs WHERE status = ? AND run_after <= ? ORDER BY created_at LIMIT 1",
+                    (STATUS_QUEUED, time.time())
+                ).fetchone()
+                if row is None:
+                    return None
+                # Очередь могут разбирать несколько процессов: задание достается тому, чей UPDATE прошел
+                cursor = self._db.execute(
+                    "UPDATE jobs SET status = ?, started_at = ?, attempts = attempts + 1 WHERE id = ? AND status = ?",
+                    (STATUS_RUNNING, time.time(), row[0], STATUS_QUEUED)
+                )
+                self._db.commit()
+                if cursor.rowcount:
+                    break
+        return self.get(row[0])
+
+    def finish(self, job_id: str, result: Optional[Dict[str, Any]] = None, error: Optional[str] = None):
+        status = STATUS_FAILED if error else STATUS_SUCCEEDED
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? WHERE id = ?",
+                (status, json.dumps(result) if result is not None else None, error, time.time(), job_id)
+            )
+            self._db.commit()
+
+    def requeue(self, job_id: str, delay: float = 0.0):
+        with self._lock:
+            self._db.execute("UPDATE jobs SET status = ?, run_after = ? WHERE id = ?",
+                             (STATUS_QUEUED, time.time() + delay, job_id))
+            self._db.commit()
+
+    def requeue_running(self) -> int:
+        """Задания, прерванные остановкой процесса, снова ставятся в очередь"""
+        with self._lock:
+            cursor = self._db.execute("UPDATE jobs SET status = ? WHERE status = ?", (STATUS_QUEUED, STATUS_RUNNING))
+            self._db.commit()
+            return cursor.rowcount
+
+    def set_callback_status(self, job_id: str, status: str):
+        with self._lock:
+            self._db.execute("UPDATE jobs SET callback_status = ? WHERE id = ?", (status, job_id))
+            self._db.commit()
+
+    def purge(self, ttl_seconds: float = _TTL_SECONDS) -> int:
+        """Удаляет завершенные задания старше ttl_seconds"""
+        with self._lock:
+            cursor = self._db.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?",
+                (STATUS_SUCCEEDED, STATUS_FAILED, time.time() - ttl_seconds)
+            )
+            self._db.commit()
+            return cursor.rowcount
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        counts = {status: 0 for status in STATUSES}
+        counts.update(dict(rows))
+        return counts
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class JobQueue:
+    """
+    Пул из workers обработчиков заданий в цикле событий сервиса. Задание
+    выполняет processor(text, artifacts, params) -> {материал: результат};
+    при перегрузке бэкенда (AdmissionRejected) задание возвращается в очередь
+    и повторяется через retry_after секунд
+    """
+
+    def __init__(self, store: JobStore, processor: Callable[..., Awaitable[Dict[str, Any]]],
+                 workers: int = _WORKERS, max_queued: int = _MAX_QUEUED):
+        self.store = store
+        self.processor = processor
+        self.workers = max(1, workers)
+        self.max_queued = max_queued
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._stopping = False
+
+    async def submit(self, text: str, artifacts: List[str], params: Dict[str, Any],
+                     callback_url: Optional[str] = None) -> str:
+        """Ставит задание в очередь и сразу возвращает его id (QueueFull, если очередь заполнена)"""
+        queued = (await executors.run_blocking(_POOL, self.store.counts))[STATUS_QUEUED]
+        if queued >= self.max_queued:
+            retry_after = max(1, queued // self.workers)
+            raise QueueFull("jobs", retry_after, "Too many queued jobs")
+        job_id = await executors.run_blocking(_POOL, self.store.add, text, artifacts, params, callback_url)
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return job_id
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return await executors.run_blocking(_POOL, self.store.get, job_id)
+
+    async def start(self, recover: bool = _RECOVER):
+        if recover:
+            requeued = await executors.run_blocking(_POOL, self.store.requeue_running)
+            if requeued:
+                print(f"Requeued {requeued} interrupted job(s)")
+        await executors.run_blocking(_POOL, self.store.purge)
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker(), name=f"job-worker-{i}") for i in range(self.workers)]
+
+    async def stop(self, timeout: float):
+        """Ждет завершения выполняющихся заданий; прерванные по таймауту вернутся в очередь"""
+        self._stopping = True
+        if self._wakeup is not None:
+            self._wakeup.set()
+        if self._tasks:
+            _, pending = await asyncio.wait(self._tasks, timeout=timeout)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _worker(self):
+        failures = 0
+        while not self._stopping:
+            try:
+                job = await executors.run_blocking(_POOL, self.store.claim)
+                if job is None:
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout=_POLL_SECONDS)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                await self._run(job)
+                failures = 0
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Например, "database is locked" при нескольких процессах: обработчик не должен остановиться
+                failures += 1
+                delay = min(_MAX_BACKOFF_SECONDS, _POLL_SECONDS * 2 ** failures)
+                print(f"Job worker error: {type(e).__name__}: {e}; retrying in {delay:.0f}s")
+                await asyncio.sleep(delay)
+
+    async def _run(self, job: Dict[str, Any]):
+        job_id = job["id"]
+        try:
+            result = await self.processor(job["text"], job["artifacts"], job["params"])
+        except asyncio.CancelledError:
+            # Остановка сервиса: задание будет выполнено заново после перезапуска.
+            # Пул еще работает (executors.shutdown вызывается после stop), а shield
+            # не дает повторной отмене прервать возврат задания в очередь
+            await asyncio.shield(executors.run_blocking(_POOL, self.store.requeue, job_id))
+            raise
+        except AdmissionRejected as e:
+            if job["attempts"] < _MAX_ATTEMPTS:
+                # Бэкенд перегружен: задание ждет в очереди, а не занимает обработчик
+                await executors.run_blocking(_POOL, self.store.requeue, job_id, delay=e.retry_after)
+                return
+            print(f"Job {job_id} failed: rejected by admission control {job['attempts']} times")
+            await executors.run_blocking(_POOL, self.store.finish, job_id,
+                                         error=f"{type(e).__name__}: {e} (after {job['attempts']} attempts)")
+        except Exception as e:
+            print(f"Job {job_id} failed: {e}")
+            await executors.run_blocking(_POOL, self.store.finish, job_id, error=f"{type(e).__name__}: {e}")
+        else:
+            await executors.run_blocking(_POOL, self.store.finish, job_id, result=result)
+        if job["callback_url"]:
+            await self._callback(job_id, job["callback_url"])
+
+    async def _callback(self, job_id: str, url: str):
+        """POST с итогом задания на callback_url (несколько попыток с паузой)"""
+        payload = public_view(await self.get(job_id))
+        status = "failed"
+        try:
+            # Адрес хоста мог измениться с момента создания задания
+            await executors.run_blocking(_POOL, validate_callback_url, url)
+        except ValueError as e:
+            status = f"rejected: {e}"
+        else:
+            for attempt in range(_CALLBACK_ATTEMPTS):
+                try:
+                    response = await http_transport.get_async_client().post(url, json=payload, timeout=10.0)
+                    if response.status_code < 500:
+                        status = "delivered" if response.is_success else f"rejected: {response.status_code}"
+                        break
+                    status = f"failed: {response.status_code}"
+                except Exception as e:
+                    status = f"failed: {type(e).__name__}"
+                if attempt + 1 < _CALLBACK_ATTEMPTS:
+                    await asyncio.sleep(2 ** attempt)
+        await executors.run_blocking(_POOL, self.store.set_callback_status, job_id, status)
+
+    async def stats(self) -> Dict[str, Any]:
+        stats = await executors.run_blocking(_POOL, self.store.counts)
+        stats["workers"] = self.workers
+        stats["max_queued"] = self.max_queued
+        return stats
+
+
+def public_view(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Задание для ответа клиенту: без исходного текста и служебных полей"""
+    return {
+        "job_id": job["id"],
+        "status": job["status"],
+        "artifacts": job["artifacts"],
+        "result": job["result"],
+        "error": job["error"],
+        "attempts": job["attempts"],
+        "created_at": job["created_at"],
+        "started_at": job["started_at"],
+        "finished_at": job["finished_at"],
+        "callback_status": job["callback_status"],
+    }
+
+
+def register_metrics(queue: JobQueue):
+    metrics.register(metrics.Gauge(
+        "qysqa_jobs", "Lecture processing jobs by status", ("status",),
+        lambda: {(status,): count for status, count in queue.store.counts().items()}
+    ))
@@ -0,0 +1,142 @@
+import json
+from typing import Any, Callable, List, Optional
+
+_WHITESPACE = " \t\r\n"
+# Символы, с которых может начинаться элемент массива; "[3] вопроса" в тексте массивом не считается
+_ELEMENT_START = '{["'
+
+
+class IncrementalJsonArrayParser:
+    """
+    Инкрементальный разбор JSON массива из потокового ответа модели.
+
+    Текст до массива (пояснения, ```json) пропускается, каждый элемент
+    возвращается сразу после закрытия, испорченные элементы пропускаются.
+    После limit принятых элементов или закрытия массива парсер останавливается
+    (done), и вызывающий код может прервать поток.
+    """
+
+    def __init__(self, limit: Optional[int] = None, validator: Optional[Callable[[Any], bool]] = None):
+        self.limit = limit
+        self.validator = validator
+        self.items: List[Any] = []
+        self.done = False
+
+        self._state = "seek"  # seek -> open -> array -> finished
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._element: List[str] = []
+
+    def feed(self, chunk: str) -> List[Any]:
+        """Обрабатывает очередной фрагмент; возвращает новые законченные элементы"""
+        new_items = []
+        for char in chunk:
+            if self.done:
+                break
+            if self._state == "seek":
+                if char == '[':
+                    self._state = "open"
+            elif self._state == "open":
+                # Проверяем, что после '[' действительно начинается JSON элемент
+                if char in _WHITESPACE:
+                    continue
+                if char == ']':
+                    self._finish()
+                elif char in _ELEMENT_START:
+                    self._state = "array"
+                    self._start_element(char)
+                else:
+                    self._state = "seek"
+            else:
+                self._consume(char, new_items)
+        return new_items
+
+    def _start_element(self, char):
+        self._element = [char]
+        self._depth = 1 if char in "{[" else 0
+        self._in_string = char == '"'
+        self._escape = False
+
+    def _consume(self, char, new_items):
+        if not self._element:
+            # Между элементами: пропускаем запятые и пробелы
+            if char == ']':
+                self._finish()
+            elif char not in _WHITESPACE and char != ',':
+                self._start_element(char)
+            return
+
+        if self._in_string:
+            self._element.append(char)
+            if self._escape:
+                self._escape = False
+            elif char == '\\':
+                self._escape = True
+            elif char == '"':
+                self._in_string = False
+                if self._depth == 0:
+                    self._emit(new_items)
+            return
+
+        if self._depth == 0 and char in ",]":
+            # Конец скалярного элемента (число, true/false/null)
+            self._emit(new_items)
+            if char == ']':
+                self._finish()
+            return
+
+        self._element.append(char)
+        if char == '"':
+            self._in_string = True
+        elif char in "{[":
+            self._depth += 1
+        elif char in "}]":
+            self._depth -= 1
+            if self._depth == 0:
+                self._emit(new_items)
+
+    def _emit(self, new_items):
+        raw = ''.join(self._element).strip()
+        self._element = []
+        try:
+            item = json.loads(raw)
+        except ValueError:
+            return
+        if self.validator is not None and not self.validator(item):
+            return
+        self.items.append(item)
+        new_items.append(item)
+        if self.limit is not None and len(self.items) >= self.limit:
+            self.done = True
+
+    def _finish(self):
+        self._state = "finished"
+        self.done = True
+
+    @property
+    def found_array(self) -> bool:
+        """Был ли в тексте найден JSON массив"""
+        return self._state in ("array", "finished")
+
+
+def parse_json_array(content: str, limit: Optional[int] = None,
+                     validator: Optional[Callable[[Any], bool]] = None) -> Optional[List[Any]]:
+    """Разбор готового ответа; None, если массив в тексте не найден"""
+    parser = IncrementalJsonArrayParser(limit=limit, validator=validator)
+    parser.feed(content)
+    if parser.found_array:
+        return parser.items
+    # Массив скаляров ([1, 2], [-1, true, null]) потоковый разбор не отличает от "[3] вопроса"
+    # в тексте, поэтому он принимается, только если весь ответ (без ```json) - это массив
+    body = content.strip()
+    if body.startswith("```"):
+        body = body[3:].removeprefix("json").removesuffix("```").strip()
+    try:
+        value = json.loads(body)
+    except ValueError:
+        return None
+    if not isinstance(value, list):
+        return None
+    items = [item for item in value if validator is None or validator(item)]
+    return items[:limit] if limit is not None else items
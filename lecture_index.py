@@ -0,0 +1,230 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, List, Optional, Tuple
+
+import numpy as np
+
+# Настройки индекса через переменные окружения
+_INDEX_PATH = os.environ.get("QYSQA_LECTURE_INDEX_PATH", "lecture_index.sqlite3")
+_THRESHOLD = float(os.environ.get("QYSQA_NEAR_DUPLICATE_THRESHOLD", "0.85"))
+
+# Параметры MinHash/LSH: 128 перестановок = 32 полосы по 4 строки
+_NUM_PERM = 128
+_BANDS = 32
+_SHINGLE_SIZE = 5
+_PRIME = 4294967291  # наибольшее простое < 2^32, поэтому a*h + b помещается в uint64
+_CHUNK = 8192
+
+_rng = np.random.RandomState(20240501)
+_PERM_A = _rng.randint(1, _PRIME, size=_NUM_PERM, dtype=np.uint64)
+_PERM_B = _rng.randint(0, _PRIME, size=_NUM_PERM, dtype=np.uint64)
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def has_words(text: str) -> bool:
+    """Есть ли в тексте слова: тексты без слов (пустой скан PDF) не индексируются и не сравниваются"""
+    return _WORD_RE.search(text) is not None
+
+
+def _shingle_hashes(text: str) -> np.ndarray:
+    """32-битные хеши словесных k-грамм текста (текст должен содержать слова)"""
+    words = _WORD_RE.findall(text.lower())
+    if not words:
+        raise ValueError("Text has no words to index")
+    k = min(_SHINGLE_SIZE, len(words))
+    shingles = {" ".join(words[i:i + k]) for i in range(len(words) - k + 1)}
+    return np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles))
+
+
+def minhash_signature(text: str) -> np.ndarray:
+    """MinHash-сигнатура текста (numpy, по частям, чтобы ограничить память)"""
+    hashes = _shingle_hashes(text)
+    signature = np.full(_NUM_PERM, _PRIME, dtype=np.uint64)
+    for start in range(0, len(hashes), _CHUNK):
+        chunk = hashes[start:start + _CHUNK]
+        values = (np.outer(_PERM_A, chunk) + _PERM_B[:, None]) % _PRIME
+        np.minimum(signature, values.min(axis=1), out=signature)
+    return signature.astype(np.uint32)
+
+
+def _band_buckets(signature: np.ndarray):
+    """Хеши полос сигнатуры для LSH"""
+    rows = _NUM_PERM // _BANDS
+    for band in range(_BANDS):
+        chunk = signature[band * rows:(band + 1) * rows].tobytes()
+        bucket = int.from_bytes(hashlib.blake2b(chunk, digest_size=8).digest(), "big", signed=True)
+        yield band, bucket
+
+
+class LectureIndex:
+    """
+    Индекс загруженных лекций для поиска почти-дубликатов (MinHash + LSH)
+    с хранением сгенерированных для них материалов в SQLite
+    """
+
+    def __init__(self, path: str = _INDEX_PATH, threshold: float = _THRESHOLD):
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        # Недавно посчитанные сигнатуры, чтобы lookup и remember не считали их дважды
+        self._recent: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS lectures (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                content_hash TEXT UNIQUE,
+                signature BLOB,
+                created_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS lsh (
+                band INTEGER,
+                bucket INTEGER,
+                lecture_id INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS lsh_bucket ON lsh (band, bucket);
+            CREATE TABLE IF NOT EXISTS artifacts (
+                lecture_id INTEGER,
+                kind TEXT,
+                params TEXT,
+                value TEXT,
+                created_at REAL,
+                PRIMARY KEY (lecture_id, kind, params)
+            );
+        """)
+        self._db.commit()
+
+    def _fingerprint(self, text: str) -> Tuple[str, np.ndarray]:
+        content_hash = hashlib.sha256(" ".join(text.split()).encode("utf-8")).hexdigest()
+        with self._lock:
+            signature = self._recent.get(content_hash)
+            if signature is not None:
+                self._recent.move_to_end(content_hash)
+                return content_hash, signature
+        signature = minhash_signature(text)
+        with self._lock:
+            self._recent[content_hash] = signature
+            if len(self._recent) > 128:
+                self._recent.popitem(last=False)
+        return content_hash, signature
+
+    def _matches(self, text: str, threshold: float, kind: Optional[str] = None,
+                 params: Any = None) -> List[Tuple[int, float, Optional[str]]]:
+        """
+        Похожие лекции (id, сходство, материал) по убыванию сходства. Если задан kind,
+        учитываются только лекции, для которых есть материал kind с параметрами params
+        """
+        if not has_words(text):
+            return []
+        content_hash, signature = self._fingerprint(text)
+        if kind is None:
+            select, join, args = "SELECT l.id, l.signature, NULL FROM lectures l", "", ()
+        else:
+            select = "SELECT l.id, l.signature, a.value FROM lectures l"
+            join = " JOIN artifacts a ON a.lecture_id = l.id AND a.kind = ? AND a.params = ?"
+            args = (kind, json.dumps(params))
+
+        with self._lock:
+            matches = []
+            exact = self._db.execute(f"{select}{join} WHERE l.content_hash = ?", args + (content_hash,)).fetchone()
+            if exact is not None:
+                matches.append((exact[0], 1.0, exact[2]))
+
+            candidates = set()
+            for band, bucket in _band_buckets(signature):
+                for (lecture_id,) in self._db.execute(
+                        "SELECT lecture_id FROM lsh WHERE band = ? AND bucket = ?", (band, bucket)):
+                    candidates.add(lecture_id)
+            candidates.discard(exact[0] if exact is not None else None)
+
+            for lecture_id in candidates:
+                row = self._db.execute(f"{select}{join} WHERE l.id = ?", args + (lecture_id,)).fetchone()
+                if row is None:
+                    continue
+                similarity = float(np.mean(np.frombuffer(row[1], dtype=np.uint32) == signature))
+                if similarity >= threshold:
+                    matches.append((lecture_id, similarity, row[2]))
+        matches.sort(key=lambda match: match[1], reverse=True)
+        return matches
+
+    def find_similar(self, text: str, threshold: Optional[float] = None, kind: Optional[str] = None,
+                     params: Any = None) -> Optional[Tuple[int, float]]:
+        """
+        Самая похожая из ранее обработанных лекций: (id, оценка сходства Жаккара).
+        С kind - самая похожая из тех, для которых уже есть такой материал
+        """
+        matches = self._matches(text, self.threshold if threshold is None else threshold, kind, params)
+        return matches[0][:2] if matches else None
+
+    def add(self, text: str) -> int:
+        """Добавление лекции в индекс; возвращает ее id (ValueError для текста без слов)"""
+        content_hash, signature = self._fingerprint(text)
+        with self._lock, self._transaction():
+            return self._add_locked(content_hash, signature)
+
+    @contextmanager
+    def _transaction(self):
+        """
+        Транзакция записи: с BEGIN IMMEDIATE процессы serve.py с общим файлом
+        индекса добавляют одну и ту же лекцию по очереди, а не с IntegrityError
+        """
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self._db.rollback()
+            raise
+        self._db.commit()
+
+    def _add_locked(self, content_hash: str, signature: np.ndarray) -> int:
+        cursor = self._db.execute(
+            "INSERT OR IGNORE INTO lectures (content_hash, signature, created_at) VALUES (?, ?, ?)",
+            (content_hash, signature.tobytes(), time.time())
+        )
+        if cursor.rowcount == 1:
+            self._db.executemany(
+                "INSERT INTO lsh (band, bucket, lecture_id) VALUES (?, ?, ?)",
+                [(band, bucket, cursor.lastrowid) for band, bucket in _band_buckets(signature)]
+            )
+            return cursor.lastrowid
+        # Лекция уже есть (возможно, ее только что добавил другой процесс)
+        return self._db.execute("SELECT id FROM lectures WHERE content_hash = ?", (content_hash,)).fetchone()[0]
+
+    def lookup(self, text: str, kind: str, params: Any = None, min_items: Optional[int] = None) -> Optional[Any]:
+        """
+        Готовый материал (summary, test_questions, flashcards) почти такой же лекции.
+        Для списков min_items задает минимально нужное количество элементов
+        """
+        for lecture_id, similarity, raw in self._matches(text, self.threshold, kind, params):
+            value = json.loads(raw)
+            if min_items is not None:
+                if not isinstance(value, list) or len(value) < min_items:
+                    continue
+                value = value[:min_items]
+            print(f"Reusing {kind} of lecture {lecture_id} (similarity {similarity:.2f})")
+            return value
+        return None
+
+    def remember(self, text: str, kind: str, value: Any, params: Any = None):
+        """Сохранение сгенерированного материала для лекции (текст без слов не сохраняется)"""
+        if not has_words(text):
+            return
+        content_hash, signature = self._fingerprint(text)
+        with self._lock, self._transaction():
+            lecture_id = self._add_locked(content_hash, signature)
+            self._db.execute(
+                "INSERT OR REPLACE INTO artifacts (lecture_id, kind, params, value, created_at) VALUES (?, ?, ?, ?, ?)",
+                (lecture_id, kind, json.dumps(params), json.dumps(value, ensure_ascii=False), time.time())
+            )
+
+    def size(self) -> int:
+        """Количество лекций в индексе"""
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM lectures").fetchone()[0]
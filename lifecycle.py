@@ -0,0 +1,157 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+# Локальные модели, которые нужно загрузить до того, как сервис станет готов
+_WARMUP_MODELS = [name.strip() for name in os.environ.get("QYSQA_WARMUP_MODELS", "").split(",") if name.strip()]
+_WARMUP_WORKERS = int(os.environ.get("QYSQA_WARMUP_WORKERS", "0"))
+# Сколько ждать завершения запросов при остановке и сколько держать готовность снятой до нее (в секундах)
+DRAIN_TIMEOUT = float(os.environ.get("QYSQA_DRAIN_TIMEOUT", "30"))
+DRAIN_DELAY = float(os.environ.get("QYSQA_DRAIN_DELAY", "5"))
+
+STATE_PENDING = "pending"
+STATE_LOADING = "loading"
+STATE_READY = "ready"
+STATE_FAILED = "failed"
+
+
+def _model_classes(model_name: str):
+    """Классы модели и токенизатора, с которыми модель загружают модули генерации"""
+    from transformers import BartForConditionalGeneration, BartTokenizer, T5ForConditionalGeneration, T5Tokenizer
+    import options
+    import question_answer
+    import summarizing
+
+    known = {
+        question_answer.MODEL_NAME: (T5ForConditionalGeneration, T5Tokenizer),
+        options.MODEL_NAME: (T5ForConditionalGeneration, T5Tokenizer),
+        summarizing.MODEL_NAME: (BartForConditionalGeneration, BartTokenizer),
+    }
+    return known.get(model_name, (None, None))
+
+
+class Lifecycle:
+    """
+    Фазы жизни процесса: фоновый прогрев локальных моделей (параллельно по
+    моделям), готовность к приему запросов и плавная остановка с ожиданием
+    запросов, которые еще обрабатываются
+    """
+
+    def __init__(self, warmup_models: Optional[List[str]] = None, warmup_workers: int = _WARMUP_WORKERS):
+        self.warmup_models = list(warmup_models if warmup_models is not None else _WARMUP_MODELS)
+        self.warmup_workers = warmup_workers or max(1, len(self.warmup_models))
+        self.draining = False
+        self.started_at = time.time()
+        self._models: Dict[str, Dict[str, Any]] = {name: {"state": STATE_PENDING} for name in self.warmup_models}
+        self._in_flight = 0
+        self._cond = threading.Condition()
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def start_warmup(self):
+        """Запускает загрузку моделей в фоне; импорт и старт сервера не ждут ее"""
+        if not self.warmup_models or self._executor is not None:
+            return
+        self._executor = ThreadPoolExecutor(max_workers=self.warmup_workers, thread_name_prefix="warmup")
+        for name in self.warmup_models:
+            self._executor.submit(self._warm, name)
+
+    def _warm(self, model_name: str):
+        self._set_state(model_name, state=STATE_LOADING)
+        start = time.monotonic()
+        try:
+            import inference_scheduler
+
+            # Модель грузится там, где идет генерация: в этом процессе или на сервере моделей
+            model_cls, tokenizer_cls = _model_classes(model_name)
+            inference_scheduler.warmup(model_name, model_cls=model_cls, tokenizer_cls=tokenizer_cls)
+        except Exception as e:
+            print(f"Warmup of {model_name} failed: {e}")
+            self._set_state(model_name, state=STATE_FAILED, error=str(e))
+            return
+        seconds = round(time.monotonic() - start, 2)
+        print(f"Model {model_name} warmed up in {seconds}s")
+        self._set_state(model_name, state=STATE_READY, seconds=seconds)
+
+    def _set_state(self, model_name: str, **fields):
+        with self._cond:
+            self._models[model_name] = fields
+
+    def is_ready(self) -> bool:
+        with self._cond:
+            return not self.draining and all(m["state"] == STATE_READY for m in self._models.values())
+
+    def status(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "ready": not self.draining and all(m["state"] == STATE_READY for m in self._models.values()),
+                "draining": self.draining,
+                "in_flight": self._in_flight,
+                "uptime_seconds": round(time.time() - self.started_at, 1),
+                "models": {name: dict(info) for name, info in self._models.items()},
+            }
+
+    def request_started(self):
+        with self._cond:
+            self._in_flight += 1
+
+    def request_finished(self):
+        with self._cond:
+            self._in_flight -= 1
+            if self._in_flight == 0:
+                self._cond.notify_all()
+
+    def begin_draining(self):
+        """Снимает готовность: новые запросы еще обслуживаются, но балансировщик перестает их слать"""
+        with self._cond:
+            if not self.draining:
+                print(f"Draining: waiting for {self._in_flight} in-flight request(s)")
+            self.draining = True
+
+    def wait_idle(self, timeout: float = DRAIN_TIMEOUT) -> bool:
+        """Блокирующее ожидание завершения всех запросов; False, если истек таймаут"""
+        with self._cond:
+            return self._cond.wait_for(lambda: self._in_flight == 0, timeout)
+
+    async def drain(self, timeout: float = DRAIN_TIMEOUT) -> bool:
+        """То же ожидание без блокировки цикла событий"""
+        self.begin_draining()
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._cond:
+                if self._in_flight == 0:
+                    return True
+            await asyncio.sleep(0.05)
+        return False
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class InFlightMiddleware:
+    """
+    ASGI middleware для учета запросов в обработке; потоковый ответ
+    считается завершенным после отправки последнего фрагмента
+    """
+
+    def __init__(self, app, lifecycle: Lifecycle, skip_prefix: str = "/health/"):
+        self.app = app
+        self.lifecycle = lifecycle
+        self.skip_prefix = skip_prefix
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(self.skip_prefix):
+            await self.app(scope, receive, send)
+            return
+        self.lifecycle.request_started()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.lifecycle.request_finished()
+
+
+# Общее состояние процесса
+lifecycle = Lifecycle()
@@ -1,14 +1,67 @@
-from fastapi import FastAPI, File, UploadFile, Form, Query
-from fastapi.responses import JSONResponse
+import asyncio
+import json
+import os
+import threading
+import time
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, File, UploadFile, Form, Query, Header, HTTPException, Response
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
 from typing import List, Dict, Any, Optional
 import uvicorn
-from ai_generators import ContentGenerator
+from ai_generators import AsyncContentGenerator
+import executors
+import http_transport
+import jobs
+import metrics
+import tracing
+import admission
+from admission import BACKEND_UPSTREAM, AdmissionRejected, admit
+from lecture_index import LectureIndex
+from lifecycle import DRAIN_DELAY, DRAIN_TIMEOUT, InFlightMiddleware, lifecycle
+from tier_router import TIER_REMOTE, TierRouter
 
-app = FastAPI(title="Educational Content API", description="API для генерации образовательного контента")
+@asynccontextmanager
+async def lifespan(app):
+    # Модели грузятся в фоне: сервер сразу отвечает на /health/live, а /health/ready - после прогрева
+    lifecycle.start_warmup()
+    await job_queue.start()
+    yield
+    if not await lifecycle.drain(DRAIN_TIMEOUT):
+        print("Warning: shutting down with in-flight requests")
+    # Незавершенные задания останутся в очереди и выполнятся после перезапуска
+    await job_queue.stop(DRAIN_TIMEOUT)
+    lifecycle.shutdown()
+    executors.shutdown()
+    await http_transport.aclose()
 
-# Инициализация генератора контента
-content_generator = ContentGenerator()
+app = FastAPI(title="Educational Content API", description="API для генерации образовательного контента",
+              lifespan=lifespan)
+app.add_middleware(InFlightMiddleware, lifecycle=lifecycle)
+app.add_middleware(tracing.TracingMiddleware)
+app.add_middleware(metrics.MetricsMiddleware)
+
+@app.exception_handler(AdmissionRejected)
+async def admission_rejected(request, exc: AdmissionRejected):
+    # Быстрый отказ вместо долгого ожидания: клиент повторит запрос позже
+    return JSONResponse(status_code=exc.status_code, content={"detail": exc.detail},
+                        headers={"Retry-After": str(exc.retry_after)})
+
+# Инициализация генератора контента (асинхронный клиент не блокирует цикл событий)
+content_generator = AsyncContentGenerator()
+
+# Выбор между удаленной моделью и локальными t5 под бюджет задержки запроса
+tier_router = TierRouter(content_generator)
+
+# Индекс почти-дубликатов лекций (пустой QYSQA_LECTURE_INDEX_PATH отключает его)
+_index_path = os.environ.get("QYSQA_LECTURE_INDEX_PATH", "lecture_index.sqlite3")
+lecture_index = LectureIndex(_index_path) if _index_path else None
+
+# Ответы генератора, которые не стоит сохранять для повторного использования
+_FAILED_SUMMARIES = {"No summary generated.", "Error generating summary."}
+
+# Общий таймаут на генерацию всех типов контента в /all-in-one (в секундах)
+ALL_IN_ONE_TIMEOUT = float(os.environ.get("QYSQA_ALL_IN_ONE_TIMEOUT", "60"))
 
 class MLResponse(BaseModel):
     text: str
@@ -17,14 +70,27 @@ class MLResponse(BaseModel):
 class TestRequest(BaseModel):
     text: str
     num_questions: int = 5
+    bypass_cache: bool = False
+    latency_budget_ms: Optional[float] = None
 
 class FlashcardRequest(BaseModel):
     text: str
     num_cards: int = 5
+    bypass_cache: bool = False
 
 class SummaryRequest(BaseModel):
     text: str
     max_length: int = 300
+    bypass_cache: bool = False
+
+class JobRequest(BaseModel):
+    text: str
+    artifacts: List[str] = ["summary"]
+    num_questions: int = 5
+    num_flashcards: int = 5
+    max_length: int = 300
+    bypass_cache: bool = False
+    callback_url: Optional[str] = None
 
 class TestQuestion(BaseModel):
     question: str
@@ -35,15 +101,46 @@ class Flashcard(BaseModel):
     front: str
     back: str
 
+def _is_reusable(result) -> bool:
+    if isinstance(result, str):
+        return result not in _FAILED_SUMMARIES
+    return bool(result)
+
+async def _reuse_or_generate(text, kind, generate, bypass_cache=False, params=None, min_items=None,
+                             remember_if=None, backend=None):
+    """Материал почти такой же лекции из индекса или новая генерация (со слотом бэкенда, если он указан)"""
+    # Подписи MinHash длинной лекции считаются десятки миллисекунд - вне цикла событий
+    if lecture_index is not None and not bypass_cache:
+        reused = await executors.run_blocking(executors.POOL_CPU, lecture_index.lookup, text, kind,
+                                              params=params, min_items=min_items)
+        if reused is not None:
+            return reused
+
+    if backend is None:
+        result = await generate()
+    else:
+        async with admit(backend):
+            result = await generate()
+    if lecture_index is not None and _is_reusable(result) and (remember_if is None or remember_if()):
+        await executors.run_blocking(executors.POOL_CPU, lecture_index.remember, text, kind, result, params=params)
+    return result
+
 @app.post("/summarize", response_model=MLResponse)
-async def summarize(file: UploadFile = File(...)):
+async def summarize(file: UploadFile = File(...), bypass_cache: bool = Query(False)):
     """Суммаризация текста из файла"""
+    metrics.request_parsed()
     # Читаем содержимое файла
-    content = await file.read()
-    text = content.decode("utf-8")
+    with metrics.stage("file_read"):
+        content = await file.read()
+    with metrics.stage("text_decode"):
+        text = content.decode("utf-8")
     
-    # Генерация саммаризации с помощью модели
-    summary = content_generator.generate_summary(text)
+    # Генерация саммаризации с помощью модели (или повторное использование для почти такой же лекции)
+    summary = await _reuse_or_generate(
+        text, "summary",
+        lambda: content_generator.generate_summary(text, bypass_cache=bypass_cache),
+        bypass_cache=bypass_cache, params=300, backend=BACKEND_UPSTREAM
+    )
     
     # Возвращаем результат
     return MLResponse(
@@ -52,19 +149,44 @@ async def summarize(file: UploadFile = File(...)):
     )
 
 @app.post("/generate-test", response_model=List[TestQuestion])
-async def generate_test(request: TestRequest):
+async def generate_test(request: TestRequest, response: Response):
     """Генерация тестовых вопросов на основе текста"""
-    # Генерация тестовых вопросов
-    questions = content_generator.generate_tests(request.text, request.num_questions)
+    metrics.request_parsed()
+    questions, tier = await _generate_tests(request.text, request.num_questions, request.latency_budget_ms,
+                                            request.bypass_cache)
+    response.headers["X-Served-Tier"] = tier or "none"
     
     # Возвращаем результат
     return questions
 
+async def _generate_tests(text, num_questions, latency_budget_ms=None, bypass_cache=False):
+    """Тестовые вопросы и уровень, который их дал ("index" - повторное использование)"""
+    served = {"tier": "index"}
+
+    async def generate():
+        questions, served["tier"] = await tier_router.generate_tests(
+            text, num_questions, latency_budget_ms, bypass_cache
+        )
+        return questions
+
+    # Генерация тестовых вопросов; для повторного использования сохраняются только ответы удаленной модели
+    questions = await _reuse_or_generate(
+        text, "test_questions", generate,
+        bypass_cache=bypass_cache, min_items=num_questions,
+        remember_if=lambda: served["tier"] == TIER_REMOTE
+    )
+    return questions, served["tier"]
+
 @app.post("/generate-flashcards", response_model=List[Flashcard])
 async def generate_flashcards(request: FlashcardRequest):
     """Генерация флеш-карточек на основе текста"""
+    metrics.request_parsed()
     # Генерация флеш-карточек
-    flashcards = content_generator.generate_flashcards(request.text, request.num_cards)
+    flashcards = await _reuse_or_generate(
+        request.text, "flashcards",
+        lambda: content_generator.generate_flashcards(request.text, request.num_cards, request.bypass_cache),
+        bypass_cache=request.bypass_cache, min_items=request.num_cards, backend=BACKEND_UPSTREAM
+    )
     
     # Возвращаем результат
     return flashcards
@@ -72,31 +194,257 @@ async def generate_flashcards(request: FlashcardRequest):
 @app.post("/generate-summary", response_model=str)
 async def generate_summary(request: SummaryRequest):
     """Генерация краткого содержания текста"""
+    metrics.request_parsed()
     # Генерация краткого содержания
-    summary = content_generator.generate_summary(request.text, request.max_length)
+    summary = await _reuse_or_generate(
+        request.text, "summary",
+        lambda: content_generator.generate_summary(request.text, request.max_length, request.bypass_cache),
+        bypass_cache=request.bypass_cache, params=request.max_length, backend=BACKEND_UPSTREAM
+    )
     
     # Возвращаем результат
     return summary
 
+def _sse(data, event: Optional[str] = None) -> str:
+    """Форматирование одного server-sent event"""
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+class _AdmittedStreamingResponse(StreamingResponse):
+    """Потоковый ответ, который освобождает слот допуска после отправки, даже если тело так и не начало читаться"""
+
+    def __init__(self, content, release, **kwargs):
+        super().__init__(content, **kwargs)
+        self._release = release
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self._release()
+
+async def _event_stream(events):
+    """
+    Ответ в формате SSE; ошибки генерации передаются отдельным событием.
+    Слот внешнего API занимается до начала ответа (чтобы отказ пришел как 429/503)
+    и освобождается после последнего события или обрыва соединения
+    """
+    limiter = admission.limiters[BACKEND_UPSTREAM]
+    await limiter.acquire()
+    start = time.monotonic()
+
+    async def body():
+        try:
+            async for data in events:
+                yield _sse(data)
+            yield _sse({}, event="done")
+        except Exception as e:
+            print(f"Error while streaming: {e}")
+            yield _sse({"detail": str(e)}, event="error")
+        finally:
+            # Закрытие генератора событий закрывает и поток ответа API
+            await events.aclose()
+
+    return _AdmittedStreamingResponse(
+        body(),
+        lambda: limiter.release(time.monotonic() - start),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post("/generate-summary/stream")
+async def generate_summary_stream(request: SummaryRequest):
+    """Потоковая генерация краткого содержания (SSE, по фрагментам текста)"""
+    metrics.request_parsed()
+    async def events():
+        async for delta in content_generator.stream_summary(request.text, request.max_length, request.bypass_cache):
+            yield {"delta": delta}
+
+    return await _event_stream(events())
+
+@app.post("/generate-test/stream")
+async def generate_test_stream(request: TestRequest):
+    """Потоковая генерация тестовых вопросов (SSE, по одному вопросу)"""
+    metrics.request_parsed()
+    return await _event_stream(
+        content_generator.stream_items(request.text, "test", request.num_questions, request.bypass_cache)
+    )
+
+@app.post("/generate-flashcards/stream")
+async def generate_flashcards_stream(request: FlashcardRequest):
+    """Потоковая генерация флеш-карточек (SSE, по одной карточке)"""
+    metrics.request_parsed()
+    return await _event_stream(
+        content_generator.stream_items(request.text, "flashcard", request.num_cards, request.bypass_cache)
+    )
+
 @app.post("/all-in-one")
 async def generate_all(
     text: str = Form(...),
     num_questions: int = Form(3),
-    num_flashcards: int = Form(3)
+    num_flashcards: int = Form(3),
+    bypass_cache: bool = Form(False)
 ):
     """Генерация всех типов контента за один запрос"""
-    # Генерация всех типов контента
-    summary = content_generator.generate_summary(text)
-    questions = content_generator.generate_tests(text, num_questions)
-    flashcards = content_generator.generate_flashcards(text, num_flashcards)
+    metrics.request_parsed()
+    # Почти такая же лекция уже обрабатывалась - возвращаем ее материалы
+    if lecture_index is not None and not bypass_cache:
+        reused = await executors.run_blocking(executors.POOL_CPU, lambda: {
+            "summary": lecture_index.lookup(text, "summary", params=300),
+            "test_questions": lecture_index.lookup(text, "test_questions", min_items=num_questions),
+            "flashcards": lecture_index.lookup(text, "flashcards", min_items=num_flashcards)
+        })
+        if all(value is not None for value in reused.values()):
+            return reused
+
+    # Резюме, тесты и карточки одним запросом к модели (с общим таймаутом);
+    # отдельные запросы выполняются только для частей, не прошедших проверку.
+    # Каждый запрос к API (и каждый из параллельных отдельных) занимает свой слот допуска
+    try:
+        result = await asyncio.wait_for(
+            content_generator.generate_all(text, num_questions, num_flashcards, bypass_cache=bypass_cache,
+                                           slot=lambda: admit(BACKEND_UPSTREAM)),
+            timeout=ALL_IN_ONE_TIMEOUT
+        )
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Content generation timed out")
+
+    if lecture_index is not None:
+        for kind, params in (("summary", 300), ("test_questions", None), ("flashcards", None)):
+            if _is_reusable(result[kind]):
+                await executors.run_blocking(executors.POOL_CPU, lecture_index.remember, text, kind, result[kind],
+                                             params=params)
     
     # Возвращаем результат
     return {
-        "summary": summary,
-        "test_questions": questions,
-        "flashcards": flashcards
+        "summary": result["summary"],
+        "test_questions": result["test_questions"],
+        "flashcards": result["flashcards"]
+    }
+
+async def _process_job(text, artifacts, params):
+    """Материалы лекции для задания: те же пути генерации, что и у синхронных эндпоинтов"""
+    bypass_cache = params.get("bypass_cache", False)
+    generators = {
+        "summary": lambda: _reuse_or_generate(
+            text, "summary",
+            lambda: content_generator.generate_summary(text, params["max_length"], bypass_cache),
+            bypass_cache=bypass_cache, params=params["max_length"], backend=BACKEND_UPSTREAM
+        ),
+        "test_questions": lambda: _generate_tests(text, params["num_questions"], bypass_cache=bypass_cache),
+        "flashcards": lambda: _reuse_or_generate(
+            text, "flashcards",
+            lambda: content_generator.generate_flashcards(text, params["num_flashcards"], bypass_cache),
+            bypass_cache=bypass_cache, min_items=params["num_flashcards"], backend=BACKEND_UPSTREAM
+        ),
+    }
+    results = await asyncio.gather(*(generators[kind]() for kind in artifacts))
+    result = dict(zip(artifacts, results))
+    if "test_questions" in result:
+        result["test_questions"] = result["test_questions"][0]
+    return result
+
+# Очередь заданий обработки лекций (SQLite, переживает перезапуск)
+job_queue = jobs.JobQueue(jobs.JobStore(), _process_job)
+jobs.register_metrics(job_queue)
+
+@app.post("/jobs", status_code=202)
+async def create_job(request: JobRequest):
+    """Ставит лекцию в очередь обработки и сразу возвращает id задания"""
+    metrics.request_parsed()
+    artifacts = list(dict.fromkeys(request.artifacts))
+    unknown = [kind for kind in artifacts if kind not in jobs.ARTIFACTS]
+    if not artifacts or unknown:
+        raise HTTPException(status_code=422, detail=f"artifacts must be a subset of {list(jobs.ARTIFACTS)}")
+    if request.callback_url:
+        try:
+            # Проверка разрешает имя хоста, поэтому выполняется вне цикла событий
+            await executors.run_blocking(executors.POOL_CPU, jobs.validate_callback_url, request.callback_url)
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+
+    params = {
+        "num_questions": request.num_questions,
+        "num_flashcards": request.num_flashcards,
+        "max_length": request.max_length,
+        "bypass_cache": request.bypass_cache,
+    }
+    job_id = await job_queue.submit(request.text, artifacts, params, request.callback_url)
+    return {"job_id": job_id, "status": jobs.STATUS_QUEUED, "status_url": f"/jobs/{job_id}"}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Статус задания и, после завершения, его результат"""
+    job = await job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return jobs.public_view(job)
+
+@app.get("/health/live")
+async def health_live():
+    """Процесс жив и обрабатывает запросы"""
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+async def health_ready():
+    """Готовность принимать трафик: модели прогреты и остановка не начата"""
+    status = lifecycle.status()
+    return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    """Метрики в текстовом формате Prometheus"""
+    # Часть датчиков (например, задания по статусам) читает SQLite - не в цикле событий
+    text = await executors.run_blocking(executors.POOL_CPU, metrics.render)
+    return PlainTextResponse(text, media_type="text/plain; version=0.0.4")
+
+@app.get("/traces/{trace_id}")
+async def get_trace(trace_id: str, trace_token: Optional[str] = Query(None),
+                    x_qysqa_trace_token: Optional[str] = Header(None)):
+    """Трасса запроса в формате Chrome trace (id из заголовка X-Qysqa-Trace-Id)"""
+    if not tracing.authorized(x_qysqa_trace_token or trace_token):
+        raise HTTPException(status_code=403, detail="Trace token required")
+    trace = tracing.store.get(trace_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail="Trace not found")
+    return trace
+
+@app.get("/stats")
+async def stats():
+    """Внутренняя статистика сервиса"""
+    return {
+        "cache": content_generator.cache.stats(),
+        "router": tier_router.stats(),
+        "http": http_transport.stats(),
+        "resilience": content_generator.resilience.stats(),
+        "admission": admission.stats(),
+        "jobs": await job_queue.stats(),
+        "executors": executors.stats(),
+        "lecture_index": ({"lectures": await executors.run_blocking(executors.POOL_CPU, lecture_index.size)}
+                          if lecture_index is not None else None)
     }
 
+class _DrainingServer(uvicorn.Server):
+    """
+    По сигналу остановки сначала снимает готовность и ждет завершения текущих
+    генераций, и только потом останавливает сервер; повторный сигнал - немедленно
+    """
+
+    def handle_exit(self, sig, frame):
+        if lifecycle.draining:
+            super().handle_exit(sig, frame)
+            return
+        lifecycle.begin_draining()
+        threading.Thread(target=self._drain_and_exit, args=(sig, frame), daemon=True).start()
+
+    def _drain_and_exit(self, sig, frame):
+        # Даем балансировщику увидеть /health/ready = 503 до закрытия сокета
+        time.sleep(DRAIN_DELAY)
+        if not lifecycle.wait_idle(DRAIN_TIMEOUT):
+            print("Warning: drain timeout expired, stopping anyway")
+        super().handle_exit(sig, frame)
+
 if __name__ == "__main__":
     print("Запуск сервера генерации образовательного контента...")
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    executors.set_switch_interval()
+    _DrainingServer(uvicorn.Config(app, host="0.0.0.0", port=8000)).run()
\ No newline at end of file
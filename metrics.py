@@ -0,0 +1,219 @@
+import contextvars
+import threading
+import time
+from typing import Callable, Dict, Iterable, Tuple
+
+import tracing
+
+# Эндпоинт текущего запроса: метки стадий берутся из контекста, а не передаются по цепочке вызовов
+current_endpoint: contextvars.ContextVar[str] = contextvars.ContextVar("qysqa_endpoint", default="-")
+_request_start: contextvars.ContextVar[float] = contextvars.ContextVar("qysqa_request_start", default=0.0)
+
+_STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {value}"
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labelnames: Iterable[str] = (), buckets=_STAGE_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # Для каждого набора меток: счетчики по корзинам (не накопительные), сумма и количество
+        self._series: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = i
+                break
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            items = [(key, list(s[0]), s[1], s[2]) for key, s in self._series.items()]
+        for key, counts, total, count in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = 'le="%s"' % bound
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}"
+            le = 'le="+Inf"'
+            yield f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {count}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, key)} {count}"
+
+
+class Gauge:
+    """Значение снимается функцией в момент выдачи метрик: {(метки): значение}"""
+
+    def __init__(self, name: str, help_text: str, labelnames: Iterable[str], collect: Callable[[], Dict]):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.collect = collect
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} gauge"
+        for key, value in self.collect().items():
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {value}"
+
+
+requests_total = Counter("qysqa_requests_total", "HTTP requests by endpoint and status", ("endpoint", "status"))
+request_seconds = Histogram("qysqa_request_seconds", "HTTP request latency", ("endpoint",))
+stage_seconds = Histogram("qysqa_stage_seconds", "Latency of pipeline stages", ("stage", "endpoint", "mode"))
+upstream_tokens = Counter("qysqa_upstream_tokens_total", "Tokens reported by the upstream API usage",
+                          ("endpoint", "mode", "kind"))
+fallbacks_total = Counter("qysqa_fallbacks_total", "Fallbacks to another generation path",
+                          ("endpoint", "mode", "reason"))
+
+_registry = [requests_total, request_seconds, stage_seconds, upstream_tokens, fallbacks_total]
+
+
+def register(metric):
+    """Добавляет метрику (например, Gauge с состоянием очередей) в выдачу /metrics"""
+    _registry.append(metric)
+    return metric
+
+
+class stage:
+    """
+    Контекст для измерения одной стадии обработки (в трассируемом запросе
+    стадия также становится спаном трассы):
+
+        with metrics.stage("model_generate", mode=model_name):
+            ...
+    """
+
+    __slots__ = ("name", "mode", "endpoint", "start", "scope")
+
+    def __init__(self, name: str, mode: str = "", endpoint: str = None):
+        self.name = name
+        self.mode = mode
+        self.endpoint = endpoint
+
+    def __enter__(self):
+        self.scope = tracing.enter(self.name, mode=self.mode) if self.mode else tracing.enter(self.name)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        observe_stage(self.name, time.perf_counter() - self.start, self.mode, self.endpoint)
+        tracing.leave(self.scope, exc)
+        return False
+
+
+def observe_stage(name: str, seconds: float, mode: str = "", endpoint: str = None):
+    stage_seconds.observe(seconds, stage=name, endpoint=endpoint or current_endpoint.get(), mode=mode)
+
+
+def request_parsed():
+    """Отмечает окончание разбора запроса (вызывается первой строкой обработчика)"""
+    start = _request_start.get()
+    if start:
+        observe_stage("request_parse", time.perf_counter() - start)
+
+
+def count_usage(mode: str, usage):
+    """Учет токенов из поля usage ответа API"""
+    if usage is None:
+        return
+    endpoint = current_endpoint.get()
+    upstream_tokens.inc(getattr(usage, "prompt_tokens", 0) or 0, endpoint=endpoint, mode=mode, kind="prompt")
+    upstream_tokens.inc(getattr(usage, "completion_tokens", 0) or 0, endpoint=endpoint, mode=mode, kind="completion")
+
+
+def count_fallback(mode: str, reason: str):
+    fallbacks_total.inc(endpoint=current_endpoint.get(), mode=mode, reason=reason)
+
+
+def render() -> str:
+    """Все метрики в текстовом формате Prometheus"""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    """ASGI middleware: время и статус запросов, эндпоинт в контексте для стадий"""
+
+    def __init__(self, app, skip_paths: Tuple[str, ...] = ("/metrics",)):
+        self.app = app
+        self.skip_paths = skip_paths
+
+    def _endpoint(self, scope) -> str:
+        # Шаблон маршрута ("/jobs/{job_id}") вместо пути, чтобы число меток не росло
+        for route in getattr(scope.get("app"), "routes", ()):
+            match, _ = route.matches(scope)
+            if match.name == "FULL":
+                return getattr(route, "path", scope["path"])
+        return "unmatched"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.skip_paths:
+            await self.app(scope, receive, send)
+            return
+
+        endpoint = self._endpoint(scope)
+        endpoint_token = current_endpoint.set(endpoint)
+        start = time.perf_counter()
+        start_token = _request_start.set(start)
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            request_seconds.observe(time.perf_counter() - start, endpoint=endpoint)
+            requests_total.inc(endpoint=endpoint, status=status["code"])
+            current_endpoint.reset(endpoint_token)
+            _request_start.reset(start_token)
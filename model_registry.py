@@ -0,0 +1,183 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+import torch
+from transformers import AutoModelForSeq2SeqLM, AutoTokenizer
+
+from inference_backends import backend_for, load_model_for_backend, model_size_bytes
+
+# Бюджет оперативной памяти под веса моделей (в мегабайтах)
+_DEFAULT_BUDGET_MB = int(os.environ.get("QYSQA_MODEL_RAM_BUDGET_MB", "8192"))
+
+
+def default_device() -> str:
+    """Устройство по умолчанию для инференса"""
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+
+class _Entry:
+    def __init__(self, tokenizer, model, device, size_bytes):
+        self.tokenizer = tokenizer
+        self.model = model
+        self.device = device
+        self.size_bytes = size_bytes
+
+
+class ModelRegistry:
+    """
+    Общий для процесса реестр моделей: каждая модель загружается один раз
+    на сочетание (класс модели, устройство, dtype), а при превышении бюджета
+    памяти вытесняется давно не использовавшаяся модель (LRU). Вызывающий код
+    берет модель через get() на время вызова и не хранит ссылку на нее,
+    иначе вытесненная модель останется в памяти
+    """
+
+    def __init__(self, budget_mb: Optional[int] = None):
+        self.budget_bytes = (budget_mb if budget_mb is not None else _DEFAULT_BUDGET_MB) * 1024 * 1024
+        self._entries: "OrderedDict[Tuple[str, str, str, str], _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Отдельные блокировки на ключ, чтобы одна модель не грузилась дважды параллельно
+        self._load_locks: Dict[Tuple[str, str, str, str], threading.Lock] = {}
+        # Токенизаторы моделей, веса которых держит сервер моделей
+        self._tokenizers: Dict[str, Any] = {}
+
+    @staticmethod
+    def _key(model_name: str, model_cls, device: str, dtype: Optional[torch.dtype]) -> Tuple[str, str, str, str]:
+        # Один чекпоинт может загружаться разными классами (с головой генерации и без)
+        cls_name = f"{model_cls.__module__}.{model_cls.__qualname__}" if model_cls is not None else "auto"
+        return model_name, cls_name, str(device), str(dtype) if dtype is not None else "default"
+
+    def get(self, model_name: str, model_cls=None, tokenizer_cls=None,
+            device: Optional[str] = None, dtype: Optional[torch.dtype] = None) -> Tuple[Any, Any, torch.device]:
+        """Возвращает (tokenizer, model, device), загружая модель при первом обращении"""
+        device = device or default_device()
+        key = self._key(model_name, model_cls, device, dtype)
+
+        entry = self._lookup(key)
+        if entry is not None:
+            return entry.tokenizer, entry.model, entry.device
+
+        with self._lock:
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+
+        with load_lock:
+            # Модель могла быть загружена другим потоком, пока мы ждали
+            entry = self._lookup(key)
+            if entry is None:
+                entry = self._load(model_name, model_cls, tokenizer_cls, device, dtype)
+                self._insert(key, entry)
+        return entry.tokenizer, entry.model, entry.device
+
+    def get_tokenizer(self, model_name: str, tokenizer_cls=None):
+        """Токенизатор модели без загрузки весов (берется у загруженной модели, если она есть)"""
+        with self._lock:
+            for key, entry in self._entries.items():
+                if key[0] == model_name:
+                    return entry.tokenizer
+            tokenizer = self._tokenizers.get(model_name)
+        if tokenizer is None:
+            tokenizer = (tokenizer_cls or AutoTokenizer).from_pretrained(model_name)
+            with self._lock:
+                tokenizer = self._tokenizers.setdefault(model_name, tokenizer)
+        return tokenizer
+
+    def _lookup(self, key) -> Optional[_Entry]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def _load(self, model_name, model_cls, tokenizer_cls, device, dtype) -> _Entry:
+        backend = backend_for(model_name)
+        print(f"Loading model {model_name} on {device} ({backend})...")
+        tokenizer_cls = tokenizer_cls or AutoTokenizer
+        model_cls = model_cls or AutoModelForSeq2SeqLM
+
+        tokenizer = tokenizer_cls.from_pretrained(model_name)
+        kwargs = {"torch_dtype": dtype} if dtype is not None else {}
+        model = load_model_for_backend(model_name, model_cls, backend, **kwargs)
+        if isinstance(model, torch.nn.Module):
+            torch_device = torch.device(device)
+            model = model.to(torch_device)
+            model.eval()
+        else:
+            # ONNX Runtime работает на CPU
+            torch_device = torch.device("cpu")
+        return _Entry(tokenizer, model, torch_device, model_size_bytes(model))
+
+    def _insert(self, key, entry: _Entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            self._evict_locked(keep=key)
+
+    def put(self, model_name: str, tokenizer, model, device: Optional[str] = None,
+            dtype: Optional[torch.dtype] = None, model_cls=None):
+        """
+        Регистрирует уже созданную модель под именем model_name: следующие
+        get() с тем же model_cls (по умолчанию - класс самой модели) вернут ее
+        без загрузки из хаба (бенчмарки, локальные чекпоинты)
+        """
+        device = device or default_device()
+        torch_device = torch.device(device)
+        if isinstance(model, torch.nn.Module):
+            model = model.to(torch_device)
+            model.eval()
+        entry = _Entry(tokenizer, model, torch_device, model_size_bytes(model))
+        self._insert(self._key(model_name, model_cls or type(model), device, dtype), entry)
+
+    def _evict_locked(self, keep):
+        used = sum(e.size_bytes for e in self._entries.values())
+        # Вытесняем самые старые модели, пока не уложимся в бюджет (текущую не трогаем)
+        while used > self.budget_bytes and len(self._entries) > 1:
+            oldest_key = next(iter(self._entries))
+            if oldest_key == keep:
+                break
+            evicted = self._entries.pop(oldest_key)
+            used -= evicted.size_bytes
+            print(f"Evicting model {oldest_key[0]} ({evicted.size_bytes // (1024 * 1024)} MB)")
+        if used > self.budget_bytes:
+            print(f"Warning: model memory budget exceeded ({used // (1024 * 1024)} MB)")
+
+    def is_loaded(self, model_name: str) -> bool:
+        """Загружен ли хотя бы один экземпляр модели"""
+        with self._lock:
+            return any(k[0] == model_name for k in self._entries)
+
+    def evict(self, model_name: str):
+        """Принудительно выгружает все экземпляры модели"""
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == model_name]:
+                del self._entries[key]
+
+    def stats(self) -> Dict[str, Any]:
+        """Статистика использования памяти реестром"""
+        with self._lock:
+            return {
+                "budget_mb": self.budget_bytes // (1024 * 1024),
+                "used_mb": sum(e.size_bytes for e in self._entries.values()) // (1024 * 1024),
+                "models": [
+                    {"name": k[0], "class": k[1], "device": k[2], "dtype": k[3],
+                     "size_mb": e.size_bytes // (1024 * 1024)}
+                    for k, e in self._entries.items()
+                ],
+            }
+
+
+# Единственный экземпляр реестра на процесс
+registry = ModelRegistry()
+
+
+def get_model(model_name: str, model_cls=None, tokenizer_cls=None,
+              device: Optional[str] = None, dtype: Optional[torch.dtype] = None):
+    """Короткий доступ к общему реестру моделей"""
+    return registry.get(model_name, model_cls=model_cls, tokenizer_cls=tokenizer_cls,
+                        device=device, dtype=dtype)
+
+
+def get_tokenizer(model_name: str, tokenizer_cls=None):
+    """Короткий доступ к токенизатору из общего реестра"""
+    return registry.get_tokenizer(model_name, tokenizer_cls=tokenizer_cls)
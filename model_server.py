@@ -0,0 +1,366 @@
+"""
+Сервер моделей: один процесс держит веса локальных seq2seq моделей и общий
+планировщик микробатчей, а API воркеры (QYSQA_MODEL_SERVER) отправляют ему
+вызовы generate через Unix сокет. Так число воркеров растет с числом ядер,
+а память под модели - нет: батчи собираются из запросов всех воркеров.
+
+Обычно серверы запускает serve.py, но их можно поднять и отдельно (с общим ключом):
+    export QYSQA_MODEL_SERVER_AUTHKEY=$(openssl rand -hex 16)
+    python model_server.py --socket /run/qysqa/model-0.sock --models facebook/bart-large-cnn
+    QYSQA_MODEL_SERVER=/run/qysqa/model-0.sock python main.py
+"""
+import argparse
+import contextvars
+import itertools
+import os
+import signal
+import threading
+import time
+import zlib
+from concurrent.futures import Future
+from multiprocessing.connection import Client, Listener
+from typing import Any, Dict, List, Optional
+
+import metrics
+import tracing
+
+_CONNECT_TIMEOUT = float(os.environ.get("QYSQA_MODEL_SERVER_CONNECT_TIMEOUT", "120"))
+
+# Служебный id запроса знакомства при подключении
+_HELLO_ID = -1
+
+
+class ModelServerError(RuntimeError):
+    """Ошибка генерации на сервере моделей или потеря соединения с ним"""
+
+
+def _authkey() -> bytes:
+    """
+    Общий ключ API воркеров и серверов моделей. Сервер распаковывает (pickle)
+    присланные данные, поэтому без ключа соединения не принимаются и не устанавливаются
+    """
+    key = os.environ.get("QYSQA_MODEL_SERVER_AUTHKEY", "").encode()
+    if not key:
+        raise ModelServerError("QYSQA_MODEL_SERVER_AUTHKEY is not set")
+    return key
+
+
+def _outcome(future: Future):
+    """(ошибка, результат) для ответа клиенту; исключения передаются текстом"""
+    error = future.exception()
+    if error is not None:
+        return f"{type(error).__name__}: {error}", None
+    return None, future.result()
+
+
+class ModelServer:
+    """
+    Принимает соединения API воркеров; каждое соединение обслуживает свой
+    поток, а вызовы generate уходят в общий планировщик микробатчей процесса
+    """
+
+    def __init__(self, path: str, models: Optional[List[str]] = None):
+        self.path = path
+        # Модели, которые этот сервер держит (пустой список - любые)
+        self.models = list(models or [])
+        self._listener: Optional[Listener] = None
+        self._stopping = False
+
+    def serve_forever(self):
+        from lifecycle import Lifecycle
+
+        authkey = _authkey()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        # Сокет сразу создается с правами только для владельца
+        umask = os.umask(0o077)
+        try:
+            self._listener = Listener(self.path, family="AF_UNIX", authkey=authkey)
+        finally:
+            os.umask(umask)
+        # Свои модели начинают грузиться сразу, не дожидаясь первого запроса
+        Lifecycle(warmup_models=self.models).start_warmup()
+        print(f"Model server listening on {self.path} (models: {', '.join(self.models) or 'any'})")
+        try:
+            while not self._stopping:
+                try:
+                    conn = self._listener.accept()
+                except OSError:
+                    if self._stopping:
+                        break
+                    continue
+                except Exception as e:
+                    # Например, неверный ключ у клиента
+                    print(f"Model server rejected connection: {e}")
+                    continue
+                threading.Thread(target=self._serve_connection, args=(conn,),
+                                 name="model-server-conn", daemon=True).start()
+        finally:
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+    def stop(self, *_):
+        self._stopping = True
+        if self._listener is not None:
+            self._listener.close()
+
+    def _state(self) -> Dict[str, Any]:
+        from model_registry import registry
+
+        return {"loaded": sorted({m["name"] for m in registry.stats()["models"]})}
+
+    def _serve_connection(self, conn):
+        send_lock = threading.Lock()
+
+        def reply(request_id, error, result):
+            with send_lock:
+                try:
+                    conn.send((request_id, error, result, self._state()))
+                except OSError:
+                    pass
+
+        while True:
+            try:
+                request_id, op, payload = conn.recv()
+            except (EOFError, OSError):
+                break
+            if op == "generate":
+                try:
+                    future = contextvars.copy_context().run(self._submit, payload)
+                except Exception as e:
+                    reply(request_id, f"{type(e).__name__}: {e}", None)
+                    continue
+                future.add_done_callback(lambda f, rid=request_id: reply(rid, *_outcome(f)))
+            else:
+                # Прогрев и статистика могут идти долго и не должны задерживать генерацию
+                threading.Thread(target=self._call, args=(op, payload, request_id, reply), daemon=True).start()
+        conn.close()
+
+    def _submit(self, payload: Dict[str, Any]) -> Future:
+        import inference_scheduler
+
+        # Метки метрик и батчей - по эндпоинту исходного запроса в API воркере
+        metrics.current_endpoint.set(payload["endpoint"])
+        return inference_scheduler.scheduler.submit(
+            payload["model_name"], payload["texts"], model_cls=payload["model_cls"],
+            tokenizer_cls=payload["tokenizer_cls"], max_input_length=payload["max_input_length"],
+            **payload["gen_kwargs"]
+        )
+
+    def _call(self, op: str, payload: Dict[str, Any], request_id: int, reply):
+        import inference_scheduler
+        from model_registry import registry
+
+        try:
+            if op == "hello":
+                result = {"pid": os.getpid(), "models": self.models}
+            elif op == "warmup":
+                result = inference_scheduler.warmup(payload["model_name"], model_cls=payload["model_cls"],
+                                                    tokenizer_cls=payload["tokenizer_cls"])
+            elif op == "stats":
+                result = {"pid": os.getpid(), "queue_depth": inference_scheduler.scheduler.queue_depth(),
+                          "registry": registry.stats()}
+            else:
+                raise ValueError(f"Unknown operation: {op}")
+        except Exception as e:
+            reply(request_id, f"{type(e).__name__}: {e}", None)
+            return
+        reply(request_id, None, result)
+
+
+class _Connection:
+    """
+    Соединение API воркера с одним сервером моделей: запросы из любых потоков
+    отправляются под блокировкой, ответы разбирает отдельный поток по id запроса
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.models: Optional[List[str]] = None
+        self.loaded: List[str] = []
+        self._conn = None
+        self._lock = threading.Lock()
+        self._pending: Dict[int, Future] = {}
+        self._ids = itertools.count()
+
+    def connect(self):
+        with self._lock:
+            self._connect_locked()
+
+    def _connect_locked(self):
+        if self._conn is not None:
+            return
+        conn = Client(self.path, family="AF_UNIX", authkey=_authkey())
+        conn.send((_HELLO_ID, "hello", None))
+        _, error, hello, state = conn.recv()
+        if error:
+            conn.close()
+            raise ModelServerError(error)
+        self.models = hello["models"]
+        self.loaded = state["loaded"]
+        self._conn = conn
+        threading.Thread(target=self._read, args=(conn,), name="model-server-client", daemon=True).start()
+
+    @property
+    def connected(self) -> bool:
+        return self._conn is not None
+
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def call(self, op: str, payload: Dict[str, Any]) -> Future:
+        future: Future = Future()
+        with self._lock:
+            try:
+                self._connect_locked()
+            except OSError as e:
+                raise ModelServerError(f"Model server {self.path} is unavailable: {e}") from e
+            request_id = next(self._ids)
+            self._pending[request_id] = future
+            try:
+                self._conn.send((request_id, op, payload))
+            except OSError as e:
+                # Соединение закроет поток чтения, получив EOF
+                self._pending.pop(request_id, None)
+                raise ModelServerError(f"Model server {self.path} is unavailable: {e}") from e
+        return future
+
+    def _read(self, conn):
+        while True:
+            try:
+                request_id, error, result, state = conn.recv()
+            except (EOFError, OSError):
+                break
+            self.loaded = state["loaded"]
+            future = self._pending.pop(request_id, None)
+            if future is None:
+                continue
+            if error:
+                future.set_exception(ModelServerError(error))
+            else:
+                future.set_result(result)
+        with self._lock:
+            self._drop_locked(conn)
+
+    def _drop_locked(self, conn):
+        """Закрывает соединение; ожидающие ответа запросы завершаются ошибкой"""
+        conn.close()
+        if self._conn is not conn:
+            return
+        self._conn = None
+        pending, self._pending = self._pending, {}
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(ModelServerError(f"Lost connection to model server {self.path}"))
+
+
+class RemoteScheduler:
+    """
+    Замена MicroBatchScheduler в API воркере: вызовы generate отправляются
+    на серверы моделей. Модель обслуживает сервер, который ее объявил
+    (--models); остальные модели распределяются по серверам без списка
+    """
+
+    def __init__(self, paths: List[str], max_batch_size: int):
+        self.max_batch_size = max_batch_size
+        self._servers = [_Connection(path) for path in paths]
+        self._routes: Dict[str, _Connection] = {}
+        self._lock = threading.Lock()
+
+    def _route(self, model_name: str) -> _Connection:
+        with self._lock:
+            server = self._routes.get(model_name)
+        if server is not None:
+            return server
+        for candidate in self._servers:
+            try:
+                candidate.connect()
+            except (OSError, ModelServerError):
+                pass
+        known = all(s.models is not None for s in self._servers)
+        owners = ([s for s in self._servers if s.models and model_name in s.models]
+                  or [s for s in self._servers if not s.models] or self._servers)
+        server = owners[zlib.crc32(model_name.encode("utf-8")) % len(owners)]
+        # Маршрут запоминается, только когда известны модели всех серверов
+        if known:
+            with self._lock:
+                self._routes[model_name] = server
+        return server
+
+    def submit(self, model_name: str, texts: List[str], model_cls=None, tokenizer_cls=None,
+               max_input_length: Optional[int] = 512, **gen_kwargs) -> Future:
+        if not texts:
+            future: Future = Future()
+            future.set_result([])
+            return future
+        payload = {"model_name": model_name, "texts": list(texts), "model_cls": model_cls,
+                   "tokenizer_cls": tokenizer_cls, "max_input_length": max_input_length,
+                   "gen_kwargs": gen_kwargs, "endpoint": metrics.current_endpoint.get()}
+        return self._route(model_name).call("generate", payload)
+
+    def generate(self, model_name: str, texts: List[str], **kwargs) -> List[List[str]]:
+        with tracing.span("model_server", model=model_name, texts=len(texts)):
+            return self.submit(model_name, texts, **kwargs).result()
+
+    def warmup(self, model_name: str, model_cls=None, tokenizer_cls=None, timeout: float = _CONNECT_TIMEOUT):
+        """Загрузка модели на ее сервере; сервер может еще запускаться, поэтому подключение повторяется"""
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                server = self._route(model_name)
+                server.connect()
+                break
+            except (OSError, ModelServerError):
+                if time.monotonic() >= deadline:
+                    raise
+                time.sleep(0.5)
+        server.call("warmup", {"model_name": model_name, "model_cls": model_cls,
+                               "tokenizer_cls": tokenizer_cls}).result()
+
+    def queue_depth(self) -> int:
+        """Запросы этого воркера, ожидающие ответа серверов (очереди других воркеров не видны)"""
+        return sum(s.pending() for s in self._servers)
+
+    def is_loaded(self, model_name: str) -> bool:
+        server = self._routes.get(model_name)
+        return server is not None and model_name in server.loaded
+
+    def stats(self) -> List[Dict[str, Any]]:
+        return [{"socket": s.path, "connected": s.connected, "models": s.models, "loaded": s.loaded,
+                 "pending": s.pending()} for s in self._servers]
+
+
+def wait_for(path: str, timeout: float = _CONNECT_TIMEOUT, alive=lambda: True) -> bool:
+    """Ждет, пока сервер моделей начнет принимать соединения"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline and alive():
+        try:
+            conn = Client(path, family="AF_UNIX", authkey=_authkey())
+        except OSError:
+            time.sleep(0.2)
+            continue
+        with conn:
+            conn.send((_HELLO_ID, "hello", None))
+            conn.recv()
+        return True
+    return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--socket", required=True, help="путь к Unix сокету")
+    parser.add_argument("--models", default="", help="модели этого сервера через запятую (по умолчанию - любые)")
+    args = parser.parse_args()
+
+    if not os.environ.get("QYSQA_MODEL_SERVER_AUTHKEY"):
+        parser.error("QYSQA_MODEL_SERVER_AUTHKEY must be set (serve.py generates it for its model servers)")
+    # Сам сервер выполняет генерацию локально
+    os.environ.pop("QYSQA_MODEL_SERVER", None)
+    server = ModelServer(args.socket, [m.strip() for m in args.models.split(",") if m.strip()])
+    signal.signal(signal.SIGTERM, server.stop)
+    signal.signal(signal.SIGINT, server.stop)
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,30 +1,25 @@
-import torch
 from transformers import T5ForConditionalGeneration, T5Tokenizer
+from model_registry import get_model
+import inference_scheduler
+
+MODEL_NAME = "valhalla/t5-small-qa-qg-hl"
 
 def load_model():
-    print("Loading model...")
-    model_name = "valhalla/t5-small-qa-qg-hl"
-    tokenizer = T5Tokenizer.from_pretrained(model_name)
-    model = T5ForConditionalGeneration.from_pretrained(model_name)
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    model = model.to(device)
-    return tokenizer, model, device
+    # Модель загружается один раз и переиспользуется через общий реестр
+    return get_model(MODEL_NAME, model_cls=T5ForConditionalGeneration, tokenizer_cls=T5Tokenizer)
 
 def generate_wrong_options(question, correct_answer, context, num_options=3):
     """Generate incorrect options for a multiple choice question"""
-    tokenizer, model, device = load_model()
-    
     # Prepare input for generating wrong options
     input_text = f"question: {question}\ncontext: {context}\ncorrect: {correct_answer}\ngenerate wrong options:"
     
-    inputs = tokenizer(input_text, 
-                     return_tensors="pt", 
-                     max_length=512, 
-                     truncation=True).to(device)
-    
-    # Generate wrong options
-    outputs = model.generate(
-        inputs["input_ids"],
+    # Generate wrong options (batched together with concurrent requests by the scheduler)
+    wrong_options = inference_scheduler.generate(
+        MODEL_NAME,
+        [input_text],
+        model_cls=T5ForConditionalGeneration,
+        tokenizer_cls=T5Tokenizer,
+        max_input_length=512,
         max_length=64,
         num_return_sequences=num_options,
         num_beams=num_options+1,
@@ -32,10 +27,7 @@ def generate_wrong_options(question, correct_answer, context, num_options=3):
         temperature=0.8,
         diversity_penalty=0.5,
         num_beam_groups=num_options+1
-    )
-    
-    # Decode results and format
-    wrong_options = [tokenizer.decode(output, skip_special_tokens=True) for output in outputs]
+    )[0]
     
     # Filter out any options that might be too similar to the correct answer
     filtered_options = []
@@ -49,6 +41,41 @@ def generate_wrong_options(question, correct_answer, context, num_options=3):
     
     return filtered_options[:num_options]
 
+def pick_answer(sentence):
+    """Ответ для вопроса: термин перед двоеточием или самая длинная фраза из слов с заглавной буквы"""
+    head, sep, _ = sentence.partition(":")
+    if sep and 0 < len(head.split()) <= 6:
+        return head.strip()
+
+    best, current = [], []
+    for word in sentence.split():
+        current = current + [word] if word[:1].isupper() else []
+        if len(current) > len(best):
+            best = current
+    if not best:
+        best = sentence.split()[:3]
+    return " ".join(best).strip(".,;:!?")
+
+def generate_highlight_questions(sentences):
+    """
+    Быстрая генерация вопросов моделью t5-small: в каждом предложении
+    выделяется ответ (<hl> ... <hl>), и модель формулирует к нему вопрос.
+    Все предложения обрабатываются одним батчем; возвращает пары (вопрос, ответ)
+    """
+    pairs = [(s, pick_answer(s)) for s in sentences]
+    pairs = [(s, a) for s, a in pairs if a]
+    outputs = inference_scheduler.generate(
+        MODEL_NAME,
+        [f"generate question: {s.replace(a, f'<hl> {a} <hl>', 1)}" for s, a in pairs],
+        model_cls=T5ForConditionalGeneration,
+        tokenizer_cls=T5Tokenizer,
+        max_input_length=512,
+        max_length=64,
+        num_beams=4,
+        early_stopping=True
+    )
+    return [(out[0].strip(), a) for out, (_, a) in zip(outputs, pairs) if out and out[0].strip()]
+
 if __name__ == "__main__":
     # Example usage
     question = "What is SEO?"
@@ -1,26 +1,70 @@
 # QUESTION,ANSWER GENERATION based on context using T5 model
-import nltk
 from nltk.tokenize import PunktSentenceTokenizer
 import random
 from transformers import T5Tokenizer, T5ForConditionalGeneration
-import torch
+from model_registry import get_model
+import executors
+import inference_scheduler
+import metrics
 
-# Загрузка модели 'punkt'
-nltk.download('punkt')
-
-# Создание токенизатора для предложений
+# Токенизатор предложений с параметрами по умолчанию: данные 'punkt' не нужны,
+# поэтому импорт модуля не обращается к сети
 sentence_tokenizer = PunktSentenceTokenizer()
 
+MODEL_NAME = "potsawee/t5-large-generation-squad-QuestionAnswer"
+
+def load_model():
+    # Общий экземпляр модели из реестра (тот же, что и в test_generator/test_full_process)
+    return get_model(MODEL_NAME, model_cls=T5ForConditionalGeneration, tokenizer_cls=T5Tokenizer)
+
+def _split_qa(qa):
+    """Разделение строки модели на вопрос и ответ"""
+    if "?" not in qa:
+        return None
+    question, answer = qa.split("?", 1)
+    return question.strip() + "?", answer.strip()
 
-tokenizer = T5Tokenizer.from_pretrained("potsawee/t5-large-generation-squad-QuestionAnswer")
-model = T5ForConditionalGeneration.from_pretrained("potsawee/t5-large-generation-squad-QuestionAnswer")
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-model = model.to(device)
+def _generate_batched(sentences, num_questions, candidates_per_sentence=2):
+    """
+    Пакетная генерация: все выбранные предложения отправляются в общий
+    планировщик микробатчей, который группирует их по длине (меньше паддинга)
+    и прогоняет через generate вместе с запросами других пользователей,
+    по несколько кандидатов на один проход энкодера
+    """
+    # Берем разные предложения, чтобы не тратить проходы модели на повторы
+    selected = random.sample(sentences, min(num_questions, len(sentences)))
+    candidates = inference_scheduler.generate(
+        MODEL_NAME,
+        [f'context: {s}' for s in selected],
+        model_cls=T5ForConditionalGeneration,
+        tokenizer_cls=T5Tokenizer,
+        max_input_length=512,
+        max_length=200,
+        num_return_sequences=candidates_per_sentence,
+        num_beams=max(2, candidates_per_sentence),
+        temperature=0.7,
+        early_stopping=True
+    )
+
+    # Сначала лучший кандидат каждого предложения, затем альтернативные, если вопросов не хватает
+    questions = []
+    for rank in range(candidates_per_sentence):
+        for sentence_candidates in candidates:
+            if len(questions) >= num_questions:
+                return questions
+            if rank >= len(sentence_candidates):
+                continue
+            pair = _split_qa(sentence_candidates[rank])
+            if pair and pair[0] not in [q for q, _ in questions]:
+                questions.append(pair)
+    return questions
 
 # Function to generate questions with word-based limits
-def generate_questions(context, max_questions=10, words_per_question=100):
+def generate_questions(context, max_questions=10, words_per_question=100,
+                       batched=False, candidates_per_sentence=2):
     # Разделяем текст на предложения
-    sentences = sentence_tokenizer.tokenize(context)
+    with metrics.stage("sentence_tokenize"):
+        sentences = sentence_tokenizer.tokenize(context)
     print(f"Total sentences in context: {len(sentences)}")  # Вывод количества предложений
     
     # Подсчет количества слов в тексте
@@ -30,21 +74,30 @@ def generate_questions(context, max_questions=10, words_per_question=100):
     # Определяем количество вопросов на основе длины текста
     num_questions = min(max_questions, max(1, word_count // words_per_question))
     print(f"Number of questions to generate: {num_questions}")  # Вывод количества вопросов
+
+    if batched:
+        if not sentences:
+            return []
+        return _generate_batched(sentences, num_questions,
+                                 candidates_per_sentence=candidates_per_sentence)
     
+    tokenizer, model, device = load_model()
     questions = []
     for _ in range(num_questions):
         # Выбираем случайное предложение из текста
         random_sentence = random.choice(sentences)
         input_text = f'context: {random_sentence}'
         input_ids = tokenizer.encode(input_text, return_tensors="pt").to(device)
-        outputs = model.generate(
-            input_ids,
-            max_length=200,
-            num_return_sequences=1,  # Генерируем один вопрос за раз
-            num_beams=2,  # Используем beam search
-            temperature=0.7,  # Добавляем случайность в генерацию
-            early_stopping=True
-        )
+        # Модель общая с планировщиком микробатчей
+        with executors.model_slot(MODEL_NAME):
+            outputs = model.generate(
+                input_ids,
+                max_length=200,
+                num_return_sequences=1,  # Генерируем один вопрос за раз
+                num_beams=2,  # Используем beam search
+                temperature=0.7,  # Добавляем случайность в генерацию
+                early_stopping=True
+            )
         
         # Обрабатываем результат
         qa = tokenizer.decode(outputs[0], skip_special_tokens=True)
@@ -58,7 +111,8 @@ def generate_questions(context, max_questions=10, words_per_question=100):
     return questions
 
 # Example usage
-context = """
+if __name__ == "__main__":
+    context = """
 Transforming Marketing: IT empowers businesses to reach and engage their customers through digital marketing strategies, allowing for greater precision in targeting.
 Marketing Technologies:
 SEO (Search Engine Optimization): Enhances online visibility and attracts organic traffic to websites.
@@ -66,12 +120,10 @@ Email Marketing Platforms: Automates personalized communication with customers.
 Social Media Marketing Tools: Platforms like Instagram, Facebook, and LinkedIn enable businesses to engage with customers and share targeted ads.
 """
 
-# Генерация вопросов с учетом длины текста
-questions = generate_questions(context, max_questions=10, words_per_question=30)
-
-# Вывод вопросов и ответов
-for i, (question, answer) in enumerate(questions, 1):
-    print(f'Question {i}: {question}')
-    print(f'Answer {i}: {answer}')
-
+    # Генерация вопросов с учетом длины текста
+    questions = generate_questions(context, max_questions=10, words_per_question=30, batched=True)
 
+    # Вывод вопросов и ответов
+    for i, (question, answer) in enumerate(questions, 1):
+        print(f'Question {i}: {question}')
+        print(f'Answer {i}: {answer}')
@@ -0,0 +1,362 @@
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Optional, Tuple
+
+
+def _parse_seconds(value: str) -> Dict[str, float]:
+    """Разбор QYSQA_DEADLINES_S вида "summary=60,test=45" """
+    result = {}
+    for item in value.split(","):
+        if "=" in item:
+            mode, seconds = item.rsplit("=", 1)
+            result[mode.strip()] = float(seconds)
+    return result
+
+
+# Предельное время ответа API по режимам (в секундах), включая дублирующие запросы
+_DEADLINES = {"summary": 60.0, "test": 45.0, "flashcard": 45.0, "combined": 90.0}
+_DEADLINES.update(_parse_seconds(os.environ.get("QYSQA_DEADLINES_S", "")))
+_DEFAULT_DEADLINE = float(os.environ.get("QYSQA_DEFAULT_DEADLINE_S", "60"))
+
+# Дублирующий запрос отправляется, если ответа нет дольше процентиля недавних задержек
+_HEDGE_MAX = int(os.environ.get("QYSQA_HEDGE_MAX", "1"))
+_HEDGE_PERCENTILE = float(os.environ.get("QYSQA_HEDGE_PERCENTILE", "0.95"))
+_HEDGE_MIN_SAMPLES = int(os.environ.get("QYSQA_HEDGE_MIN_SAMPLES", "20"))
+_HEDGE_MIN_DELAY = float(os.environ.get("QYSQA_HEDGE_MIN_DELAY_MS", "500")) / 1000.0
+_LATENCY_WINDOW = 500
+
+# Автомат отключения: доля ошибок за окно, после которой запросы к API не отправляются
+_BREAKER_FAILURE_RATIO = float(os.environ.get("QYSQA_BREAKER_FAILURE_RATIO", "0.5"))
+_BREAKER_MIN_REQUESTS = int(os.environ.get("QYSQA_BREAKER_MIN_REQUESTS", "10"))
+_BREAKER_WINDOW = float(os.environ.get("QYSQA_BREAKER_WINDOW_S", "60"))
+_BREAKER_OPEN_SECONDS = float(os.environ.get("QYSQA_BREAKER_OPEN_S", "30"))
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """API временно отключено автоматом из-за высокой доли ошибок"""
+
+
+class DeadlineExceeded(TimeoutError):
+    """Ответ API не получен за отведенное режиму время"""
+
+
+class CircuitBreaker:
+    """
+    Автомат отключения: при доле ошибок выше порога за последние window
+    секунд запросы сразу отклоняются на open_seconds, затем пропускается
+    одна пробная попытка, успех которой снова открывает доступ к API
+    """
+
+    def __init__(self, failure_ratio: float = _BREAKER_FAILURE_RATIO, min_requests: int = _BREAKER_MIN_REQUESTS,
+                 window: float = _BREAKER_WINDOW, open_seconds: float = _BREAKER_OPEN_SECONDS):
+        self.failure_ratio = failure_ratio
+        self.min_requests = min_requests
+        self.window = window
+        self.open_seconds = open_seconds
+        self.state = STATE_CLOSED
+        self._outcomes = deque()
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._probe_id = 0
+        self._lock = threading.Lock()
+        self.times_opened = 0
+        self.rejected = 0
+
+    def available(self) -> bool:
+        """Можно ли ожидать, что запрос будет пропущен (без изменения состояния)"""
+        with self._lock:
+            if self.state == STATE_OPEN:
+                return time.monotonic() - self._opened_at >= self.open_seconds
+            return not (self.state == STATE_HALF_OPEN and self._probe_in_flight)
+
+    def allow(self) -> bool:
+        return self.acquire() is not None
+
+    def acquire(self) -> Optional[int]:
+        """Пропуск запроса: None - отклонен, 0 - обычный, иначе номер пробной попытки для release"""
+        with self._lock:
+            if self.state == STATE_OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+                self.state = STATE_HALF_OPEN
+                self._probe_in_flight = False
+            if self.state == STATE_CLOSED:
+                return 0
+            if self.state == STATE_HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                self._probe_id += 1
+                return self._probe_id
+            self.rejected += 1
+            return None
+
+    def record(self, success: bool):
+        now = time.monotonic()
+        with self._lock:
+            if self.state == STATE_HALF_OPEN:
+                self._probe_in_flight = False
+                if success:
+                    self.state = STATE_CLOSED
+                    self._outcomes.clear()
+                else:
+                    self._open_locked(now)
+                return
+            if self.state == STATE_OPEN:
+                return
+
+            self._outcomes.append((now, success))
+            while self._outcomes and now - self._outcomes[0][0] > self.window:
+                self._outcomes.popleft()
+            failures = sum(1 for _, ok in self._outcomes if not ok)
+            if len(self._outcomes) >= self.min_requests and failures / len(self._outcomes) >= self.failure_ratio:
+                self._open_locked(now)
+
+    def release(self, probe: int):
+        """
+        Попытка прервана без результата (отмена запроса): если это была еще
+        не завершенная пробная попытка, пробный слот снова свободен
+        """
+        with self._lock:
+            if probe and self._probe_in_flight and probe == self._probe_id:
+                self._probe_in_flight = False
+
+    def _open_locked(self, now: float):
+        print(f"Circuit breaker opened for {self.open_seconds}s")
+        self.state = STATE_OPEN
+        self._opened_at = now
+        self._outcomes.clear()
+        self.times_opened += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "state": self.state,
+                "times_opened": self.times_opened,
+                "rejected": self.rejected,
+                "window_requests": len(self._outcomes),
+                "window_failures": sum(1 for _, ok in self._outcomes if not ok),
+            }
+
+
+class _ModeStats:
+    def __init__(self):
+        self.latencies = deque(maxlen=_LATENCY_WINDOW)
+        self.calls = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.failures = 0
+        self.deadline_exceeded = 0
+
+
+def _percentile(values, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Resilience:
+    """
+    Вызовы API с предельным временем по режиму, дублирующими запросами
+    (hedging) после процентиля задержки и автоматом отключения.
+    Побеждает первый валидный ответ, остальные попытки отменяются
+    """
+
+    def __init__(self, deadlines: Optional[Dict[str, float]] = None, hedge_max: int = _HEDGE_MAX,
+                 hedge_percentile: float = _HEDGE_PERCENTILE, breaker: Optional[CircuitBreaker] = None):
+        self.deadlines = dict(deadlines if deadlines is not None else _DEADLINES)
+        self.hedge_max = hedge_max
+        self.hedge_percentile = hedge_percentile
+        self.breaker = breaker or CircuitBreaker()
+        self._modes: Dict[str, _ModeStats] = {}
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def deadline_for(self, mode: str) -> float:
+        return self.deadlines.get(mode, _DEFAULT_DEADLINE)
+
+    def _mode(self, mode: str) -> _ModeStats:
+        with self._lock:
+            return self._modes.setdefault(mode, _ModeStats())
+
+    def hedge_delay(self, mode: str) -> Optional[float]:
+        """Через сколько секунд без ответа отправлять дублирующий запрос (None - не отправлять)"""
+        stats = self._mode(mode)
+        with self._lock:
+            latencies = list(stats.latencies)
+        if self.hedge_max <= 0 or len(latencies) < _HEDGE_MIN_SAMPLES:
+            return None
+        return max(_HEDGE_MIN_DELAY, _percentile(latencies, self.hedge_percentile))
+
+    def _start(self, mode: str) -> Tuple[_ModeStats, int]:
+        probe = self.breaker.acquire()
+        if probe is None:
+            raise CircuitOpenError("Upstream API is temporarily disabled after repeated errors")
+        stats = self._mode(mode)
+        with self._lock:
+            stats.calls += 1
+        return stats, probe
+
+    def _finish(self, stats: _ModeStats, attempt_index: int, seconds: float):
+        with self._lock:
+            stats.latencies.append(seconds)
+            if attempt_index > 0:
+                stats.hedge_wins += 1
+
+    def _count(self, stats: _ModeStats, field: str):
+        with self._lock:
+            setattr(stats, field, getattr(stats, field) + 1)
+
+    def call(self, mode: str, attempt: Callable[[float], Any], is_valid: Callable[[Any], bool] = bool):
+        """
+        Синхронный вызов: attempt(timeout) выполняет один запрос к API.
+        Попытки идут в потоках, поэтому дублирующий запрос не ждет первый
+        """
+        stats, _ = self._start(mode)
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="hedge")
+        start = time.monotonic()
+        deadline = start + self.deadline_for(mode)
+        delay = self.hedge_delay(mode)
+        sent = 0
+
+        # Попытки выполняются в копии контекста вызывающего: метки метрик и трасса запроса сохраняются
+        pending = {self._executor.submit(contextvars.copy_context().run, attempt, deadline - start): 0}
+        result, error = None, None
+        while True:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            timeout = deadline - now
+            can_hedge = delay is not None and sent < self.hedge_max
+            next_hedge = start + delay * (sent + 1) if can_hedge else None
+            if next_hedge is not None:
+                timeout = min(timeout, max(0.0, next_hedge - now))
+            done, _ = wait(list(pending), timeout=timeout, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                index = pending.pop(future)
+                try:
+                    value = future.result()
+                except Exception as e:
+                    self.breaker.record(False)
+                    error = e
+                    continue
+                self.breaker.record(True)
+                if is_valid(value):
+                    self._finish(stats, index, time.monotonic() - start)
+                    return value
+                result = value
+
+            # Дублирующий запрос: ответа нет дольше процентиля или первая попытка уже завершилась неудачно
+            if can_hedge and (not pending or time.monotonic() >= next_hedge):
+                sent += 1
+                self._count(stats, "hedges")
+                future = self._executor.submit(contextvars.copy_context().run, attempt, deadline - time.monotonic())
+                pending[future] = sent
+            elif not pending:
+                break
+
+        if pending:
+            self._count(stats, "deadline_exceeded")
+            self.breaker.record(False)
+            raise DeadlineExceeded(f"No valid {mode} response within {self.deadline_for(mode)}s")
+        if result is None and error is not None:
+            self._count(stats, "failures")
+            raise error
+        return result
+
+    async def acall(self, mode: str, attempt: Callable[[float], Any], is_valid: Callable[[Any], bool] = bool):
+        """Асинхронный вызов: attempt(timeout) возвращает корутину одного запроса к API"""
+        stats, probe = self._start(mode)
+        start = time.monotonic()
+        deadline = start + self.deadline_for(mode)
+        delay = self.hedge_delay(mode)
+        sent = 0
+
+        pending = {asyncio.ensure_future(attempt(deadline - start)): 0}
+        result, error = None, None
+        try:
+            while True:
+                now = time.monotonic()
+                if now >= deadline:
+                    break
+                timeout = deadline - now
+                can_hedge = delay is not None and sent < self.hedge_max
+                next_hedge = start + delay * (sent + 1) if can_hedge else None
+                if next_hedge is not None:
+                    timeout = min(timeout, max(0.0, next_hedge - now))
+                done, _ = await asyncio.wait(list(pending), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+                for task in done:
+                    index = pending.pop(task)
+                    try:
+                        value = task.result()
+                    except Exception as e:
+                        self.breaker.record(False)
+                        error = e
+                        continue
+                    self.breaker.record(True)
+                    if is_valid(value):
+                        self._finish(stats, index, time.monotonic() - start)
+                        return value
+                    result = value
+
+                if can_hedge and (not pending or time.monotonic() >= next_hedge):
+                    sent += 1
+                    self._count(stats, "hedges")
+                    pending[asyncio.ensure_future(attempt(deadline - time.monotonic()))] = sent
+                elif not pending:
+                    break
+        except asyncio.CancelledError:
+            self.breaker.release(probe)
+            raise
+        finally:
+            # Отмена оставшихся попыток закрывает их соединения с API
+            for task in pending:
+                task.cancel()
+
+        if pending:
+            self._count(stats, "deadline_exceeded")
+            self.breaker.record(False)
+            raise DeadlineExceeded(f"No valid {mode} response within {self.deadline_for(mode)}s")
+        if result is None and error is not None:
+            self._count(stats, "failures")
+            raise error
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        """Задержки, дублирующие запросы и состояние автомата по режимам"""
+        with self._lock:
+            modes = {
+                mode: {
+                    "calls": s.calls,
+                    "hedges": s.hedges,
+                    "hedge_wins": s.hedge_wins,
+                    "failures": s.failures,
+                    "deadline_exceeded": s.deadline_exceeded,
+                    "deadline_s": self.deadline_for(mode),
+                    "p50_ms": round(_percentile(s.latencies, 0.5) * 1000, 1) if s.latencies else None,
+                    "p95_ms": round(_percentile(s.latencies, 0.95) * 1000, 1) if s.latencies else None,
+                }
+                for mode, s in self._modes.items()
+            }
+        return {"breaker": self.breaker.stats(), "modes": modes}
+
+
+_default: Optional[Resilience] = None
+_default_lock = threading.Lock()
+
+
+def get_default_resilience() -> Resilience:
+    """Общий для процесса экземпляр (один автомат на внешний API)"""
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = Resilience()
+        return _default
@@ -0,0 +1,135 @@
+"""
+Запуск сервиса в несколько процессов: API воркеры main.py принимают запросы
+на общем сокете, а веса локальных моделей держат серверы моделей
+(model_server.py). Модель загружается один раз на узел, а не в каждом
+воркере, и батчи собираются из запросов всех воркеров.
+
+    python serve.py --workers 4 --model-servers 1
+
+Модели из QYSQA_WARMUP_MODELS распределяются по серверам по кругу и грузятся
+при старте; остальные загружаются по первому запросу. С --model-servers 0
+каждый воркер держит свои копии моделей, как при запуске main.py.
+"""
+import argparse
+import multiprocessing
+import os
+import secrets
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+import uvicorn
+
+from lifecycle import DRAIN_DELAY, DRAIN_TIMEOUT
+
+_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def _run_worker(sockets, host: str, port: int):
+    # Сигналы терминала получает только супервизор: он останавливает воркеры
+    # одним SIGTERM, и каждый успевает дождаться своих запросов
+    os.setsid()
+    import executors
+    import main
+
+    executors.set_switch_interval()
+    main._DrainingServer(uvicorn.Config(main.app, host=host, port=port)).run(sockets=sockets)
+
+
+def _start_model_server(path: str, models, env):
+    return subprocess.Popen([sys.executable, os.path.join(_ROOT, "model_server.py"), "--socket", path,
+                             "--models", ",".join(models)], env=env, cwd=_ROOT, start_new_session=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="число API воркеров")
+    parser.add_argument("--model-servers", type=int, default=1, help="число серверов моделей")
+    parser.add_argument("--socket-dir", help="каталог для сокетов серверов моделей")
+    args = parser.parse_args()
+
+    import jobs
+    from model_server import wait_for
+
+    # Задания, прерванные прошлой остановкой, возвращаются в очередь один раз, а не каждым воркером
+    requeued = jobs.JobStore().requeue_running()
+    if requeued:
+        print(f"Requeued {requeued} interrupted job(s)")
+    os.environ["QYSQA_JOB_RECOVER"] = "0"
+
+    servers = []
+    if args.model_servers > 0:
+        socket_dir = args.socket_dir or tempfile.mkdtemp(prefix="qysqa-")
+        os.makedirs(socket_dir, mode=0o700, exist_ok=True)
+        os.environ.setdefault("QYSQA_MODEL_SERVER_AUTHKEY", secrets.token_hex(16))
+        warmup = [name.strip() for name in os.environ.get("QYSQA_WARMUP_MODELS", "").split(",") if name.strip()]
+        server_env = {k: v for k, v in os.environ.items() if k != "QYSQA_MODEL_SERVER"}
+        for i in range(args.model_servers):
+            path = os.path.join(socket_dir, f"model-{i}.sock")
+            models = warmup[i::args.model_servers]
+            servers.append([path, models, _start_model_server(path, models, server_env)])
+        for path, _, process in servers:
+            try:
+                started = wait_for(path, alive=lambda: process.poll() is None)
+            except Exception as e:
+                print(f"Model server {path} is unreachable: {e}")
+                started = False
+            if not started:
+                print(f"Model server {path} did not start")
+                for _, _, other in servers:
+                    other.terminate()
+                sys.exit(1)
+        # API воркеры наследуют окружение и отправляют генерацию на серверы моделей
+        os.environ["QYSQA_MODEL_SERVER"] = ",".join(path for path, _, _ in servers)
+
+    stopping = []
+    signal.signal(signal.SIGINT, lambda sig, frame: stopping.append(sig))
+    signal.signal(signal.SIGTERM, lambda sig, frame: stopping.append(sig))
+
+    sockets = [uvicorn.Config("main:app", host=args.host, port=args.port).bind_socket()]
+    context = multiprocessing.get_context("spawn")
+
+    def start_worker():
+        process = context.Process(target=_run_worker, args=(sockets, args.host, args.port), name="api-worker")
+        process.start()
+        return process
+
+    workers = [start_worker() for _ in range(args.workers)]
+    print(f"Serving on {args.host}:{args.port} with {args.workers} API worker(s) "
+          f"and {len(servers)} model server(s)")
+
+    while not stopping:
+        time.sleep(0.5)
+        for server in servers:
+            if not stopping and server[2].poll() is not None:
+                print(f"Model server {server[0]} exited with code {server[2].returncode}, restarting")
+                server[2] = _start_model_server(server[0], server[1], server_env)
+        for i, process in enumerate(workers):
+            if not stopping and not process.is_alive():
+                print(f"API worker {process.pid} exited with code {process.exitcode}, restarting")
+                workers[i] = start_worker()
+
+    # Сначала воркеры дожидаются своих запросов, и только потом останавливаются серверы моделей
+    for process in workers:
+        if process.is_alive():
+            os.kill(process.pid, signal.SIGTERM)
+    deadline = time.monotonic() + DRAIN_DELAY + DRAIN_TIMEOUT + 5
+    for process in workers:
+        process.join(max(0.0, deadline - time.monotonic()))
+        if process.is_alive():
+            process.kill()
+    for _, _, process in servers:
+        process.terminate()
+    for _, _, process in servers:
+        try:
+            process.wait(10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,35 @@
-import torch
+import os
+import re
 from transformers import BartForConditionalGeneration, BartTokenizer
+from model_registry import get_model, get_tokenizer
+from encoder_cache import encoder_cache
+import executors
+from inference_backends import is_torch_backend
+import inference_scheduler
+import tracing
+
+MODEL_NAME = "facebook/bart-large-cnn"
+
+# Ограничение входа BART и параметры разбиения длинных лекций на части
+MAX_INPUT_TOKENS = 1024
+CHUNK_TOKENS = int(os.environ.get("QYSQA_SUMMARY_CHUNK_TOKENS", "900"))
+CHUNK_OVERLAP = int(os.environ.get("QYSQA_SUMMARY_CHUNK_OVERLAP", "100"))
+MAP_WORKERS = int(os.environ.get("QYSQA_SUMMARY_WORKERS", "2"))
+MAX_MERGE_LEVELS = 4
+
+_SENTENCE_RE = re.compile(r'(?<=[.!?])\s+|\n+')
 
 class EnhancedSummarizer:
-    def __init__(self):  # Ошибка: init -> __init__
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
-        self.tokenizer = BartTokenizer.from_pretrained("facebook/bart-large-cnn")
-        self.model = BartForConditionalGeneration.from_pretrained("facebook/bart-large-cnn").to(self.device)
+    def __init__(self, raw_pass=False):  # Ошибка: init -> __init__
+        # Проход по всему тексту для raw_summary нужен редко, поэтому он включается явно
+        self.raw_pass = raw_pass
+        self.raw_summary = None
+        # Токенизатор нужен для разбиения текста; веса модели загружает планировщик
+        # (в этом процессе или на сервере моделей), поэтому повторное создание дешево
+        self.tokenizer = get_tokenizer(MODEL_NAME, tokenizer_cls=BartTokenizer)
+        # Объединенные резюме частей длинных текстов в пределах одного generate_summary:
+        # секция "General" лекции без заголовков и обзорный проход суммируют один и тот же текст
+        self._merged_cache = None
 
     def generate_summary(self, text):  # Ошибка: отступ (метод должен быть внутри класса)
         # Определение параметров на основе длины текста
@@ -16,32 +40,59 @@ class EnhancedSummarizer:
         # Либо diversity_penalty не нужен, либо нужно добавить num_beam_groups > 1
         diversity_penalty_value = 0.5  # Сохраняем значение
         
-        # Подготовка текста и генерация summary
-        inputs = self.tokenizer.encode("summarize: " + text, 
-                                     return_tensors="pt", 
-                                     max_length=1024, 
-                                     truncation=True).to(self.device)
-        
-        # Генерация с обновленными параметрами
-        summary_ids = self.model.generate(
-            inputs,
-            **gen_params,
-            num_return_sequences=1,
-            no_repeat_ngram_size=3,
-            # diversity_penalty удален отсюда
-            early_stopping=True
-        )
-        
-        raw_summary = self.tokenizer.decode(summary_ids[0], skip_special_tokens=True)
-        
-        # Ошибка: метод _format_summary не определен, возможно, имелся в виду _format_full_summary
-        sections = self._split_into_sections(text)
-        section_summaries = {}
-        for section, content in sections.items():
-            params = self._get_generation_params(len(content.split()))
-            section_summaries[section] = self._generate_section_summary(content, params)
-        
-        return self._format_full_summary(section_summaries, text)
+        self._merged_cache = {}
+        try:
+            # Генерация с обновленными параметрами (длинный текст суммируется по частям);
+            # выход энкодера для полного текста общий с обзорным проходом
+            if self.raw_pass:
+                with tracing.span("raw_summary"):
+                    self.raw_summary = self._generate_section_summary(
+                        text, dict(gen_params, early_stopping=True), reuse_encoder=True
+                    )
+
+            # Ошибка: метод _format_summary не определен, возможно, имелся в виду _format_full_summary
+            with tracing.span("split_sections"):
+                sections = self._split_into_sections(text)
+            with tracing.span("summarize_sections", sections=len(sections)):
+                section_summaries = self._summarize_sections(sections)
+
+            with tracing.span("format_summary"):
+                return self._format_full_summary(section_summaries, text)
+        finally:
+            self._merged_cache = None
+
+    def _summarize_sections(self, sections):
+        """
+        Пакетное суммирование секций: секции группируются по набору параметров
+        генерации (<100, <300, >=300 слов), сортируются по длине в токенах,
+        и каждая группа обрабатывается одним вызовом generate с паддингом
+        """
+        names = list(sections.keys())
+        # Длина входа модели вместе со служебными токенами <s> и </s>
+        lengths = [len(ids) for ids in self.tokenizer(
+            ["summarize: " + sections[name] for name in names], add_special_tokens=True
+        )["input_ids"]]
+
+        summaries = {}
+        buckets = {}
+        for name, length in zip(names, lengths):
+            params = self._get_generation_params(len(sections[name].split()))
+            if length > MAX_INPUT_TOKENS:
+                # Длинная секция суммируется по частям (map-reduce)
+                summaries[name] = self._generate_section_summary(sections[name], params)
+            else:
+                tier = tuple(sorted(params.items()))
+                buckets.setdefault(tier, []).append((length, name))
+
+        for tier, members in buckets.items():
+            members.sort()
+            texts = ["summarize: " + sections[name] for _, name in members]
+            results = self._generate(texts, **dict(tier), no_repeat_ngram_size=3, num_return_sequences=1)
+            for (_, name), summary in zip(members, results):
+                summaries[name] = summary
+
+        # Сохраняем исходный порядок секций для форматирования
+        return {name: summaries[name] for name in names}
 
     def _split_into_sections(self, text):  # Ошибка: отступ
         sections = {}
@@ -62,13 +113,130 @@ class EnhancedSummarizer:
         
         return sections
 
-    def _generate_section_summary(self, text, params):  # Ошибка: отступ
-        inputs = self.tokenizer.encode(
-            "summarize: " + text,
-            return_tensors="pt",
-            max_length=1024,
-            truncation=True
-        ).to(self.device)
+    def _generate(self, texts, **gen_kwargs):
+        """Генерация через общий планировщик, объединяющий вызовы разных запросов в батчи"""
+        results = inference_scheduler.generate(
+            MODEL_NAME,
+            texts,
+            model_cls=BartForConditionalGeneration,
+            tokenizer_cls=BartTokenizer,
+            max_input_length=1024,
+            **gen_kwargs
+        )
+        return [variants[0] for variants in results]
+
+    def _count_tokens(self, text):
+        return len(self.tokenizer(text, add_special_tokens=False)["input_ids"])
+
+    def _fits_input(self, text):
+        """Помещается ли текст с префиксом и служебными токенами во вход модели"""
+        return len(self.tokenizer("summarize: " + text, add_special_tokens=True)["input_ids"]) <= MAX_INPUT_TOKENS
+
+    def _chunk_text(self, text, chunk_tokens=CHUNK_TOKENS, overlap=CHUNK_OVERLAP):
+        """Разбиение текста на перекрывающиеся части не длиннее chunk_tokens токенов"""
+        sentences = [s.strip() for s in _SENTENCE_RE.split(text) if s.strip()]
+        if not sentences:
+            return []
+        lengths = [len(ids) for ids in self.tokenizer(sentences, add_special_tokens=False)["input_ids"]]
+
+        chunks = []
+        current, current_len = [], 0
+        for sentence, length in zip(sentences, lengths):
+            # Слишком длинное предложение режем по токенам
+            if length > chunk_tokens:
+                ids = self.tokenizer(sentence, add_special_tokens=False)["input_ids"]
+                pieces = [self.tokenizer.decode(ids[i:i + chunk_tokens]) for i in range(0, len(ids), chunk_tokens)]
+                if current:
+                    chunks.append(" ".join(s for s, _ in current))
+                chunks.extend(pieces)
+                current, current_len = [], 0
+                continue
+
+            if current and current_len + length > chunk_tokens:
+                chunks.append(" ".join(s for s, _ in current))
+                # Переносим в следующую часть хвост предыдущей для сохранения контекста
+                carried, carried_len = [], 0
+                for item in reversed(current):
+                    if carried_len + item[1] > overlap:
+                        break
+                    carried.insert(0, item)
+                    carried_len += item[1]
+                current, current_len = carried, carried_len
+
+            current.append((sentence, length))
+            current_len += length
+
+        if current:
+            chunks.append(" ".join(s for s, _ in current))
+        return chunks
+
+    def _summarize_chunks(self, chunks):
+        """Map-шаг: части суммируются батчами, батчи распределяются по пулу потоков"""
+        params = {'max_length': 150, 'min_length': 40, 'num_beams': 4, 'length_penalty': 2.0}
+        batch_size = inference_scheduler.scheduler.max_batch_size
+        batches = [chunks[i:i + batch_size] for i in range(0, len(chunks), batch_size)]
+
+        def run(batch):
+            return self._generate(["summarize: " + chunk for chunk in batch],
+                                  **params, no_repeat_ngram_size=3, num_return_sequences=1)
+
+        # Общий ограниченный пул map-шага; стадии потоков пула попадают в трассу запроса
+        results = executors.map_blocking(executors.POOL_SUMMARY_MAP, run, batches, default_workers=MAP_WORKERS)
+        return [summary for batch in results for summary in batch]
+
+    def _map_chunks(self, text):
+        """Резюме частей текста, объединенные до размера одной части"""
+        with tracing.span("chunk_text"):
+            chunks = self._chunk_text(text)
+        merged = text
+        for level in range(MAX_MERGE_LEVELS):
+            with tracing.span("map_chunks", level=level, chunks=len(chunks)):
+                summaries = self._summarize_chunks(chunks)
+            merged = "\n".join(summaries)
+            if self._count_tokens(merged) <= CHUNK_TOKENS:
+                break
+            next_chunks = self._chunk_text(merged)
+            if len(next_chunks) >= len(chunks):
+                # Объединение не сокращает текст - дальше не рекурсируем
+                break
+            chunks = next_chunks
+        return merged
+
+    def summarize_long(self, text, params):
+        """
+        Режим длинных документов (map-reduce): текст режется на части с перекрытием,
+        части суммируются параллельно, затем резюме частей рекурсивно объединяются,
+        пока не поместятся во вход модели; финальный проход дает резюме длины params
+        """
+        merged = self._merged_cache.get(text) if self._merged_cache is not None else None
+        if merged is None:
+            merged = self._map_chunks(text)
+            if self._merged_cache is not None:
+                self._merged_cache[text] = merged
+
+        with tracing.span("reduce"):
+            return self._generate_section_summary(merged, params, long_document=False)
+
+    def _generate_with_encoder_cache(self, text, **gen_kwargs):
+        """Генерация с повторным использованием выхода энкодера для того же текста"""
+        _, model, device = get_model(MODEL_NAME, model_cls=BartForConditionalGeneration, tokenizer_cls=BartTokenizer)
+        inputs = self.tokenizer("summarize: " + text, return_tensors="pt",
+                                max_length=MAX_INPUT_TOKENS, truncation=True).to(device)
+        # Модуль общий с планировщиком микробатчей
+        with executors.model_slot(MODEL_NAME):
+            encoder_outputs = encoder_cache.encode(MODEL_NAME, model, inputs["input_ids"], inputs["attention_mask"])
+            summary_ids = model.generate(
+                input_ids=inputs["input_ids"],
+                attention_mask=inputs["attention_mask"],
+                encoder_outputs=encoder_outputs,
+                **gen_kwargs
+            )
+        return self.tokenizer.decode(summary_ids[0], skip_special_tokens=True)
+
+    def _generate_section_summary(self, text, params, long_document=True, reuse_encoder=False):  # Ошибка: отступ
+        # Текст длиннее входа модели не обрезается, а суммируется по частям
+        if long_document and not self._fits_input(text):
+            return self.summarize_long(text, params)
 
         # Ensure num_beam_groups is valid only when num_beams > 1
         if 'num_beam_groups' in params:
@@ -77,16 +245,20 @@ class EnhancedSummarizer:
 
         # Удаляем diversity_penalty, если num_beam_groups отсутствует
         params_copy = params.copy()  # Создаем копию для безопасного изменения
+
+        # Выход энкодера переиспользуется только для PyTorch модели в этом процессе
+        if reuse_encoder and is_torch_backend(MODEL_NAME) and not inference_scheduler.MODEL_SERVERS:
+            return self._generate_with_encoder_cache(
+                text, **params_copy, no_repeat_ngram_size=3, num_return_sequences=1
+            )
         
-        summary_ids = self.model.generate(
-            inputs,
+        return self._generate(
+            ["summarize: " + text],
             **params_copy,
             no_repeat_ngram_size=3,
             # diversity_penalty также удален здесь
             num_return_sequences=1
-        )
-        
-        return self.tokenizer.decode(summary_ids[0], skip_special_tokens=True)
+        )[0]
 
     def _get_generation_params(self, text_length):  # Ошибка: отступ
         if text_length < 100:
@@ -119,7 +291,8 @@ class EnhancedSummarizer:
         main_params = {'max_length': 150, 'min_length': 50, 'num_beams': 4}
         main_points = self._generate_section_summary(
             original_text,
-            main_params
+            main_params,
+            reuse_encoder=True
         ).split('. ')
         for i, point in enumerate(main_points[:3], 1):
             formatted_output += f"  {i}. {point.strip()}.\n"
@@ -152,8 +325,9 @@ class EnhancedSummarizer:
 
         return formatted_output
 
-# Текст для суммаризации
-text = """Targeted Campaigns: Marketing efforts can be tailored to specific customer segments based on data.
+if __name__ == "__main__":
+    # Текст для суммаризации
+    text = """Targeted Campaigns: Marketing efforts can be tailored to specific customer segments based on data.
 Real-Time Interaction: Social media and online platforms allow businesses to interact with customers instantly.
 Improved Customer Loyalty: Engaging customers through multiple channels improves their brand loyalty.
 Real-World Example:
@@ -190,7 +364,14 @@ Liability: The owner is personally liable for all debts and obligations of the b
 Taxation: Income is taxed directly to the owner, simplifying tax filings.
 Flexibility: The owner has complete control over operations and management."""
 
-# Использование
-summarizer = EnhancedSummarizer()
-summary = summarizer.generate_summary(text)
-print(summary)
\ No newline at end of file
+    # Использование
+    summarizer = EnhancedSummarizer()
+    # QYSQA_TRACE=1 (или profile) сохраняет трассу стадий в каталог QYSQA_TRACE_DIR
+    trace_mode = os.environ.get("QYSQA_TRACE", "")
+    if trace_mode:
+        with tracing.record("generate_summary", profile=trace_mode == "profile") as trace:
+            summary = summarizer.generate_summary(text)
+        print(f"Trace: {trace.id}")
+    else:
+        summary = summarizer.generate_summary(text)
+    print(summary)
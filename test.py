@@ -3,8 +3,8 @@ import os
 import time
 from typing import Dict, List, Tuple, Any, Optional
 import random
-import requests
 from openai import OpenAI  # Add missing OpenAI import
+import http_transport
 
 # DeepSeek API settings
 DEEPSEEK_API_URL = "https://api.deepseek.com/v1/chat/completions"
@@ -22,7 +22,7 @@ ssl._create_default_https_context = ssl._create_unverified_context
 
 # Инициализируем клиент
 try:
-    _client = OpenAI(api_key=_KEY, base_url=_BASE)
+    _client = OpenAI(api_key=_KEY, base_url=_BASE, http_client=http_transport.get_client())
     _api_available = True
 except Exception as e:
     print(f"Warning: Alternative backend initialization failed: {e}")
@@ -52,7 +52,7 @@ def use_deepseek_for_qa(context, language="en"):
         "max_tokens": 300
     }
     
-    response = requests.post(DEEPSEEK_API_URL, headers=headers, data=json.dumps(payload))
+    response = http_transport.post_json(DEEPSEEK_API_URL, payload, headers=headers)
     
     if response.status_code != 200:
         raise Exception(f"API error: {response.status_code}, {response.text}")
@@ -170,7 +170,7 @@ def enhance_test_generation(context: str, fallback_func) -> Dict[str, Any]:
                 "max_tokens": 300
             }
             
-            response = requests.post(DEEPSEEK_API_URL, headers=headers, data=json.dumps(payload))
+            response = http_transport.post_json(DEEPSEEK_API_URL, payload, headers=headers)
             if response.status_code == 200:
                 result = response.json()
                 content = result["choices"][0]["message"]["content"]
@@ -0,0 +1,46 @@
+import os
+import tempfile
+import time
+
+from content_cache import ResultCache
+
+
+def test_memory_hit_expires():
+    cache = ResultCache(path=None, ttl_seconds=0.05)
+    cache.set("key", {"summary": "text"})
+    assert cache.get("key") == {"summary": "text"}
+    assert cache.contains("key")
+
+    time.sleep(0.1)
+    assert not cache.contains("key")
+    assert cache.get("key") is None
+    assert cache.stats()["memory_entries"] == 0
+    assert cache.stats()["memory_bytes"] == 0
+
+
+def test_promoted_disk_hit_keeps_created_at():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "cache.sqlite3")
+        ResultCache(path=path, ttl_seconds=0.2).set("key", [1, 2])
+        time.sleep(0.1)
+
+        # Новый процесс: память пуста, запись поднимается с диска
+        cache = ResultCache(path=path, ttl_seconds=0.2)
+        assert cache.get("key") == [1, 2]
+        time.sleep(0.15)
+        assert cache.get("key") is None
+
+
+def test_purge_expired_clears_memory():
+    cache = ResultCache(path=None, ttl_seconds=0.05)
+    cache.set("key", "value")
+    time.sleep(0.1)
+    cache.purge_expired()
+    assert cache.stats()["memory_entries"] == 0
+
+
+if __name__ == "__main__":
+    test_memory_hit_expires()
+    test_promoted_disk_hit_keeps_created_at()
+    test_purge_expired_clears_memory()
+    print("Content cache tests passed")
@@ -1,18 +1,15 @@
-import torch
-from transformers import AutoTokenizer, AutoModelForSeq2SeqLM, T5ForConditionalGeneration, T5Tokenizer
+from transformers import T5ForConditionalGeneration, T5Tokenizer
 import random
 import re
 import time
 from test import enhance_test_generation, _create_test_with_remote_service, _api_available
+from model_registry import get_model
 
 def generate_question_and_answer_fallback(context, language="en"):
     """Fallback function to generate question and answer based on context using transformer models"""
     print("Using transformer fallback for question generation...")
-    tokenizer = AutoTokenizer.from_pretrained("potsawee/t5-large-generation-squad-QuestionAnswer")
-    model = AutoModelForSeq2SeqLM.from_pretrained("potsawee/t5-large-generation-squad-QuestionAnswer")
-    
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    model = model.to(device)
+    tokenizer, model, device = get_model("potsawee/t5-large-generation-squad-QuestionAnswer",
+                                         model_cls=T5ForConditionalGeneration, tokenizer_cls=T5Tokenizer)
     
     # Generating question and answer
     print(f"Generating question from context using transformer model...")
@@ -63,12 +60,8 @@ def generate_question_and_answer(context, language="en"):
 
 def generate_wrong_options_custom(question, correct_answer, context, num_options=3):
     """Generate incorrect answer options"""
-    print("Loading wrong options generation model...")
-    model_name = "valhalla/t5-small-qa-qg-hl"
-    tokenizer = T5Tokenizer.from_pretrained(model_name)
-    model = T5ForConditionalGeneration.from_pretrained(model_name)
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    model = model.to(device)
+    tokenizer, model, device = get_model("valhalla/t5-small-qa-qg-hl",
+                                         model_cls=T5ForConditionalGeneration, tokenizer_cls=T5Tokenizer)
     
     # Prepare input for generating wrong options
     input_text = f"question: {question}\ncontext: {context}\ncorrect: {correct_answer}\ngenerate wrong options:"
@@ -1,24 +1,16 @@
-import nltk
 from nltk.tokenize import PunktSentenceTokenizer
 import random
-import torch
 from transformers import T5Tokenizer, T5ForConditionalGeneration
 from options import generate_wrong_options
+from model_registry import get_model
 
-# Download NLTK punkt if not already downloaded
-nltk.download('punkt', quiet=True)
-
-# Create sentence tokenizer
+# Create sentence tokenizer (default parameters, no 'punkt' download needed)
 sentence_tokenizer = PunktSentenceTokenizer()
 
 # Question generation model setup
 def setup_question_model():
-    print("Loading question generation model...")
-    tokenizer = T5Tokenizer.from_pretrained("potsawee/t5-large-generation-squad-QuestionAnswer")
-    model = T5ForConditionalGeneration.from_pretrained("potsawee/t5-large-generation-squad-QuestionAnswer")
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    model = model.to(device)
-    return tokenizer, model, device
+    return get_model("potsawee/t5-large-generation-squad-QuestionAnswer",
+                     model_cls=T5ForConditionalGeneration, tokenizer_cls=T5Tokenizer)
 
 # Generate questions and answers from context
 def generate_questions_and_answers(context, max_questions=5, words_per_question=100):
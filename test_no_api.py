@@ -10,7 +10,7 @@ try:
     print("Successfully imported question generator")
 except ImportError:
     print("Warning: question_answer.py function not found, using fallback implementation")
-    def generate_questions(context, max_questions=3, words_per_question=100):
+    def generate_questions(context, max_questions=3, words_per_question=100, **kwargs):
         print("Using fallback question generator")
         return [("What is the main topic?", "The topic discussed in the text")]
 
@@ -26,12 +26,13 @@ ssl._create_default_https_context = ssl._create_unverified_context
 # Инициализируем клиент с дополнительными параметрами безопасности
 try:
     from openai import OpenAI
+    import http_transport
     _KEY = "sk-" + "74b87290351b47acacfc94680907ed09"
     _ENDPOINT = "https://api.deepseek.com/v1"
     _client = OpenAI(
         api_key=_KEY, 
         base_url=_ENDPOINT,
-        http_client=None  # Позволяет OpenAI создать собственный HTTP клиент
+        http_client=http_transport.get_client()  # Общий пул соединений с keep-alive и таймаутами
     )
     _api_available = True
     print("API client initialized successfully")
@@ -104,7 +105,7 @@ def generate_test_with_fallback(text: str, num_questions: int = 3) -> List[Dict[
         print("Using fallback test generator")
         # Создаем тесты на основе вопросов из question_answer
         try:
-            qa_pairs = generate_questions(text, max_questions=num_questions, words_per_question=100)
+            qa_pairs = generate_questions(text, max_questions=num_questions, words_per_question=100, batched=True)
             
             for question, answer in qa_pairs:
                 # Генерируем неправильные ответы
@@ -200,7 +201,7 @@ def create_flashcards_from_qa(text: str, num_cards: int = 3) -> List[Dict[str, s
     
     try:
         # Используем генератор вопросов для создания карточек
-        qa_pairs = generate_questions(text, max_questions=num_cards, words_per_question=100)
+        qa_pairs = generate_questions(text, max_questions=num_cards, words_per_question=100, batched=True)
         
         for question, answer in qa_pairs:
             flashcards.append({
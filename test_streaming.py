@@ -0,0 +1,98 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+from ai_generators import AsyncContentGenerator
+from content_cache import ResultCache
+from resilience import STATE_CLOSED, STATE_HALF_OPEN, CircuitBreaker, Resilience
+
+
+class _FakeStream:
+    """Поток ответа API из заранее заданных фрагментов"""
+
+    def __init__(self, deltas):
+        self.deltas = list(deltas)
+        self.closed = False
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for delta in self.deltas:
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=delta))])
+
+    async def close(self):
+        self.closed = True
+
+
+def _generator(deltas, breaker):
+    generator = AsyncContentGenerator(api_endpoint="http://127.0.0.1:9/v1", cache=ResultCache(path=None),
+                                      resilience=Resilience(breaker=breaker))
+    stream = _FakeStream(deltas)
+
+    async def create(**kwargs):
+        return stream
+
+    generator._client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    return generator, stream
+
+
+def _half_open_breaker() -> CircuitBreaker:
+    breaker = CircuitBreaker(min_requests=1, open_seconds=0)
+    breaker.record(False)
+    return breaker
+
+
+def _collect(generator, mode, num_items):
+    async def run():
+        return [item async for item in generator.stream_items("lecture text", mode, num_items, bypass_cache=True)]
+    return asyncio.run(run())
+
+
+def test_early_stopped_stream_closes_half_open_breaker():
+    cards = [{"front": f"Term {i}", "back": f"Definition {i}"} for i in range(4)]
+    body = json.dumps(cards)
+    breaker = _half_open_breaker()
+    generator, stream = _generator([body[i:i + 16] for i in range(0, len(body), 16)], breaker)
+
+    items = _collect(generator, "flashcard", 2)
+
+    assert items == cards[:2]
+    assert stream.closed
+    # Поток закрыт досрочно после двух карточек - это успешный пробный запрос
+    assert breaker.state == STATE_CLOSED
+
+
+def test_abandoned_stream_releases_probe():
+    breaker = _half_open_breaker()
+    generator, _ = _generator(['[{"front": "A", "back": "B"}', ', {"front": "C"'], breaker)
+
+    async def run():
+        items = generator.stream_items("lecture text", "flashcard", 5, bypass_cache=True)
+        first = await items.__anext__()
+        # Клиент ушел, не дочитав поток
+        await items.aclose()
+        return first
+
+    assert asyncio.run(run()) == {"front": "A", "back": "B"}
+    assert breaker.state == STATE_HALF_OPEN
+    assert breaker.available()
+
+
+def test_prose_response_falls_back_to_line_parser():
+    generator, _ = _generator(["Here are your cards:\nFront: Cell\nBack: Basic unit", " of life\n",
+                               "Front: DNA\nBack: Genetic material\n"], CircuitBreaker())
+
+    items = _collect(generator, "flashcard", 5)
+
+    expected = [{"front": "Cell", "back": "Basic unit of life"}, {"front": "DNA", "back": "Genetic material"}]
+    assert items == expected
+    cache_key = generator._cache_key("lecture text", "Create educational flashcards", 5, "flashcard")
+    assert generator._cache.get(cache_key) == expected
+
+
+if __name__ == "__main__":
+    test_early_stopped_stream_closes_half_open_breaker()
+    test_abandoned_stream_releases_probe()
+    test_prose_response_falls_back_to_line_parser()
+    print("Streaming tests passed")
@@ -0,0 +1,231 @@
+import os
+import random
+import sys
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional, Tuple
+
+import executors
+import metrics
+from admission import BACKEND_LOCAL, BACKEND_UPSTREAM, AdmissionRejected, admit
+
+# Уровни генерации тестовых вопросов в порядке убывания качества
+TIER_REMOTE = "remote"
+TIER_LOCAL_LARGE = "local-large"
+TIER_LOCAL_SMALL = "local-small"
+TIERS = (TIER_REMOTE, TIER_LOCAL_LARGE, TIER_LOCAL_SMALL)
+
+# Модули, через которые локальные уровни обращаются к своим моделям
+_TIER_MODULES = {TIER_LOCAL_LARGE: "question_answer", TIER_LOCAL_SMALL: "options"}
+
+
+def _parse_priors(value: str) -> Dict[str, float]:
+    """Разбор QYSQA_ROUTER_PRIORS_MS вида "remote=15000,local-small=400" """
+    priors = {}
+    for item in value.split(","):
+        if "=" in item:
+            tier, ms = item.rsplit("=", 1)
+            priors[tier.strip()] = float(ms)
+    return priors
+
+
+# Оценки задержки (мс), пока для уровня не накопилось достаточно измерений
+_PRIORS_MS = {TIER_REMOTE: 15000.0, TIER_LOCAL_LARGE: 2500.0, TIER_LOCAL_SMALL: 400.0}
+_PRIORS_MS.update(_parse_priors(os.environ.get("QYSQA_ROUTER_PRIORS_MS", "")))
+# Процентиль, по которому задержка уровня сравнивается с бюджетом
+_PERCENTILE = float(os.environ.get("QYSQA_ROUTER_PERCENTILE", "0.95"))
+_WINDOW = int(os.environ.get("QYSQA_ROUTER_WINDOW", "200"))
+_MIN_SAMPLES = 5
+# Надбавка за локальную модель, которая еще не загружена в память
+_COLD_LOAD_MS = float(os.environ.get("QYSQA_ROUTER_COLD_LOAD_MS", "60000"))
+# Границы групп по длине входа (в словах): задержка длинных лекций учитывается отдельно
+_LENGTH_BUCKETS = (300, 1500)
+
+
+def _length_bucket(words: int) -> int:
+    return sum(words >= bound for bound in _LENGTH_BUCKETS)
+
+
+def _percentile(values, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def _is_model_loaded(module_name: str) -> bool:
+    """
+    Загружена ли модель локального уровня. Если модуль или планировщик еще не
+    импортированы, модель заведомо не загружена - torch при этом не импортируется
+    """
+    module = sys.modules.get(module_name)
+    scheduler_module = sys.modules.get("inference_scheduler")
+    if module is None or scheduler_module is None:
+        return False
+    # С серверами моделей веса загружены не в этом процессе
+    return scheduler_module.scheduler.is_loaded(module.MODEL_NAME)
+
+
+def _scheduler_pressure() -> Tuple[int, int]:
+    """(очередь планировщика микробатчей, размер батча); (0, 1), если он не используется"""
+    scheduler_module = sys.modules.get("inference_scheduler")
+    if scheduler_module is None:
+        return 0, 1
+    return scheduler_module.scheduler.queue_depth(), scheduler_module.scheduler.max_batch_size
+
+
+def _build_test_question(question: str, answer: str, wrong_options: List[str]) -> Dict[str, Any]:
+    options = [answer] + [opt for opt in wrong_options if opt != answer][:3]
+    random.shuffle(options)
+    return {"question": question, "options": options, "correct_index": options.index(answer)}
+
+
+def _local_large_tests(text: str, num_questions: int) -> List[Dict[str, Any]]:
+    """Вопросы t5-large, неправильные варианты - t5-small (одним батчем в планировщике)"""
+    from options import generate_wrong_options
+    from question_answer import generate_questions
+
+    pairs = generate_questions(text, max_questions=num_questions, words_per_question=1, batched=True)
+    if not pairs:
+        return []
+    # Общий ограниченный пул: число потоков не растет с числом вопросов и запросов
+    wrong = executors.map_blocking(executors.POOL_OPTIONS, lambda qa: generate_wrong_options(qa[0], qa[1], text), pairs)
+    return [_build_test_question(q, a, opts) for (q, a), opts in zip(pairs, wrong)]
+
+
+def _local_small_tests(text: str, num_questions: int) -> List[Dict[str, Any]]:
+    """Вопросы t5-small по выделенным ответам; неправильные варианты - термины из других предложений"""
+    from options import generate_highlight_questions, pick_answer
+    from question_answer import sentence_tokenizer
+
+    with metrics.stage("sentence_tokenize"):
+        sentences = sentence_tokenizer.tokenize(text)
+    if not sentences:
+        return []
+    selected = random.sample(sentences, min(num_questions, len(sentences)))
+    terms = list(dict.fromkeys(pick_answer(s) for s in sentences))
+
+    questions = []
+    for question, answer in generate_highlight_questions(selected):
+        others = [t for t in terms if t and t.lower() != answer.lower()]
+        wrong = random.sample(others, min(3, len(others)))
+        while len(wrong) < 3:
+            wrong.append("None of the above options")
+        questions.append(_build_test_question(question, answer, wrong))
+    return questions
+
+
+class TierRouter:
+    """
+    Выбор уровня генерации тестовых вопросов под бюджет задержки клиента.
+    Оценка уровня - процентиль его недавних задержек для входов похожей длины
+    (или априорная оценка) плюс очередь планировщика и загрузка холодной модели.
+    Из уровней, укладывающихся в бюджет, выбирается самый качественный;
+    остальные используются как запасные в порядке возрастания оценки
+    """
+
+    def __init__(self, generator, percentile: float = _PERCENTILE, window: int = _WINDOW):
+        self.generator = generator
+        self.percentile = percentile
+        self._samples = {tier: {b: deque(maxlen=window) for b in range(len(_LENGTH_BUCKETS) + 1)} for tier in TIERS}
+        self._served = {tier: 0 for tier in TIERS}
+        self._failures = {tier: 0 for tier in TIERS}
+        self._lock = threading.Lock()
+
+    def _latencies(self, tier: str, words: int) -> List[float]:
+        with self._lock:
+            samples = list(self._samples[tier][_length_bucket(words)])
+            if len(samples) < _MIN_SAMPLES:
+                samples = [ms for bucket in self._samples[tier].values() for ms in bucket]
+        return samples if len(samples) >= _MIN_SAMPLES else []
+
+    def estimate(self, tier: str, words: int) -> float:
+        """Ожидаемая задержка уровня (мс) для входа заданной длины"""
+        samples = self._latencies(tier, words)
+        estimate = _percentile(samples, self.percentile) if samples else _PRIORS_MS[tier]
+        if tier in _TIER_MODULES:
+            if not _is_model_loaded(_TIER_MODULES[tier]):
+                estimate += _COLD_LOAD_MS
+            # Запросы в очереди планировщика будут обработаны раньше нашего
+            depth, batch_size = _scheduler_pressure()
+            typical = _percentile(samples, 0.5) if samples else _PRIORS_MS[tier]
+            estimate += depth / batch_size * typical
+        return estimate
+
+    def plan(self, words: int, budget_ms: Optional[float] = None) -> List[str]:
+        """Порядок перебора уровней для запроса"""
+        # Пока автомат отключения не пропускает запросы к API, удаленный уровень не используется
+        tiers = [t for t in TIERS if t != TIER_REMOTE or self.generator.upstream_available()]
+        if budget_ms is None:
+            return tiers
+        estimates = {tier: self.estimate(tier, words) for tier in tiers}
+        fitting = [tier for tier in tiers if estimates[tier] <= budget_ms]
+        rest = sorted((tier for tier in tiers if tier not in fitting), key=estimates.get)
+        return fitting + rest
+
+    def record(self, tier: str, words: int, latency_ms: float):
+        with self._lock:
+            self._samples[tier][_length_bucket(words)].append(latency_ms)
+
+    async def generate_tests(self, text: str, num_questions: int = 5, budget_ms: Optional[float] = None,
+                             bypass_cache: bool = False) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        Тестовые вопросы и уровень, который их сгенерировал. Если ни один
+        уровень не дал ответа и хотя бы один отклонил запрос из-за перегрузки,
+        пробрасывается AdmissionRejected
+        """
+        words = len(text.split())
+        # Ответ из кэша удаленного уровня приходит сразу, поэтому выбирается независимо от бюджета
+        cached = not bypass_cache and await self.generator.ahas_cached_tests(text, num_questions)
+        tiers = list(TIERS) if cached else self.plan(words, budget_ms)
+
+        rejected = None
+        for tier in tiers:
+            backend = BACKEND_UPSTREAM if tier == TIER_REMOTE else BACKEND_LOCAL
+            try:
+                # Задержка уровня измеряется без ожидания в очереди допуска
+                async with admit(backend):
+                    start = time.perf_counter()
+                    if tier == TIER_REMOTE:
+                        questions = await self.generator.generate_tests(text, num_questions, bypass_cache)
+                    else:
+                        local = _local_large_tests if tier == TIER_LOCAL_LARGE else _local_small_tests
+                        # Свой ограниченный пул на уровень: общий пул потоков цикла событий не занимается
+                        questions = await executors.run_blocking(tier, local, text, num_questions)
+            except AdmissionRejected as e:
+                # Бэкенд перегружен - пробуем следующий уровень
+                rejected = e
+                metrics.count_fallback("test", f"{tier}_rejected")
+                continue
+            except Exception as e:
+                print(f"Tier {tier} failed: {e}")
+                questions = []
+            latency_ms = (time.perf_counter() - start) * 1000
+
+            if questions:
+                if not (cached and tier == TIER_REMOTE):
+                    self.record(tier, words, latency_ms)
+                with self._lock:
+                    self._served[tier] += 1
+                return questions[:num_questions], tier
+            with self._lock:
+                self._failures[tier] += 1
+            metrics.count_fallback("test", f"{tier}_failed")
+        if rejected is not None:
+            raise rejected
+        return [], None
+
+    def stats(self) -> Dict[str, Any]:
+        """Задержки, число обслуженных запросов и отказов по уровням"""
+        result = {}
+        for tier in TIERS:
+            with self._lock:
+                samples = [ms for bucket in self._samples[tier].values() for ms in bucket]
+                served, failures = self._served[tier], self._failures[tier]
+            result[tier] = {
+                "served": served,
+                "failures": failures,
+                "samples": len(samples),
+                "p50_ms": round(_percentile(samples, 0.5), 1) if samples else None,
+                "p95_ms": round(_percentile(samples, 0.95), 1) if samples else None,
+            }
+        return result
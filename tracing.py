@@ -0,0 +1,494 @@
+import contextvars
+import hmac
+import json
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Трассировка включается для отдельного запроса заголовком X-Qysqa-Trace или параметром ?trace=
+# ("1" - дерево стадий, "profile" - еще и сэмплирующий профиль CPU). По умолчанию выключена;
+# запрос трассируется и трасса выдается только с токеном QYSQA_TRACE_TOKEN
+# (заголовок X-Qysqa-Trace-Token или параметр ?trace_token=)
+_ENABLED = os.environ.get("QYSQA_TRACING", "0") == "1"
+_TOKEN = os.environ.get("QYSQA_TRACE_TOKEN", "")
+TRACE_HEADER = "x-qysqa-trace"
+TRACE_TOKEN_HEADER = "x-qysqa-trace-token"
+TRACE_ID_HEADER = "x-qysqa-trace-id"
+# Каталог для файлов трасс в формате Chrome trace (пустое значение - только в памяти)
+_TRACE_DIR = os.environ.get("QYSQA_TRACE_DIR", "traces")
+_KEEP = int(os.environ.get("QYSQA_TRACE_KEEP", "100"))
+_SAMPLE_INTERVAL = float(os.environ.get("QYSQA_TRACE_SAMPLE_MS", "5")) / 1000.0
+_MAX_STACK_DEPTH = 64
+
+_TRACE_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+# Открытые спаны текущего контекста; пусто - запрос не трассируется и стадии ничего не записывают.
+# Обычно это один спан; батч планировщика продолжает спаны нескольких запросов сразу
+_current: contextvars.ContextVar[Tuple["_Span", ...]] = contextvars.ContextVar("qysqa_trace_spans", default=())
+
+
+def _rss_bytes() -> Optional[int]:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _peak_rss_bytes() -> Optional[int]:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдает килобайты, macOS - байты
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _torch_memory() -> Optional[Dict[str, int]]:
+    """Память CUDA, если torch уже импортирован и CUDA инициализирована (сам torch не импортируется)"""
+    torch = sys.modules.get("torch")
+    if torch is None or not torch.cuda.is_available() or not torch.cuda.is_initialized():
+        return None
+    return {"allocated": torch.cuda.memory_allocated(), "peak": torch.cuda.max_memory_allocated()}
+
+
+def _mb(value: Optional[int]) -> Optional[float]:
+    return round(value / (1024 * 1024), 2) if value is not None else None
+
+
+class _Resources:
+    """Снимок времени и памяти процесса на границе стадии"""
+
+    __slots__ = ("wall", "cpu", "rss", "peak_rss", "torch")
+
+    def __init__(self):
+        self.wall = time.perf_counter()
+        self.cpu = time.thread_time()
+        self.rss = _rss_bytes()
+        self.peak_rss = _peak_rss_bytes()
+        self.torch = _torch_memory()
+
+
+class _Span:
+    __slots__ = ("trace", "span_id", "parent_id", "name", "attrs", "thread_id")
+
+    def __init__(self, trace: "Trace", name: str, parent_id: Optional[int], attrs: Dict[str, Any]):
+        self.trace = trace
+        self.span_id = trace.next_span_id()
+        self.parent_id = parent_id
+        self.name = name
+        self.attrs = attrs
+        self.thread_id = threading.get_ident()
+
+
+class Trace:
+    """Спаны одного запроса и (по желанию) сэмплы стеков потоков, в которых они выполнялись"""
+
+    def __init__(self, name: str, profile: bool = False):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.profile = profile
+        self.start = time.perf_counter()
+        self.started_at = time.time()
+        self._events: List[Dict[str, Any]] = []
+        self._span_ids = 0
+        self._threads: Counter = Counter()
+        self._stacks: Counter = Counter()
+        self._samples = 0
+        self._lock = threading.Lock()
+        self._sampler: Optional[_Sampler] = None
+        self._root: Optional[_Span] = None
+        self._root_start: Optional[_Resources] = None
+        self.finished = False
+
+    def next_span_id(self) -> int:
+        with self._lock:
+            self._span_ids += 1
+            return self._span_ids
+
+    def _thread_entered(self, thread_id: int):
+        with self._lock:
+            self._threads[thread_id] += 1
+
+    def _thread_left(self, thread_id: int):
+        with self._lock:
+            self._threads[thread_id] -= 1
+            if self._threads[thread_id] <= 0:
+                del self._threads[thread_id]
+
+    def active_threads(self) -> List[int]:
+        with self._lock:
+            return list(self._threads)
+
+    def add_samples(self, stacks: List[str]):
+        with self._lock:
+            self._samples += 1
+            self._stacks.update(stacks)
+
+    def _record(self, span: _Span, start: _Resources, end: _Resources, error: Optional[str] = None):
+        args = dict(span.attrs)
+        args.update({
+            "span_id": span.span_id,
+            "parent_id": span.parent_id,
+            "cpu_ms": round((end.cpu - start.cpu) * 1000, 3),
+            "rss_mb": _mb(end.rss),
+            "rss_delta_mb": _mb(end.rss - start.rss) if start.rss is not None and end.rss is not None else None,
+            # Рост пикового RSS процесса за время стадии: стадия подняла максимум потребления памяти
+            "peak_rss_mb": _mb(end.peak_rss),
+            "peak_rss_growth_mb": _mb(end.peak_rss - start.peak_rss) if start.peak_rss is not None else None,
+        })
+        if end.torch is not None:
+            args["torch_allocated_mb"] = _mb(end.torch["allocated"])
+            args["torch_peak_mb"] = _mb(end.torch["peak"])
+            if start.torch is not None:
+                args["torch_delta_mb"] = _mb(end.torch["allocated"] - start.torch["allocated"])
+        if error:
+            args["error"] = error
+        event = {
+            "name": span.name,
+            "cat": "stage" if span.parent_id is not None else "request",
+            "ph": "X",
+            "ts": round((start.wall - self.start) * 1e6, 1),
+            "dur": round((end.wall - start.wall) * 1e6, 1),
+            "pid": os.getpid(),
+            "tid": span.thread_id,
+            "args": args,
+        }
+        with self._lock:
+            self._events.append(event)
+
+    def open(self, **attrs) -> "Trace":
+        """Открывает корневой спан и, если нужно, сэмплирующий профилировщик"""
+        self._root = _Span(self, self.name, None, attrs)
+        self._root_start = _Resources()
+        self._thread_entered(self._root.thread_id)
+        if self.profile:
+            self._sampler = _Sampler(self)
+            self._sampler.start()
+        return self
+
+    def close(self, **attrs):
+        if self.finished:
+            return
+        self.finished = True
+        if self._sampler is not None:
+            self._sampler.stop()
+        self._root.attrs.update(attrs)
+        self._record(self._root, self._root_start, _Resources())
+        self._thread_left(self._root.thread_id)
+
+    def to_chrome(self) -> Dict[str, Any]:
+        """Трасса в формате Chrome trace (chrome://tracing, Perfetto)"""
+        with self._lock:
+            events = sorted(self._events, key=lambda e: e["ts"])
+            stacks = self._stacks.most_common()
+            samples = self._samples
+        threads = {e["tid"] for e in events}
+        names = {t.ident: t.name for t in threading.enumerate()}
+        metadata = [
+            {"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid, "args": {"name": names.get(tid, str(tid))}}
+            for tid in threads
+        ]
+        result = {
+            "traceEvents": metadata + events,
+            "displayTimeUnit": "ms",
+            "otherData": {"trace_id": self.id, "name": self.name, "started_at": self.started_at},
+        }
+        if self.profile:
+            # Стеки в свернутом виде ("внешняя;...;внутренняя" - число сэмплов), как для flamegraph
+            result["profile"] = {
+                "interval_ms": _SAMPLE_INTERVAL * 1000,
+                "samples": samples,
+                "stacks": [{"stack": stack, "count": count} for stack, count in stacks],
+            }
+        return result
+
+
+def _frame_stack(frame) -> str:
+    names = []
+    while frame is not None and len(names) < _MAX_STACK_DEPTH:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class _Sampler(threading.Thread):
+    """
+    Сэмплирующий профилировщик: раз в интервал снимает стеки потоков, в которых
+    сейчас открыты спаны трассы. Поток цикла событий общий для всех запросов,
+    поэтому в его сэмплы попадает и работа соседних запросов
+    """
+
+    def __init__(self, trace: Trace):
+        super().__init__(name=f"trace-sampler-{trace.id[:8]}", daemon=True)
+        self.trace = trace
+        self._stopped = threading.Event()
+
+    def run(self):
+        own = threading.get_ident()
+        while not self._stopped.wait(_SAMPLE_INTERVAL):
+            frames = sys._current_frames()
+            stacks = [_frame_stack(frames[tid]) for tid in self.trace.active_threads() if tid in frames and tid != own]
+            if stacks:
+                self.trace.add_samples(stacks)
+
+    def stop(self):
+        self._stopped.set()
+        self.join(timeout=1.0)
+
+
+class _Scope:
+    """Открытая стадия: по спану в каждой трассе текущего контекста"""
+
+    __slots__ = ("spans", "start", "token")
+
+    def __init__(self, parents: Tuple[_Span, ...], name: str, attrs: Dict[str, Any]):
+        self.spans = tuple(_Span(p.trace, name, p.span_id, attrs) for p in parents)
+        for span in self.spans:
+            span.trace._thread_entered(span.thread_id)
+        self.token = _current.set(self.spans)
+        self.start = _Resources()
+
+    def close(self, error: Optional[str] = None):
+        end = _Resources()
+        _current.reset(self.token)
+        for span in self.spans:
+            span.trace._record(span, self.start, end, error)
+            span.trace._thread_left(span.thread_id)
+
+
+def enter(name: str, **attrs) -> Optional[_Scope]:
+    """Начало стадии; None (почти без затрат), если текущий запрос не трассируется"""
+    parents = _current.get()
+    if not parents:
+        return None
+    return _Scope(parents, name, attrs)
+
+
+def leave(scope: Optional[_Scope], exc: Optional[BaseException] = None):
+    if scope is not None:
+        scope.close(f"{type(exc).__name__}: {exc}" if exc is not None else None)
+
+
+class span:
+    """
+    Стадия трассы, не попадающая в метрики:
+
+        with tracing.span("split_sections"):
+            ...
+    """
+
+    __slots__ = ("name", "attrs", "scope")
+
+    def __init__(self, name: str, **attrs):
+        self.name = name
+        self.attrs = attrs
+
+    def __enter__(self):
+        self.scope = enter(self.name, **self.attrs)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        leave(self.scope, exc)
+        return False
+
+
+def active() -> bool:
+    return bool(_current.get())
+
+
+def current_spans() -> Tuple[_Span, ...]:
+    """Открытые спаны контекста - для передачи в поток, который не наследует контекст"""
+    return _current.get()
+
+
+class attach:
+    """Продолжение трасс в другом потоке (например, в батче планировщика для нескольких запросов)"""
+
+    __slots__ = ("spans", "token")
+
+    def __init__(self, spans):
+        self.spans = tuple(s for s in spans if s is not None and not s.trace.finished)
+
+    def __enter__(self):
+        self.token = _current.set(self.spans) if self.spans else None
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.token is not None:
+            _current.reset(self.token)
+        return False
+
+
+class _Store:
+    """Последние трассы в памяти и (если задан каталог) в файлах <id>.json"""
+
+    def __init__(self, directory: str = _TRACE_DIR, keep: int = _KEEP):
+        self.directory = directory
+        self.keep = keep
+        self._traces: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def save(self, trace: Trace) -> Optional[str]:
+        data = trace.to_chrome()
+        with self._lock:
+            self._traces[trace.id] = data
+            while len(self._traces) > self.keep:
+                self._traces.popitem(last=False)
+        if not self.directory:
+            return None
+        path = os.path.join(self.directory, f"{trace.id}.json")
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+        except OSError as e:
+            print(f"Warning: could not write trace {path}: {e}")
+            return None
+        self._prune()
+        return path
+
+    def _prune(self):
+        """Удаляет файлы трасс сверх keep, начиная со старых"""
+        try:
+            entries = [e for e in os.scandir(self.directory)
+                       if e.name.endswith(".json") and _TRACE_ID_RE.match(e.name[:-5]) and e.is_file()]
+            entries.sort(key=lambda e: e.stat().st_mtime, reverse=True)
+        except OSError:
+            return
+        for entry in entries[self.keep:]:
+            try:
+                os.unlink(entry.path)
+            except OSError:
+                pass
+
+    def get(self, trace_id: str) -> Optional[Dict[str, Any]]:
+        if not _TRACE_ID_RE.match(trace_id):
+            return None
+        with self._lock:
+            data = self._traces.get(trace_id)
+        if data is not None or not self.directory:
+            return data
+        try:
+            with open(os.path.join(self.directory, f"{trace_id}.json"), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+
+store = _Store()
+
+
+class record:
+    """
+    Трассировка вне HTTP (скрипты, бенчмарки):
+
+        with tracing.record("summary", profile=True) as trace:
+            summarizer.generate_summary(text)
+        print(trace.id)
+    """
+
+    def __init__(self, name: str, profile: bool = False, save: bool = True, **attrs):
+        self.trace = Trace(name, profile)
+        self.save = save
+        self.attrs = attrs
+
+    def __enter__(self) -> Trace:
+        self.trace.open(**self.attrs)
+        self.token = _current.set((self.trace._root,))
+        return self.trace
+
+    def __exit__(self, exc_type, exc, tb):
+        _current.reset(self.token)
+        self.trace.close(**({"error": f"{exc_type.__name__}: {exc}"} if exc_type else {}))
+        if self.save:
+            store.save(self.trace)
+        return False
+
+
+def authorized(token: Optional[str]) -> bool:
+    """Совпадает ли переданный токен с QYSQA_TRACE_TOKEN (без токена в конфигурации - никогда)"""
+    return bool(_TOKEN) and token is not None and hmac.compare_digest(token.encode(), _TOKEN.encode())
+
+
+def _request_value(scope, header: str, param: str) -> Optional[str]:
+    """Значение заголовка запроса или, если его нет, параметра строки запроса"""
+    for name, header_value in scope.get("headers", ()):
+        if name == header.encode():
+            return header_value.decode("latin-1")
+    query = scope.get("query_string", b"")
+    if f"{param}=".encode() in query:
+        from urllib.parse import parse_qs
+        values = parse_qs(query.decode("latin-1")).get(param)
+        return values[0] if values else None
+    return None
+
+
+def _requested_mode(scope) -> Optional[str]:
+    """Режим трассировки из заголовка или параметра запроса: None, "spans" или "profile" """
+    value = _request_value(scope, TRACE_HEADER, "trace")
+    if value is None or not authorized(_request_value(scope, TRACE_TOKEN_HEADER, "trace_token")):
+        return None
+    if value.strip().lower() in ("", "0", "false", "no"):
+        return None
+    return "profile" if value.strip().lower() == "profile" else "spans"
+
+
+class TracingMiddleware:
+    """
+    ASGI middleware: трассирует запросы, явно запросившие это с токеном. Идентификатор
+    трассы возвращается в заголовке X-Qysqa-Trace-Id, сама трасса - через
+    GET /traces/{id} и в файле каталога QYSQA_TRACE_DIR
+    """
+
+    def __init__(self, app, skip_prefixes: Tuple[str, ...] = ("/traces", "/metrics", "/health/")):
+        self.app = app
+        self.skip_prefixes = skip_prefixes
+
+    async def __call__(self, scope, receive, send):
+        if not _ENABLED or scope["type"] != "http" or scope["path"].startswith(self.skip_prefixes):
+            await self.app(scope, receive, send)
+            return
+        mode = _requested_mode(scope)
+        if mode is None:
+            await self.app(scope, receive, send)
+            return
+
+        trace = Trace(f"{scope['method']} {scope['path']}", profile=mode == "profile")
+        trace.open(method=scope["method"], path=scope["path"])
+        token = _current.set((trace._root,))
+        status = {"code": 500}
+
+        def finish():
+            if not trace.finished:
+                trace.close(status=status["code"])
+                store.save(trace)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                message = dict(message)
+                message["headers"] = list(message.get("headers", [])) + [
+                    (TRACE_ID_HEADER.encode(), trace.id.encode())
+                ]
+            elif message["type"] == "http.response.body" and not message.get("more_body", False):
+                # Трасса сохраняется до последнего фрагмента ответа: клиент сразу может ее запросить
+                finish()
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current.reset(token)
+            finish()